@@ -6,6 +6,8 @@ load_dotenv()
 class Config:
     STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY") or ""
     STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET") or ""
+    STRIPE_WEBHOOK_SECRETS = [s.strip() for s in STRIPE_WEBHOOK_SECRET.split(",") if s.strip()]
+    STRIPE_WEBHOOK_TOLERANCE_SECONDS = int(os.getenv("STRIPE_WEBHOOK_TOLERANCE_SECONDS") or "300")
     DOMAIN = os.getenv("DOMAIN") or "http://localhost:4242"
     API_VERSION = os.getenv("API_VERSION") or "v1.0.0"
     DOCS_PUBLIC = ((os.getenv("DOCS_PUBLIC") or "1").lower() not in ("0", "false", "no"))
@@ -26,7 +28,59 @@ class Config:
     ADMIN_EMAILS = os.getenv("ADMIN_EMAILS") or ""
     WEBHOOK_SYNC_ENABLED = ((os.getenv("WEBHOOK_SYNC_ENABLED") or "0").lower() in ("1", "true", "yes"))
     WEBHOOK_SYNC_INTERVAL_MINUTES = int(os.getenv("WEBHOOK_SYNC_INTERVAL_MINUTES") or "15")
+    WEBHOOK_SYNC_MIN_INTERVAL_MINUTES = int(os.getenv("WEBHOOK_SYNC_MIN_INTERVAL_MINUTES") or "5")
+    WEBHOOK_SYNC_MAX_INTERVAL_MINUTES = int(os.getenv("WEBHOOK_SYNC_MAX_INTERVAL_MINUTES") or "240")
     WEBHOOK_SYNC_LOOKBACK_MINUTES = int(os.getenv("WEBHOOK_SYNC_LOOKBACK_MINUTES") or "120")
+    WEBHOOK_SYNC_OVERLAP_SECONDS = int(os.getenv("WEBHOOK_SYNC_OVERLAP_SECONDS") or "300")
+    WEBHOOK_SYNC_CONCURRENCY = int(os.getenv("WEBHOOK_SYNC_CONCURRENCY") or "4")
+    WEBHOOK_SYNC_STRIPE_RPS = float(os.getenv("WEBHOOK_SYNC_STRIPE_RPS") or "20")
+    WEBHOOK_SYNC_STALE_MINUTES = int(os.getenv("WEBHOOK_SYNC_STALE_MINUTES") or "30")
+    WORKER_LEASE_TTL_SECONDS = int(os.getenv("WORKER_LEASE_TTL_SECONDS") or "60")
+    WEBHOOK_SPOOL_ENABLED = (os.getenv("WEBHOOK_SPOOL_ENABLED") or "0").lower() in ("1", "true", "yes")
+    WEBHOOK_SPOOL_DIR = os.getenv("WEBHOOK_SPOOL_DIR") or "webhook_spool"
+    WEBHOOK_SPOOL_SEGMENT_BYTES = int(os.getenv("WEBHOOK_SPOOL_SEGMENT_BYTES") or "8388608")
+    WEBHOOK_SPOOL_SEGMENT_SECONDS = int(os.getenv("WEBHOOK_SPOOL_SEGMENT_SECONDS") or "60")
+    WEBHOOK_SPOOL_FSYNC = (os.getenv("WEBHOOK_SPOOL_FSYNC") or "always").lower()
+    WEBHOOK_SPOOL_FSYNC_INTERVAL_SECONDS = int(os.getenv("WEBHOOK_SPOOL_FSYNC_INTERVAL_SECONDS") or "1")
+    WEBHOOK_SPOOL_POLL_SECONDS = int(os.getenv("WEBHOOK_SPOOL_POLL_SECONDS") or "1")
+    WEBHOOK_PAYLOAD_CODEC = (os.getenv("WEBHOOK_PAYLOAD_CODEC") or "zlib").lower()
+    WEBHOOK_PAYLOAD_ZLIB_LEVEL = int(os.getenv("WEBHOOK_PAYLOAD_ZLIB_LEVEL") or "6")
+    REPLAY_CONCURRENCY = int(os.getenv("REPLAY_CONCURRENCY") or "4")
+    REPLAY_RATE_PER_STORE = float(os.getenv("REPLAY_RATE_PER_STORE") or "5")
+    REPLAY_BATCH_SIZE = int(os.getenv("REPLAY_BATCH_SIZE") or "200")
+    REPLAY_STALE_MINUTES = int(os.getenv("REPLAY_STALE_MINUTES") or "30")
+    PAGINATION_DEFAULT_LIMIT = int(os.getenv("PAGINATION_DEFAULT_LIMIT") or "100")
+    PAGINATION_MAX_LIMIT = int(os.getenv("PAGINATION_MAX_LIMIT") or "500")
+    EVENT_DEDUPE_CACHE_SIZE = int(os.getenv("EVENT_DEDUPE_CACHE_SIZE") or "50000")
+    EVENT_DEDUPE_CACHE_TTL_SECONDS = int(os.getenv("EVENT_DEDUPE_CACHE_TTL_SECONDS") or "259200")
+    STORE_DISPATCH_WORKERS = int(os.getenv("STORE_DISPATCH_WORKERS") or "2")
+    STORE_DISPATCH_POLL_SECONDS = int(os.getenv("STORE_DISPATCH_POLL_SECONDS") or "1")
+    STORE_DISPATCH_BATCH_SIZE = int(os.getenv("STORE_DISPATCH_BATCH_SIZE") or "20")
+    STORE_DISPATCH_LEASE_SECONDS = int(os.getenv("STORE_DISPATCH_LEASE_SECONDS") or "60")
+    STORE_DISPATCH_MAX_ATTEMPTS = int(os.getenv("STORE_DISPATCH_MAX_ATTEMPTS") or "12")
+    STORE_DISPATCH_BACKOFF_BASE_SECONDS = int(os.getenv("STORE_DISPATCH_BACKOFF_BASE_SECONDS") or "30")
+    STORE_DISPATCH_BACKOFF_MAX_SECONDS = int(os.getenv("STORE_DISPATCH_BACKOFF_MAX_SECONDS") or "21600")
+    STORE_DISPATCH_BATCH_MAX_ORDERS = int(os.getenv("STORE_DISPATCH_BATCH_MAX_ORDERS") or "100")
+    STORE_DISPATCH_BATCH_WINDOW_SECONDS = int(os.getenv("STORE_DISPATCH_BATCH_WINDOW_SECONDS") or "2")
+    STORE_DISPATCH_BATCH_MAX_BYTES = int(os.getenv("STORE_DISPATCH_BATCH_MAX_BYTES") or "262144")
+    CIRCUIT_BREAKER_ENABLED = ((os.getenv("CIRCUIT_BREAKER_ENABLED") or "1").lower() in ("1", "true", "yes"))
+    CIRCUIT_BREAKER_BACKEND = os.getenv("CIRCUIT_BREAKER_BACKEND") or "db"
+    CIRCUIT_BREAKER_WINDOW_SECONDS = int(os.getenv("CIRCUIT_BREAKER_WINDOW_SECONDS") or "60")
+    CIRCUIT_BREAKER_MIN_REQUESTS = int(os.getenv("CIRCUIT_BREAKER_MIN_REQUESTS") or "5")
+    CIRCUIT_BREAKER_FAILURE_RATE_PERCENT = int(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE_PERCENT") or "50")
+    CIRCUIT_BREAKER_OPEN_SECONDS = int(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS") or "60")
+    STRIPE_CACHE_BACKEND = os.getenv("STRIPE_CACHE_BACKEND") or "memory"
+    STRIPE_CACHE_MAX_ENTRIES = int(os.getenv("STRIPE_CACHE_MAX_ENTRIES") or "10000")
+    CATALOG_CACHE_TTL_SECONDS = int(os.getenv("CATALOG_CACHE_TTL_SECONDS") or "300")
+    CATALOG_CACHE_MAX_ITEMS = int(os.getenv("CATALOG_CACHE_MAX_ITEMS") or "1000")
+    PRICE_CACHE_TTL_SECONDS = int(os.getenv("PRICE_CACHE_TTL_SECONDS") or "86400")
+    ACCOUNT_STATUS_FRESH_SECONDS = int(os.getenv("ACCOUNT_STATUS_FRESH_SECONDS") or "30")
+    ACCOUNT_STATUS_MAX_STALE_SECONDS = int(os.getenv("ACCOUNT_STATUS_MAX_STALE_SECONDS") or "900")
+    STRIPE_SINGLE_FLIGHT_TIMEOUT_SECONDS = float(os.getenv("STRIPE_SINGLE_FLIGHT_TIMEOUT_SECONDS") or "10")
+    OUTBOUND_POOL_MAXSIZE = int(os.getenv("OUTBOUND_POOL_MAXSIZE") or "10")
+    OUTBOUND_MAX_HOSTS = int(os.getenv("OUTBOUND_MAX_HOSTS") or "256")
+    OUTBOUND_CONNECT_TIMEOUT_SECONDS = int(os.getenv("OUTBOUND_CONNECT_TIMEOUT_SECONDS") or "3")
+    OUTBOUND_READ_TIMEOUT_SECONDS = int(os.getenv("OUTBOUND_READ_TIMEOUT_SECONDS") or "5")
     DB_DIALECT = os.getenv("DB_DIALECT") or ""
     MYSQL_HOST = os.getenv("MYSQL_HOST") or ""
     MYSQL_PORT = int(os.getenv("MYSQL_PORT") or "3306")
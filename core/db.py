@@ -1,6 +1,6 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, UniqueConstraint, DateTime, Text, inspect, text, Boolean
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from datetime import datetime
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, UniqueConstraint, DateTime, Text, inspect, text, Boolean, Index, LargeBinary
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, deferred
+from datetime import datetime, timedelta
 from core.config import Config
 
 engine = create_engine(Config.DATABASE_URL, future=True)
@@ -17,10 +17,12 @@ class User(Base):
 
 class StripeAccount(Base):
     __tablename__ = "stripe_accounts"
+    __table_args__ = (Index("ix_stripe_accounts_user", "user_id", "id"),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     account_id = Column(String(255), unique=True, nullable=False)
     store_domain = Column(String(512), nullable=True)
+    dispatch_batch_enabled = Column(Boolean, nullable=False, default=False)
     user = relationship("User", back_populates="stripe_accounts")
 
 class CheckoutSession(Base):
@@ -50,14 +52,30 @@ class WebhookEvent(Base):
 
 class WebhookLog(Base):
     __tablename__ = "webhook_logs"
+    __table_args__ = (
+        Index("ix_webhook_logs_account_received", "account_id", "received_at", "id"),
+        Index("ix_webhook_logs_type", "event_type", "event_created"),
+    )
     id = Column(Integer, primary_key=True)
     event_id = Column(String(255), unique=True, nullable=False)
     event_type = Column(String(255), nullable=False)
+    # extraídos do evento na ingestão para consultas sem abrir o payload
+    account_id = Column(String(255), nullable=True)
+    event_created = Column(DateTime, nullable=True)
     payload = Column(Text, nullable=False)
+    # webhook = corpo recebido; sync_api = bytes da resposta da API; NULL = json re-serializado (legado)
+    payload_source = Column(String(16), nullable=True)
+    # identity/NULL = texto em payload; zlib = comprimido em payload_blob (ver core/payload_codec.py)
+    payload_codec = Column(String(16), nullable=True)
+    payload_blob = deferred(Column(LargeBinary(16777215), nullable=True))
     received_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 class StoreDispatch(Base):
     __tablename__ = "store_dispatch"
+    __table_args__ = (
+        Index("ix_store_dispatch_due", "state", "next_attempt_at"),
+        Index("ix_store_dispatch_account", "account_id", "id"),
+    )
     id = Column(Integer, primary_key=True)
     event_id = Column(String(255), unique=True, nullable=False)
     account_id = Column(String(255), nullable=False)
@@ -65,6 +83,22 @@ class StoreDispatch(Base):
     status = Column(String(64), nullable=True)
     attempts = Column(Integer, default=0, nullable=False)
     delivered_at = Column(DateTime, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    state = Column(String(16), default="pending", nullable=True)
+
+class StoreCircuit(Base):
+    __tablename__ = "store_circuits"
+    id = Column(Integer, primary_key=True)
+    store_key = Column(String(512), unique=True, nullable=False)
+    state = Column(String(16), default="closed", nullable=False)
+    window_started_at = Column(DateTime, nullable=True)
+    window_requests = Column(Integer, default=0, nullable=False)
+    window_failures = Column(Integer, default=0, nullable=False)
+    opened_at = Column(DateTime, nullable=True)
+    next_probe_at = Column(DateTime, nullable=True)
+    version = Column(Integer, default=1, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 class OrderCorrelation(Base):
     __tablename__ = "order_correlation"
@@ -83,6 +117,82 @@ class WebhookSyncLog(Base):
     ignored_events = Column(Integer, default=0, nullable=False)
     failed_notifications = Column(Integer, default=0, nullable=False)
     message = Column(Text, nullable=True)
+    run_id = Column(Integer, nullable=True)
+
+class WebhookSyncRun(Base):
+    __tablename__ = "webhook_sync_runs"
+    id = Column(Integer, primary_key=True)
+    started_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    accounts_total = Column(Integer, default=0, nullable=False)
+    accounts_processed = Column(Integer, default=0, nullable=False)
+    accounts_failed = Column(Integer, default=0, nullable=False)
+    recovered_events = Column(Integer, default=0, nullable=False)
+    ignored_events = Column(Integer, default=0, nullable=False)
+    failed_notifications = Column(Integer, default=0, nullable=False)
+
+class WorkerLease(Base):
+    __tablename__ = "worker_leases"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(64), unique=True, nullable=False)
+    holder = Column(String(255), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    heartbeat_at = Column(DateTime, nullable=False)
+
+class StripeCacheEntry(Base):
+    __tablename__ = "stripe_cache"
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String(255), unique=True, nullable=False)
+    value = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class SyncCheckpoint(Base):
+    __tablename__ = "sync_checkpoints"
+    id = Column(Integer, primary_key=True)
+    account_id = Column(String(255), unique=True, nullable=False)
+    # evento mais novo já processado pelo sincronizador (created em unix ts)
+    last_event_created = Column(Integer, nullable=True)
+    last_event_id = Column(String(255), nullable=True)
+    # janela em andamento: retomada pela página seguinte a page_cursor se o processo cair no meio
+    window_gte = Column(Integer, nullable=True)
+    window_started = Column(Integer, nullable=True)
+    page_cursor = Column(String(255), nullable=True)
+    pending_created = Column(Integer, nullable=True)
+    pending_event_id = Column(String(255), nullable=True)
+    # created do evento mais antigo da janela que falhou ou ficou sem conta; o checkpoint não passa dele
+    pending_retry_created = Column(Integer, nullable=True)
+    # agenda adaptativa: contas sem eventos recuperados espaçam as consultas, contas com perda encurtam
+    interval_seconds = Column(Integer, nullable=True)
+    next_sync_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class ReplayJob(Base):
+    __tablename__ = "replay_jobs"
+    id = Column(Integer, primary_key=True)
+    account_id = Column(String(255), nullable=True)
+    event_types = Column(Text, nullable=True)
+    since = Column(DateTime, nullable=False)
+    until = Column(DateTime, nullable=True)
+    dry_run = Column(Boolean, nullable=False, default=False)
+    state = Column(String(16), nullable=False, default="queued")
+    matched = Column(Integer, default=0, nullable=False)
+    delivered = Column(Integer, default=0, nullable=False)
+    pending = Column(Integer, default=0, nullable=False)
+    skipped = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # último progresso gravado; job em andamento sem progresso por REPLAY_STALE_MINUTES foi interrompido
+    updated_at = Column(DateTime, nullable=True)
+    message = Column(Text, nullable=True)
+
+def _ensure_indexes(inspector, model):
+    existing = [i["name"] for i in inspector.get_indexes(model.__tablename__)]
+    for ix in model.__table__.indexes:
+        if ix.name not in existing:
+            with engine.begin() as conn:
+                ix.create(conn)
 
 def init_db():
     Base.metadata.create_all(bind=engine)
@@ -97,6 +207,9 @@ def init_db():
         if "store_domain" not in cols:
             with engine.begin() as conn:
                 conn.execute(text("ALTER TABLE stripe_accounts ADD COLUMN store_domain VARCHAR(512)"))
+        if "dispatch_batch_enabled" not in cols:
+            with engine.begin() as conn:
+                conn.execute(text("ALTER TABLE stripe_accounts ADD COLUMN dispatch_batch_enabled BOOLEAN DEFAULT 0 NOT NULL"))
         # ensure order_correlation exists
         tables = inspector.get_table_names()
         if "order_correlation" not in tables:
@@ -115,5 +228,72 @@ def init_db():
                 conn.execute(text("ALTER TABLE webhook_events ADD COLUMN source VARCHAR(32)"))
             if "processed_at" not in wcols:
                 conn.execute(text("ALTER TABLE webhook_events ADD COLUMN processed_at DATETIME"))
+        # outbox columns on store_dispatch
+        dcols = [c["name"] for c in inspector.get_columns("store_dispatch")]
+        with engine.begin() as conn:
+            if "next_attempt_at" not in dcols:
+                conn.execute(text("ALTER TABLE store_dispatch ADD COLUMN next_attempt_at DATETIME"))
+            if "last_error" not in dcols:
+                conn.execute(text("ALTER TABLE store_dispatch ADD COLUMN last_error TEXT"))
+            if "state" not in dcols:
+                conn.execute(text("ALTER TABLE store_dispatch ADD COLUMN state VARCHAR(16)"))
+                conn.execute(text("UPDATE store_dispatch SET state='delivered' WHERE delivered_at IS NOT NULL"))
+                conn.execute(text("UPDATE store_dispatch SET state='pending' WHERE delivered_at IS NULL AND next_attempt_at IS NOT NULL"))
+                # linhas antigas não têm next_attempt_at: as recebidas dentro da janela do sincronizador (que antes as
+                # retentava) voltam para a fila agora; só as mais velhas viram dead-letter
+                now = datetime.utcnow()
+                conn.execute(
+                    text("UPDATE store_dispatch SET state='pending', next_attempt_at=:now WHERE delivered_at IS NULL AND next_attempt_at IS NULL"
+                         " AND event_id IN (SELECT event_id FROM webhook_events WHERE received_at >= :cutoff)"),
+                    {"now": now, "cutoff": now - timedelta(minutes=Config.WEBHOOK_SYNC_LOOKBACK_MINUTES)},
+                )
+                conn.execute(text("UPDATE store_dispatch SET state='dead' WHERE delivered_at IS NULL AND next_attempt_at IS NULL"))
+        _ensure_indexes(inspector, StoreDispatch)
+        lcols = [c["name"] for c in inspector.get_columns("webhook_logs")]
+        with engine.begin() as conn:
+            if "payload_source" not in lcols:
+                conn.execute(text("ALTER TABLE webhook_logs ADD COLUMN payload_source VARCHAR(16)"))
+            if "payload_codec" not in lcols:
+                conn.execute(text("ALTER TABLE webhook_logs ADD COLUMN payload_codec VARCHAR(16)"))
+            if "payload_blob" not in lcols:
+                blob_type = "MEDIUMBLOB" if engine.dialect.name == "mysql" else "BLOB"
+                conn.execute(text(f"ALTER TABLE webhook_logs ADD COLUMN payload_blob {blob_type}"))
+            if "account_id" not in lcols:
+                conn.execute(text("ALTER TABLE webhook_logs ADD COLUMN account_id VARCHAR(255)"))
+            if "event_created" not in lcols:
+                conn.execute(text("ALTER TABLE webhook_logs ADD COLUMN event_created DATETIME"))
+        _ensure_indexes(inspector, WebhookLog)
+        # (account_id, id) foi substituído por ix_webhook_logs_account_received; índice a mais só custa nas inserções
+        if "ix_webhook_logs_account" in [i["name"] for i in inspector.get_indexes("webhook_logs")]:
+            on = " ON webhook_logs" if engine.dialect.name == "mysql" else ""
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP INDEX ix_webhook_logs_account{on}"))
+        _ensure_indexes(inspector, StripeAccount)
+        scols = [c["name"] for c in inspector.get_columns("webhook_sync_logs")]
+        if "run_id" not in scols:
+            with engine.begin() as conn:
+                conn.execute(text("ALTER TABLE webhook_sync_logs ADD COLUMN run_id INTEGER"))
+        ccols = [c["name"] for c in inspector.get_columns("sync_checkpoints")]
+        with engine.begin() as conn:
+            if "window_gte" not in ccols:
+                conn.execute(text("ALTER TABLE sync_checkpoints ADD COLUMN window_gte INTEGER"))
+            if "window_started" not in ccols:
+                conn.execute(text("ALTER TABLE sync_checkpoints ADD COLUMN window_started INTEGER"))
+            if "page_cursor" not in ccols:
+                conn.execute(text("ALTER TABLE sync_checkpoints ADD COLUMN page_cursor VARCHAR(255)"))
+            if "pending_created" not in ccols:
+                conn.execute(text("ALTER TABLE sync_checkpoints ADD COLUMN pending_created INTEGER"))
+            if "pending_event_id" not in ccols:
+                conn.execute(text("ALTER TABLE sync_checkpoints ADD COLUMN pending_event_id VARCHAR(255)"))
+            if "pending_retry_created" not in ccols:
+                conn.execute(text("ALTER TABLE sync_checkpoints ADD COLUMN pending_retry_created INTEGER"))
+            if "interval_seconds" not in ccols:
+                conn.execute(text("ALTER TABLE sync_checkpoints ADD COLUMN interval_seconds INTEGER"))
+            if "next_sync_at" not in ccols:
+                conn.execute(text("ALTER TABLE sync_checkpoints ADD COLUMN next_sync_at DATETIME"))
+        rcols = [c["name"] for c in inspector.get_columns("replay_jobs")]
+        if "updated_at" not in rcols:
+            with engine.begin() as conn:
+                conn.execute(text("ALTER TABLE replay_jobs ADD COLUMN updated_at DATETIME"))
     except Exception:
         pass
@@ -0,0 +1,50 @@
+import threading
+import time
+from collections import OrderedDict
+from core.config import Config
+
+# LRU com TTL de event_ids já ingeridos neste processo; o banco continua sendo a fonte da verdade
+class EventIdCache:
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, event_id):
+        # None = desconhecido; senão o valor gravado (True se já há despacho no outbox)
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(event_id)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._data[event_id]
+                self.misses += 1
+                return None
+            self._data.move_to_end(event_id)
+            self.hits += 1
+            return item[1]
+
+    def add(self, event_id, dispatched=False):
+        if not event_id or self.max_size <= 0:
+            return
+        with self._lock:
+            prev = self._data.get(event_id)
+            self._data[event_id] = (time.monotonic() + self.ttl_seconds, bool(dispatched) or bool(prev and prev[1]))
+            self._data.move_to_end(event_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxSize": self.max_size, "hits": self.hits, "misses": self.misses}
+
+seen_events = EventIdCache(Config.EVENT_DEDUPE_CACHE_SIZE, Config.EVENT_DEDUPE_CACHE_TTL_SECONDS)
@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from core.config import Config
+
+# uma Session (pool keep-alive próprio) por scheme://host; as mais antigas são fechadas além do limite
+_sessions = OrderedDict()
+_lock = threading.Lock()
+
+def host_key(url):
+    p = urlparse(url)
+    return f"{p.scheme.lower()}://{p.netloc.lower()}"
+
+def _new_session():
+    s = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=max(1, Config.OUTBOUND_POOL_MAXSIZE),
+        max_retries=0,
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+def session_for(url):
+    key = host_key(url)
+    with _lock:
+        s = _sessions.get(key)
+        if s is not None:
+            _sessions.move_to_end(key)
+            return s
+        s = _new_session()
+        _sessions[key] = s
+        while len(_sessions) > max(1, Config.OUTBOUND_MAX_HOSTS):
+            _, old = _sessions.popitem(last=False)
+            old.close()
+        return s
+
+def timeouts():
+    return (Config.OUTBOUND_CONNECT_TIMEOUT_SECONDS, Config.OUTBOUND_READ_TIMEOUT_SECONDS)
+
+def post(url, data=None, headers=None, timeout=None):
+    return session_for(url).post(url, data=data, headers=headers, timeout=timeout or timeouts())
+
+def close_all():
+    with _lock:
+        while _sessions:
+            _, s = _sessions.popitem()
+            s.close()
@@ -0,0 +1,49 @@
+import base64
+import json
+from datetime import datetime
+from flask import request
+from sqlalchemy import DateTime, and_, or_
+from core.config import Config
+
+# paginação por keyset: o cursor é opaco (base64 de JSON) com as chaves da última linha da página
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor, columns):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw.decode("utf-8"))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("cursor shape")
+        return [datetime.fromisoformat(v) if isinstance(c.type, DateTime) else v for c, v in zip(columns, values)]
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e))
+
+def page_limit():
+    try:
+        limit = int(request.args.get("limit") or Config.PAGINATION_DEFAULT_LIMIT)
+    except ValueError:
+        limit = Config.PAGINATION_DEFAULT_LIMIT
+    return max(1, min(limit, Config.PAGINATION_MAX_LIMIT))
+
+def _after(columns, values, descending):
+    col, val = columns[0], values[0]
+    beyond = col < val if descending else col > val
+    if len(columns) == 1:
+        return beyond
+    return or_(beyond, and_(col == val, _after(columns[1:], values[1:], descending)))
+
+def paginate(query, columns, key, descending=False):
+    # columns: chaves de ordenação (a última deve ser única); key(row) devolve os valores delas
+    limit = page_limit()
+    cursor = request.args.get("cursor")
+    if cursor:
+        query = query.filter(_after(columns, decode_cursor(cursor, columns), descending))
+    order = [c.desc() if descending else c.asc() for c in columns]
+    rows = query.order_by(*order).limit(limit + 1).all()
+    next_cursor = encode_cursor(key(rows[limit - 1])) if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -0,0 +1,26 @@
+import zlib
+from core.config import Config
+
+CODEC_IDENTITY = "identity"
+CODEC_ZLIB = "zlib"
+
+# payload em texto puro fica em webhook_logs.payload; comprimido vai para payload_blob
+def encode(text, codec=None):
+    codec = codec or Config.WEBHOOK_PAYLOAD_CODEC
+    if codec == CODEC_ZLIB:
+        blob = zlib.compress(text.encode("utf-8"), Config.WEBHOOK_PAYLOAD_ZLIB_LEVEL)
+        return {"payload": "", "payload_blob": blob, "payload_codec": CODEC_ZLIB}
+    return {"payload": text, "payload_blob": None, "payload_codec": CODEC_IDENTITY}
+
+def decode(payload, blob, codec):
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(blob).decode("utf-8")
+    if codec in (None, "", CODEC_IDENTITY):
+        return payload
+    raise ValueError(f"unknown payload codec: {codec}")
+
+def payload_of(log):
+    # payload_blob é deferred: só é carregado (e descomprimido) quando lido aqui
+    if log.payload_codec in (None, "", CODEC_IDENTITY):
+        return log.payload
+    return decode(log.payload, log.payload_blob, log.payload_codec)
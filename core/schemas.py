@@ -1,3 +1,5 @@
+from datetime import datetime
+from typing import List
 from pydantic import BaseModel, Field, ValidationError
 
 from typing import Optional
@@ -33,6 +35,13 @@ class StoreCreateSchema(BaseModel):
 class StoreDomainUpdateSchema(BaseModel):
     storeDomain: str = Field(min_length=8)
 
+class ReplayCreateSchema(BaseModel):
+    since: datetime
+    until: Optional[datetime] = None
+    accountId: Optional[str] = None
+    eventTypes: Optional[List[str]] = None
+    dryRun: bool = False
+
 def parse_and_validate(schema, data):
     try:
         return schema(**data), None
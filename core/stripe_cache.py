@@ -0,0 +1,256 @@
+import json
+import threading
+import structlog
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from core.config import Config
+from core.db import SessionLocal, StripeCacheEntry
+
+# cache de leituras da Stripe (catálogo, metadados de preço e status da conta); memória do processo ou tabela compartilhada entre workers
+class MemoryCacheBackend:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.time() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def set_many(self, items, ttl):
+        for key, value in items.items():
+            self.set(key, value, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class DbCacheBackend:
+    def get(self, key):
+        db = SessionLocal()
+        try:
+            row = db.query(StripeCacheEntry).filter_by(cache_key=key).first()
+            if not row or row.expires_at < datetime.utcnow():
+                return None
+            return json.loads(row.value)
+        finally:
+            db.close()
+
+    def set(self, key, value, ttl):
+        expires = datetime.utcnow() + timedelta(seconds=ttl)
+        raw = json.dumps(value, separators=(",", ":"))
+        db = SessionLocal()
+        try:
+            res = db.execute(update(StripeCacheEntry).where(StripeCacheEntry.cache_key == key).values(value=raw, expires_at=expires))
+            if res.rowcount == 0:
+                db.add(StripeCacheEntry(cache_key=key, value=raw, expires_at=expires))
+            db.commit()
+        except IntegrityError:
+            # outro worker gravou a mesma chave ao mesmo tempo; qualquer um dos valores serve
+            db.rollback()
+        finally:
+            db.close()
+
+    def set_many(self, items, ttl):
+        # uma transação por lote: remove as chaves e insere de novo
+        if not items:
+            return
+        expires = datetime.utcnow() + timedelta(seconds=ttl)
+        db = SessionLocal()
+        try:
+            db.query(StripeCacheEntry).filter(StripeCacheEntry.cache_key.in_(list(items))).delete(synchronize_session=False)
+            db.execute(insert(StripeCacheEntry), [
+                {"cache_key": k, "value": json.dumps(v, separators=(",", ":")), "expires_at": expires} for k, v in items.items()
+            ])
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+        finally:
+            db.close()
+
+    def delete(self, key):
+        db = SessionLocal()
+        try:
+            db.query(StripeCacheEntry).filter_by(cache_key=key).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def clear(self):
+        db = SessionLocal()
+        try:
+            db.query(StripeCacheEntry).delete()
+            db.commit()
+        finally:
+            db.close()
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = DbCacheBackend() if Config.STRIPE_CACHE_BACKEND == "db" else MemoryCacheBackend(Config.STRIPE_CACHE_MAX_ENTRIES)
+        return _backend
+
+def set_backend(backend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+def _count(name):
+    with _backend_lock:
+        _stats[name] += 1
+
+def stats():
+    with _backend_lock:
+        return dict(_stats, backend=Config.STRIPE_CACHE_BACKEND)
+
+def _catalog_key(account_id):
+    return f"catalog:{account_id}"
+
+def get_catalog(account_id):
+    if Config.CATALOG_CACHE_TTL_SECONDS <= 0:
+        return None
+    value = get_backend().get(_catalog_key(account_id))
+    _count("misses" if value is None else "hits")
+    return value
+
+def put_catalog(account_id, products):
+    if Config.CATALOG_CACHE_TTL_SECONDS > 0:
+        get_backend().set(_catalog_key(account_id), products, Config.CATALOG_CACHE_TTL_SECONDS)
+
+def invalidate_catalog(account_id):
+    get_backend().delete(_catalog_key(account_id))
+    _count("invalidations")
+
+def _field(obj, name):
+    if obj is None:
+        return None
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+def price_meta(price):
+    # type/moeda/valor não mudam depois de criado o preço na Stripe
+    return {
+        "type": _field(price, "type"),
+        "interval": _field(_field(price, "recurring"), "interval"),
+        "currency": _field(price, "currency"),
+        "unitAmount": _field(price, "unit_amount"),
+    }
+
+def _price_key(account_id, price_id):
+    return f"price:{account_id}:{price_id}"
+
+def get_price_meta(account_id, price_id):
+    if Config.PRICE_CACHE_TTL_SECONDS <= 0:
+        return None
+    value = get_backend().get(_price_key(account_id, price_id))
+    _count("misses" if value is None else "hits")
+    return value
+
+def put_prices(account_id, prices):
+    # prices: objetos de preço da Stripe (retrieve, listagem do catálogo ou data.object do webhook)
+    if Config.PRICE_CACHE_TTL_SECONDS <= 0:
+        return
+    items = {_price_key(account_id, _field(p, "id")): price_meta(p) for p in prices if _field(p, "id") and _field(p, "type")}
+    get_backend().set_many(items, Config.PRICE_CACHE_TTL_SECONDS)
+
+def apply_event(event):
+    # product.* / price.* chegam pelo /webhook; eventos sem "account" são da conta da plataforma
+    event_type = event.get("type") or ""
+    if not event_type.startswith(("product.", "price.")):
+        return False
+    account_id = event.get("account") or "platform"
+    invalidate_catalog(account_id)
+    if event_type in ("price.created", "price.updated"):
+        put_prices(account_id, [(event.get("data") or {}).get("object")])
+    elif event_type == "price.deleted":
+        obj = (event.get("data") or {}).get("object") or {}
+        get_backend().delete(_price_key(account_id, obj.get("id")))
+    return True
+
+def _account_key(account_id):
+    return f"account_status:{account_id}"
+
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+def _store_account_status(account_id, summary, fetched_at=None):
+    entry = {"summary": summary, "fetchedAt": time.time() if fetched_at is None else fetched_at}
+    get_backend().set(_account_key(account_id), entry, max(Config.ACCOUNT_STATUS_FRESH_SECONDS, Config.ACCOUNT_STATUS_MAX_STALE_SECONDS))
+
+def revalidate_account_status(account_id, fetch):
+    # atualiza em segundo plano; no máximo uma atualização em voo por conta neste processo
+    with _refreshing_lock:
+        if account_id in _refreshing:
+            return None
+        _refreshing.add(account_id)
+
+    def _run():
+        try:
+            _store_account_status(account_id, fetch(account_id))
+        except Exception as e:
+            structlog.get_logger().warning("account_status_refresh_failed", account_id=account_id, error=str(e))
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(account_id)
+
+    t = threading.Thread(target=_run, name=f"AccountStatusRefresh-{account_id}", daemon=True)
+    t.start()
+    return t
+
+def get_account_status(account_id, fetch):
+    # stale-while-revalidate: dentro de ACCOUNT_STATUS_FRESH_SECONDS responde do cache; depois, ainda responde
+    # do cache (até ACCOUNT_STATUS_MAX_STALE_SECONDS) e dispara a atualização; só bloqueia na Stripe em miss
+    if Config.ACCOUNT_STATUS_FRESH_SECONDS <= 0:
+        return fetch(account_id)
+    entry = get_backend().get(_account_key(account_id))
+    if entry is None:
+        _count("misses")
+        summary = fetch(account_id)
+        _store_account_status(account_id, summary)
+        return summary
+    _count("hits")
+    if time.time() - entry["fetchedAt"] >= Config.ACCOUNT_STATUS_FRESH_SECONDS:
+        revalidate_account_status(account_id, fetch)
+    return entry["summary"]
+
+def updated_account(event):
+    # conta afetada por account.updated (v1) ou eventos v2.core.account*; None para os demais
+    event_type = event.get("type") or ""
+    if event_type == "account.updated":
+        return event.get("account") or ((event.get("data") or {}).get("object") or {}).get("id")
+    if event_type.startswith("v2.core.account"):
+        return (event.get("related_object") or {}).get("id")
+    return None
+
+def account_status_changed(account_id, fetch):
+    # marca a entrada como vencida (leituras seguintes também revalidam) e atualiza já
+    entry = get_backend().get(_account_key(account_id))
+    if entry is not None:
+        _store_account_status(account_id, entry["summary"], fetched_at=0)
+    _count("invalidations")
+    return revalidate_account_status(account_id, fetch)
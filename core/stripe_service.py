@@ -1,8 +1,57 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
 import stripe
 from core.config import Config
 
 stripe.api_key = Config.STRIPE_SECRET_KEY
 
+# single-flight: leituras idênticas e simultâneas neste processo compartilham uma única chamada à Stripe
+class SingleFlightTimeout(TimeoutError):
+    pass
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+_flights = {}
+_flights_lock = threading.Lock()
+_flight_stats = {"calls": 0, "shared": 0, "timeouts": 0}
+
+def single_flight(key, fn, timeout=None):
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+            _flight_stats["calls"] += 1
+        else:
+            _flight_stats["shared"] += 1
+    if leader:
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+        finally:
+            with _flights_lock:
+                _flights.pop(key, None)
+            flight.done.set()
+    elif not flight.done.wait(Config.STRIPE_SINGLE_FLIGHT_TIMEOUT_SECONDS if timeout is None else timeout):
+        with _flights_lock:
+            _flight_stats["timeouts"] += 1
+        raise SingleFlightTimeout(f"timed out waiting for in-flight Stripe call {key!r}")
+    if flight.error is not None:
+        raise flight.error
+    return flight.result
+
+def single_flight_stats():
+    with _flights_lock:
+        return dict(_flight_stats, inFlight=len(_flights))
+
 def create_product_on_account(name, description, account_id):
     product = stripe.Product.create(name=name, description=description, stripe_account=account_id)
     return product
@@ -20,12 +69,14 @@ def create_price_for_product(product_id, unit_amount, account_id, recurring_inte
     price = stripe.Price.create(**price_data)
     return price
 
-def list_prices_with_products(account_id):
+def list_prices_with_products(account_id, limit=100, starting_after=None):
+    # devolve uma página; use auto_paging_iter() para percorrer o catálogo inteiro
+    params = {"expand": ["data.product"], "active": True, "limit": limit}
+    if starting_after:
+        params["starting_after"] = starting_after
     if account_id != "platform":
-        prices = stripe.Price.list(expand=["data.product"], active=True, limit=100, stripe_account=account_id)
-    else:
-        prices = stripe.Price.list(expand=["data.product"], active=True, limit=100)
-    return prices
+        params["stripe_account"] = account_id
+    return single_flight(("prices", account_id, limit, starting_after), lambda: stripe.Price.list(**params))
 
 def create_checkout_session_platform(account_id, price_id, success_url, cancel_url):
     session = stripe.checkout.Session.create(
@@ -61,7 +112,54 @@ def create_checkout_session_connected(account_id, price_id, mode, success_url, c
     return checkout_session
 
 def retrieve_price(price_id, account_id):
-    return stripe.Price.retrieve(price_id, stripe_account=account_id)
+    return single_flight(("price", account_id, price_id), lambda: stripe.Price.retrieve(price_id, stripe_account=account_id))
+
+def retrieve_checkout_session(session_id, account_id=None):
+    if account_id and account_id != "platform":
+        return single_flight(("checkout_session", account_id, session_id), lambda: stripe.checkout.Session.retrieve(session_id, stripe_account=account_id))
+    return single_flight(("checkout_session", None, session_id), lambda: stripe.checkout.Session.retrieve(session_id))
 
-def verify_webhook(payload, sig_header, endpoint_secret):
-    return stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
+def retrieve_connected_account(client, account_id):
+    return single_flight(
+        ("account", account_id),
+        lambda: client.v2.core.accounts.retrieve(account_id, {"include": ["requirements", "configuration.merchant"]}),
+    )
+
+_last_webhook_secret = None
+
+def _parse_signature_header(sig_header):
+    timestamp, signatures = None, []
+    for item in (sig_header or "").split(","):
+        k, _, v = item.strip().partition("=")
+        if k == "t":
+            timestamp = int(v)
+        elif k == "v1":
+            signatures.append(v)
+    return timestamp, signatures
+
+def verify_webhook(payload, sig_header, endpoint_secret, tolerance=None):
+    # aceita um segredo ou a lista de segredos em rotação; devolve o evento como dict
+    global _last_webhook_secret
+    secrets = [endpoint_secret] if isinstance(endpoint_secret, str) else list(endpoint_secret or [])
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    try:
+        timestamp, signatures = _parse_signature_header(sig_header)
+    except ValueError:
+        timestamp, signatures = None, []
+    if timestamp is None or not signatures or not secrets:
+        raise stripe.error.SignatureVerificationError("Unable to extract timestamp and signatures from header", sig_header)
+    tolerance = Config.STRIPE_WEBHOOK_TOLERANCE_SECONDS if tolerance is None else tolerance
+    if tolerance and timestamp < time.time() - tolerance:
+        # rejeita antes de qualquer HMAC
+        raise stripe.error.SignatureVerificationError("Timestamp outside the tolerance zone (%d)" % timestamp, sig_header)
+    signed = str(timestamp).encode("ascii") + b"." + bytes(payload)
+    last = _last_webhook_secret
+    if last in secrets:
+        secrets = [last] + [sec for sec in secrets if sec != last]
+    for sec in secrets:
+        expected = hmac.new(sec.encode("utf-8"), signed, hashlib.sha256).hexdigest()
+        if any(hmac.compare_digest(expected, sig) for sig in signatures):
+            _last_webhook_secret = sec
+            return json.loads(payload)
+    raise stripe.error.SignatureVerificationError("No signatures found matching the expected signature for payload", sig_header)
@@ -3,7 +3,8 @@
 import os
 import json
 import time
-from flask import Flask, jsonify, request, redirect, make_response, g, render_template
+from datetime import timezone
+from flask import Flask, Response, jsonify, request, redirect, make_response, g, render_template, stream_with_context
 from functools import wraps
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -13,6 +14,7 @@ from core.rate_limit import init_limiter
 from core.auth import auth_required, generate_access_token, generate_refresh_token
 from core.config_audit import audit_config
 from core.http import ok, error
+from core.pagination import paginate, InvalidCursor
 from core.schemas import (
     parse_and_validate,
     CreateProductSchema,
@@ -21,6 +23,7 @@ from core.schemas import (
     CreatePortalSessionSchema,
     StoreCreateSchema,
     StoreDomainUpdateSchema,
+    ReplayCreateSchema,
 )
 from core.db import init_db, SessionLocal, User, StripeAccount, WebhookEvent, WebhookLog, StoreDispatch
 from core.stripe_service import (
@@ -30,17 +33,24 @@ from core.stripe_service import (
     create_checkout_session_platform,
     create_checkout_session_connected,
     retrieve_price,
+    retrieve_checkout_session,
+    retrieve_connected_account,
+    single_flight_stats,
     verify_webhook,
 )
 import stripe
 import structlog
 from stripe import StripeClient
 import jwt
-import hmac
-import hashlib
-import requests
-from services.webhook_sync import run_sync_once, start_worker
-from sqlalchemy import text
+from services.webhook_sync import run_if_leader, schedule_all_now, start_worker, SYNC_LEASE
+from services.store_dispatch import start_dispatch_workers, requeue_dead_letters
+from services.webhook_ingest import ingest_event
+from services.circuit_breaker import circuit_status, list_shed_circuits
+from services.webhook_replay import create_job as create_replay_job, start_job as start_replay_job, job_status as replay_job_status
+from core.outbound_http import host_key
+from core.event_cache import seen_events
+from core import stripe_cache
+from services import webhook_spool, worker_lease
 from urllib.parse import urlparse
 import ipaddress
 stripe.api_key = Config.STRIPE_SECRET_KEY
@@ -62,6 +72,12 @@ app.start_time = time.time()
 def _is_dev_env():
     d = Config.DOMAIN or ""
     return ("localhost" in d) or ("ngrok" in d)
+def _naive_utc(dt):
+    # o banco guarda UTC sem fuso
+    if dt is not None and dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
 def _validate_store_domain(store_domain):
     try:
         p = urlparse(store_domain or "")
@@ -194,20 +210,11 @@ def stores_view():
 @app.route('/stores/list', methods=['GET'])
 @local_only
 def stores_list():
-    db = SessionLocal()
     try:
-        rows = db.query(StripeAccount, User).join(User, StripeAccount.user_id == User.id).all()
-        data = []
-        for acc, user in rows:
-            data.append({
-                'accountId': acc.account_id,
-                'userId': user.id,
-                'email': user.email,
-                'storeDomain': acc.store_domain
-            })
-        return ok({'stores': data})
-    finally:
-        db.close()
+        data, next_cursor = _list_stores()
+    except InvalidCursor:
+        return error('invalid_cursor', 400)
+    return ok({'stores': data, 'next_cursor': next_cursor})
 @app.route('/stores/<account_id>', methods=['GET'])
 @local_only
 def store_detail_view(account_id):
@@ -225,49 +232,32 @@ def stores_get(account_id):
             'accountId': acc.account_id,
             'userId': acc.user_id,
             'email': user.email if user else None,
-            'storeDomain': acc.store_domain
+            'storeDomain': acc.store_domain,
+            'batchEnabled': bool(acc.dispatch_batch_enabled),
+            'circuit': _store_circuit(acc.store_domain)
         })
     finally:
         db.close()
 @app.route('/stores/dispatches/<account_id>', methods=['GET'])
 @local_only
 def stores_dispatches(account_id):
-    db = SessionLocal()
     try:
-        rows = db.query(StoreDispatch).filter_by(account_id=account_id).order_by(StoreDispatch.id.desc()).limit(200).all()
-        data = []
-        for d in rows:
-            data.append({
-                'eventId': d.event_id,
-                'orderId': d.order_id,
-                'status': d.status,
-                'attempts': d.attempts,
-                'deliveredAt': d.delivered_at.isoformat() if d.delivered_at else None
-            })
-        return ok({'dispatches': data})
-    finally:
-        db.close()
+        data, next_cursor = _list_dispatches(account_id, request.args.get('state'))
+    except InvalidCursor:
+        return error('invalid_cursor', 400)
+    return ok({'dispatches': data, 'next_cursor': next_cursor})
+@app.route('/stores/dispatches/<account_id>/requeue', methods=['POST'])
+@local_only
+def stores_dispatches_requeue(account_id):
+    return ok({'status': 'requeued', 'accountId': account_id, 'requeued': requeue_dead_letters(account_id)})
 @app.route('/stores/webhooks/<account_id>', methods=['GET'])
 @local_only
 def stores_webhooks(account_id):
-    db = SessionLocal()
     try:
-        rows = db.query(WebhookLog).order_by(WebhookLog.id.desc()).limit(400).all()
-        data = []
-        for w in rows:
-            try:
-                ev = json.loads(w.payload)
-                if ev.get('account') == account_id:
-                    data.append({
-                        'eventId': ev.get('id'),
-                        'type': ev.get('type'),
-                        'receivedAt': w.received_at.isoformat() if w.received_at else None
-                    })
-            except Exception:
-                pass
-        return ok({'webhooks': data})
-    finally:
-        db.close()
+        data, next_cursor = _list_store_webhooks(account_id)
+    except InvalidCursor:
+        return error('invalid_cursor', 400)
+    return ok({'webhooks': data, 'next_cursor': next_cursor})
 @app.route('/admin/stores/update', methods=['POST'])
 @local_only
 def admin_stores_update_post():
@@ -287,6 +277,10 @@ def admin_stores_update_post():
         return ok({'status': 'updated', 'accountId': account_id, 'storeDomain': store_domain})
     finally:
         db.close()
+@app.route('/admin/stores/batch/<account_id>', methods=['PUT'])
+@local_only
+def admin_stores_batch(account_id):
+    return _set_store_batch(account_id, parse_request_body().get('enabled'))
 @app.route('/admin/stores/upsert', methods=['POST'])
 @local_only
 def admin_stores_upsert():
@@ -418,12 +412,11 @@ def user_detail_view(user_id):
 @app.route('/admin/users/list', methods=['GET'])
 @local_only
 def admin_users_list():
-    db = SessionLocal()
     try:
-        rows = db.query(User).order_by(User.id.asc()).all()
-        return ok({'users': [{'id': u.id, 'email': u.email} for u in rows]})
-    finally:
-        db.close()
+        data, next_cursor = _list_users()
+    except InvalidCursor:
+        return error('invalid_cursor', 400)
+    return ok({'users': data, 'next_cursor': next_cursor})
 @app.route('/admin/users/create', methods=['POST'])
 @local_only
 def admin_users_create():
@@ -462,7 +455,8 @@ def admin_user_stores(user_id):
     db = SessionLocal()
     try:
         rows = db.query(StripeAccount).filter_by(user_id=user_id).all()
-        return ok({'stores': [{'accountId': a.account_id, 'storeDomain': a.store_domain} for a in rows]})
+        user = db.query(User).filter_by(id=user_id).first()
+        return ok({'email': user.email if user else None, 'stores': [{'accountId': a.account_id, 'storeDomain': a.store_domain} for a in rows]})
     finally:
         db.close()
 @app.route('/admin/users/<int:user_id>/stores/create', methods=['POST'])
@@ -554,7 +548,12 @@ def status():
             'login': Config.RATE_LIMIT_LOGIN,
             'checkout': Config.RATE_LIMIT_CHECKOUT,
             'webhook': Config.RATE_LIMIT_WEBHOOK
-        }
+        },
+        'dedupe_cache': seen_events.stats(),
+        'stripe_cache': stripe_cache.stats(),
+        'stripe_single_flight': single_flight_stats(),
+        'webhook_spool': webhook_spool.backlog() if Config.WEBHOOK_SPOOL_ENABLED else None,
+        'webhook_sync_leader': worker_lease.current(SYNC_LEASE) if Config.WEBHOOK_SYNC_ENABLED else None
     })
 
 @app.route('/done', methods=['GET'])
@@ -592,6 +591,86 @@ def enforce_account_ownership(account_id):
         return True if exists else False
     finally:
         db.close()
+def _set_store_batch(account_id, enabled):
+    if enabled is None:
+        return error('invalid_payload', 400)
+    enabled = str(enabled).lower() in ('1', 'true', 'yes')
+    db = SessionLocal()
+    try:
+        acc = db.query(StripeAccount).filter_by(account_id=account_id).first()
+        if not acc:
+            return error('account_not_found', 404)
+        acc.dispatch_batch_enabled = enabled
+        db.add(acc)
+        db.commit()
+        return ok({'status': 'updated', 'accountId': account_id, 'batchEnabled': enabled})
+    finally:
+        db.close()
+def _store_circuit(store_domain):
+    if not store_domain:
+        return None
+    try:
+        return circuit_status(host_key(store_domain))
+    except Exception:
+        return None
+def _list_stores():
+    db = SessionLocal()
+    try:
+        q = db.query(StripeAccount, User).join(User, StripeAccount.user_id == User.id)
+        rows, next_cursor = paginate(q, [StripeAccount.id], lambda r: [r[0].id])
+        data = []
+        for acc, user in rows:
+            data.append({
+                'accountId': acc.account_id,
+                'userId': user.id,
+                'email': user.email,
+                'storeDomain': acc.store_domain
+            })
+        return data, next_cursor
+    finally:
+        db.close()
+def _list_users():
+    db = SessionLocal()
+    try:
+        rows, next_cursor = paginate(db.query(User), [User.id], lambda u: [u.id])
+        return [{'id': u.id, 'email': u.email} for u in rows], next_cursor
+    finally:
+        db.close()
+def _list_dispatches(account_id, state=None):
+    db = SessionLocal()
+    try:
+        q = db.query(StoreDispatch).filter_by(account_id=account_id)
+        if state:
+            q = q.filter(StoreDispatch.state == state)
+        rows, next_cursor = paginate(q, [StoreDispatch.id], lambda d: [d.id], descending=True)
+        data = []
+        for d in rows:
+            data.append({
+                'eventId': d.event_id,
+                'orderId': d.order_id,
+                'status': d.status,
+                'state': d.state,
+                'attempts': d.attempts,
+                'nextAttemptAt': d.next_attempt_at.isoformat() if d.next_attempt_at else None,
+                'lastError': d.last_error,
+                'deliveredAt': d.delivered_at.isoformat() if d.delivered_at else None
+            })
+        return data, next_cursor
+    finally:
+        db.close()
+def _list_store_webhooks(account_id):
+    # consulta indexada (ix_webhook_logs_account_received); não abre payloads
+    db = SessionLocal()
+    try:
+        q = db.query(WebhookLog.id, WebhookLog.event_id, WebhookLog.event_type, WebhookLog.received_at).filter(WebhookLog.account_id == account_id)
+        rows, next_cursor = paginate(q, [WebhookLog.received_at, WebhookLog.id], lambda r: [r.received_at, r.id], descending=True)
+        return [{
+            'eventId': r.event_id,
+            'type': r.event_type,
+            'receivedAt': r.received_at.isoformat() if r.received_at else None
+        } for r in rows], next_cursor
+    finally:
+        db.close()
 def admin_required(fn):
     @wraps(fn)
     def _inner(*args, **kwargs):
@@ -622,6 +701,8 @@ def create_product():
     try:
         product = create_product_on_account(product_name, product_description, account_id)
         price = create_price_for_product(product.id, product_price, account_id, recurring_interval)
+        # não espera o webhook price.created para o produto aparecer no catálogo
+        stripe_cache.invalidate_catalog(account_id)
 
         return jsonify({
             'productName': product_name,
@@ -646,10 +727,7 @@ def create_connect_account():
 def get_checkout_session(session_id):
     account_id = request.args.get('accountId') or g.get('stripe_account_id')
     try:
-        if account_id and account_id != 'platform':
-            s = stripe.checkout.Session.retrieve(session_id, stripe_account=account_id)
-        else:
-            s = stripe.checkout.Session.retrieve(session_id)
+        s = retrieve_checkout_session(session_id, account_id)
         return jsonify({
             'id': s.id,
             'status': s.status,
@@ -680,42 +758,36 @@ def account_status(account_id):
     try:
         if not enforce_account_ownership(account_id):
             return jsonify({'error': 'forbidden'}), 403
-        account = stripe_client.v2.core.accounts.retrieve(
-            account_id, {
-                "include": [
-                    "requirements",
-                    "configuration.merchant"
-                ]
-            }
-        )
-        payouts_enabled = (
-            (account.get("configuration") or {}).get("merchant") or {}
-        ).get("capabilities", {}).get("stripe_balance", {}).get("payouts", {}).get(
-            "status"
-        ) == "active"
-        charges_enabled = (
-            (account.get("configuration") or {}).get("merchant") or {}
-        ).get("capabilities", {}).get("card_payments", {}).get("status") == "active"
-        summary_status = (
-            ((account.get("requirements") or {}).get("summary") or {})
-            .get("minimum_deadline", {})
-            .get("status")
-        )
-        details_submitted = (summary_status is None) or (
-            summary_status == "eventually_due"
-        )
-        return jsonify(
-            {
-                "id": account["id"],
-                "payoutsEnabled": payouts_enabled,
-                "chargesEnabled": charges_enabled,
-                "detailsSubmitted": details_submitted,
-                "requirements": (account.get("requirements") or {}).get("entries"),
-            }
-        )
+        return jsonify(stripe_cache.get_account_status(account_id, _fetch_account_summary))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _fetch_account_summary(account_id):
+    account = retrieve_connected_account(stripe_client, account_id)
+    payouts_enabled = (
+        (account.get("configuration") or {}).get("merchant") or {}
+    ).get("capabilities", {}).get("stripe_balance", {}).get("payouts", {}).get(
+        "status"
+    ) == "active"
+    charges_enabled = (
+        (account.get("configuration") or {}).get("merchant") or {}
+    ).get("capabilities", {}).get("card_payments", {}).get("status") == "active"
+    summary_status = (
+        ((account.get("requirements") or {}).get("summary") or {})
+        .get("minimum_deadline", {})
+        .get("status")
+    )
+    details_submitted = (summary_status is None) or (
+        summary_status == "eventually_due"
+    )
+    return {
+        "id": account["id"],
+        "payoutsEnabled": payouts_enabled,
+        "chargesEnabled": charges_enabled,
+        "detailsSubmitted": details_submitted,
+        "requirements": (account.get("requirements") or {}).get("entries"),
+    }
+
 @app.route('/api/products/<account_id>', methods=['GET'])
 @app.route('/api/v1/products/<account_id>', methods=['GET'])
 @auth_required
@@ -724,22 +796,85 @@ def get_products(account_id):
     try:
         if not enforce_account_ownership(account_id):
             return jsonify({'error': 'forbidden'}), 403
+        if request.args.get('limit') or request.args.get('starting_after'):
+            return _products_page(account_id)
+        products = stripe_cache.get_catalog(account_id)
+        if products is not None:
+            return jsonify(products)
+        # a primeira página é buscada aqui: erro da Stripe ainda vira 500 antes do streaming começar
         prices = list_prices_with_products(account_id)
+        return Response(stream_with_context(_stream_products(account_id, prices)), mimetype='application/json')
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        products = []
-        for price in prices.data:
-            products.append({
-                'id': price.product.id,
-                'name': price.product.name,
-                'description': price.product.description,
-                'price': price.unit_amount,
-                'priceId': price.id,
-                'image': 'https://i.imgur.com/6Mvijcm.png'
-            })
+def _product_item(price):
+    return {
+        'id': price.product.id,
+        'name': price.product.name,
+        'description': price.product.description,
+        'price': price.unit_amount,
+        'priceId': price.id,
+        'image': 'https://i.imgur.com/6Mvijcm.png'
+    }
+
+CATALOG_STREAM_ERROR = {'error': 'catalog_stream_interrupted'}
 
-        return jsonify(products)
+def _cache_quietly(fn, *args):
+    # falha do cache nunca interrompe a resposta
+    try:
+        fn(*args)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        structlog.get_logger().warning("stripe_cache_write_failed", operation=fn.__name__, error=str(e))
+
+def _stream_products(account_id, prices):
+    # percorre todas as páginas da Stripe escrevendo o array aos poucos; só catálogos completos vão para o cache.
+    # Se uma página seguinte falhar (status 200 já enviado), o array é fechado com CATALOG_STREAM_ERROR como último item.
+    cached = []
+    page = []
+    count = 0
+    failed = None
+    items = iter(prices.auto_paging_iter())
+    yield '['
+    while True:
+        try:
+            price = next(items)
+        except StopIteration:
+            break
+        except Exception as e:
+            failed = e
+            break
+        item = _product_item(price)
+        yield (',' if count else '') + json.dumps(item)
+        count += 1
+        page.append(price)
+        if len(page) >= 100:
+            _cache_quietly(stripe_cache.put_prices, account_id, page)
+            page = []
+        if cached is not None:
+            cached.append(item)
+            if len(cached) > Config.CATALOG_CACHE_MAX_ITEMS:
+                cached = None
+    _cache_quietly(stripe_cache.put_prices, account_id, page)
+    if failed is not None:
+        structlog.get_logger().warning("catalog_stream_error", account_id=account_id, items=count, error=str(failed))
+        yield (',' if count else '') + json.dumps(CATALOG_STREAM_ERROR) + ']'
+        return
+    yield ']'
+    if cached is not None:
+        _cache_quietly(stripe_cache.put_catalog, account_id, cached)
+
+def _products_page(account_id):
+    # paginação pelo cliente: uma página da Stripe, sem cache; o cursor da próxima vai no cabeçalho
+    try:
+        limit = max(1, min(int(request.args.get('limit') or 100), 100))
+    except ValueError:
+        limit = 100
+    prices = list_prices_with_products(account_id, limit=limit, starting_after=request.args.get('starting_after') or None)
+    _cache_quietly(stripe_cache.put_prices, account_id, prices.data)
+    resp = jsonify([_product_item(p) for p in prices.data])
+    if prices.has_more and prices.data:
+        resp.headers['X-Next-Cursor'] = prices.data[-1].id
+    return resp
 
 @app.route('/api/v1/update-store-domain', methods=['POST'])
 @auth_required
@@ -759,8 +894,16 @@ def update_store_domain():
 def stores_list_user():
     db = SessionLocal()
     try:
-        rows = db.query(StripeAccount).filter_by(user_id=int(g.user_id)).order_by(StripeAccount.id.asc()).all()
-        return jsonify([{'accountId': r.account_id, 'storeDomain': r.store_domain} for r in rows])
+        q = db.query(StripeAccount).filter_by(user_id=int(g.user_id))
+        try:
+            rows, next_cursor = paginate(q, [StripeAccount.id], lambda r: [r.id])
+        except InvalidCursor:
+            return error('invalid_cursor', 400)
+        # corpo continua sendo a lista; o cursor da próxima página vai no cabeçalho
+        resp = jsonify([{'accountId': r.account_id, 'storeDomain': r.store_domain} for r in rows])
+        if next_cursor:
+            resp.headers['X-Next-Cursor'] = next_cursor
+        return resp
     finally:
         db.close()
 
@@ -973,9 +1116,12 @@ def create_checkout_session():
             return jsonify({'error': 'priceId ausente'}), 400
         if not enforce_account_ownership(account_id):
             return jsonify({'error': 'forbidden'}), 403
-        price = retrieve_price(price_id, account_id)
-        price_type = price.type
-        mode = 'subscription' if price_type == 'recurring' else 'payment'
+        meta = stripe_cache.get_price_meta(account_id, price_id)
+        if meta is None:
+            price = retrieve_price(price_id, account_id)
+            stripe_cache.put_prices(account_id, [price])
+            meta = stripe_cache.price_meta(price)
+        mode = 'subscription' if meta['type'] == 'recurring' else 'payment'
         from flask import g as _g
         setattr(_g, "order_id", order_id)
         if order_id:
@@ -1015,7 +1161,7 @@ def create_portal_session():
     if err:
         return jsonify(err), 400
     session_id = payload.session_id
-    checkout_session = stripe.checkout.Session.retrieve(session_id)
+    checkout_session = retrieve_checkout_session(session_id)
     portal_session = stripe.billing_portal.Session.create(
         customer_account=checkout_session.customer_account,
         return_url=f"{Config.DOMAIN}/?session_id={session_id}",
@@ -1026,19 +1172,14 @@ def create_portal_session():
 @app.route('/webhook', methods=['POST'])
 @limiter.limit(Config.RATE_LIMIT_WEBHOOK)
 def webhook_received():
-    secrets_raw = Config.STRIPE_WEBHOOK_SECRET
-    if not secrets_raw:
+    if not Config.STRIPE_WEBHOOK_SECRETS:
         return jsonify({'error': 'webhook_secret_not_configured'}), 500
     sig_header = request.headers.get('stripe-signature')
     body = request.get_data(cache=True)
-    event = None
-    for sec in [s.strip() for s in str(secrets_raw).split(',') if s.strip()]:
-        try:
-            event = verify_webhook(body, sig_header, sec)
-            break
-        except stripe.error.SignatureVerificationError as e:
-            event = None
-            continue
+    try:
+        event = verify_webhook(body, sig_header, Config.STRIPE_WEBHOOK_SECRETS)
+    except (stripe.error.SignatureVerificationError, ValueError):
+        event = None
     if event is None:
         logger = structlog.get_logger()
         logger.warning("webhook_invalid_signature", request_id=g.get('request_id'), error="signature_mismatch_all_secrets")
@@ -1047,115 +1188,56 @@ def webhook_received():
     logger = structlog.get_logger()
     logger.info("webhook_received", request_id=g.get('request_id'), event_id=event.get('id'), event_type=event.get('type'))
 
-    # Persist event log (idempotente por event_id)
-    db = SessionLocal()
-    try:
-        exists_log = db.query(WebhookLog).filter_by(event_id=event['id']).first()
-        if not exists_log:
-            db.add(WebhookLog(event_id=event['id'], event_type=event['type'], payload=json.dumps(event)))
-            db.commit()
-    finally:
-        db.close()
-
-    etype = event.get('type')
-    if etype in ('checkout.session.completed', 'payment_intent.succeeded'):
-        obj = event['data']['object']
-        raw_status = obj.get('payment_status') or obj.get('status')
-        if raw_status in ('paid', 'succeeded', 'completed', 'complete'):
-            normalized_status = 'paid'
-        else:
-            logger.info("webhook_ignored_nonfinal", request_id=g.get('request_id'), event_id=event['id'], event_type=etype, status=raw_status)
-            return jsonify({'status': 'ignored'}), 200
-        db2 = SessionLocal()
+    rid = g.get('request_id')
+    if seen_events.get(event.get('id')) is not None:
+        logger.info("webhook_duplicate", request_id=rid, event_id=event.get('id'), cached=True)
+        return jsonify({'status': 'duplicate'}), 200
+    if stripe_cache.apply_event(event):
+        logger.info("stripe_cache_invalidated", request_id=rid, event_id=event.get('id'), event_type=event.get('type'), account_id=event.get('account'))
+    updated_account = stripe_cache.updated_account(event)
+    if updated_account:
+        stripe_cache.account_status_changed(updated_account, _fetch_account_summary)
+        logger.info("account_status_refresh_scheduled", request_id=rid, event_id=event.get('id'), account_id=updated_account)
+    if Config.WEBHOOK_SPOOL_ENABLED:
         try:
-            exists = db2.query(WebhookEvent).filter_by(event_id=event['id']).first()
-            if exists:
-                logger.info("webhook_duplicate", request_id=g.get('request_id'), event_id=event['id'])
-                return jsonify({'status': 'duplicate'}), 200
-            db2.add(WebhookEvent(event_id=event['id'], status=normalized_status, processed_at=None, source="webhook"))
-            db2.commit()
-        finally:
-            db2.close()
-        acc_id = event.get('account')
-        order_id = None
-        if isinstance(obj, dict):
-            meta = obj.get('metadata') or {}
-            order_id = meta.get('orderId') or obj.get('client_reference_id')
-        if not order_id:
-            logger.info("webhook_missing_order_id", request_id=g.get('request_id'), event_id=event['id'], event_type=etype)
-            return jsonify({'status': 'no_order_id'}), 200
-        if not acc_id:
-            # try resolve account via order correlation
-            dbcorr = SessionLocal()
-            try:
-                from core.db import OrderCorrelation
-                corr = dbcorr.query(OrderCorrelation).filter_by(order_id=order_id).first()
-                if corr:
-                    acc_id = corr.account_id
-                    logger.info("webhook_account_resolved_from_correlation", request_id=g.get('request_id'), event_id=event['id'], order_id=order_id, account_id=acc_id)
-                else:
-                    logger.info("webhook_account_unresolved", request_id=g.get('request_id'), event_id=event['id'], order_id=order_id)
-                    return jsonify({'status': 'success'}), 200
-            finally:
-                dbcorr.close()
-        dispatch_store_webhook(acc_id, order_id, normalized_status, event.get("id"))
+            webhook_spool.append(body)
+            logger.info("webhook_spooled", request_id=rid, event_id=event.get('id'), event_type=event.get('type'))
+            return jsonify({'status': 'accepted'}), 200
+        except OSError as e:
+            # disco indisponível: processa de forma síncrona
+            logger.warning("webhook_spool_append_failed", request_id=rid, event_id=event.get('id'), error=str(e))
+    res = ingest_event(event, raw=body)
+    seen_events.add(res.event_id, dispatched=res.enqueued)
+    if res.status == 'ignored':
+        logger.info("webhook_ignored_nonfinal", request_id=rid, event_id=res.event_id, event_type=res.event_type, status=res.raw_status)
+        return jsonify({'status': 'ignored'}), 200
+    if res.status == 'duplicate':
+        logger.info("webhook_duplicate", request_id=rid, event_id=res.event_id)
+        return jsonify({'status': 'duplicate'}), 200
+    if res.status == 'no_order_id':
+        logger.info("webhook_missing_order_id", request_id=rid, event_id=res.event_id, event_type=res.event_type)
+        return jsonify({'status': 'no_order_id'}), 200
+    if res.status == 'unresolved':
+        logger.info("webhook_account_unresolved", request_id=rid, event_id=res.event_id, order_id=res.order_id)
+    elif res.status == 'processed':
+        if res.account_source == 'correlation':
+            logger.info("webhook_account_resolved_from_correlation", request_id=rid, event_id=res.event_id, order_id=res.order_id, account_id=res.account_id)
+        if res.enqueued:
+            logger.info("store_dispatch_enqueued", request_id=rid, event_id=res.event_id, account_id=res.account_id)
     else:
-        logger.info("webhook_unhandled_type", request_id=g.get('request_id'), event_id=event['id'], event_type=event['type'])
+        logger.info("webhook_unhandled_type", request_id=rid, event_id=res.event_id, event_type=res.event_type)
 
     return jsonify({'status': 'success'})
 
-def dispatch_store_webhook(account_id, order_id, status, event_id):
-    db3 = SessionLocal()
-    try:
-        acc = db3.query(StripeAccount).filter_by(account_id=account_id).first()
-        if acc and acc.store_domain and Config.PAYMENTS_EVENTS_SECRET:
-            payload = {"orderId": order_id, "status": status}
-            body = json.dumps(payload, separators=(",", ":"))
-            sig = hmac.new(
-                Config.PAYMENTS_EVENTS_SECRET.encode("utf-8"),
-                body.encode("utf-8"),
-                hashlib.sha256
-            ).hexdigest()
-            ep = acc.store_domain.rstrip("/") + Config.PAYMENTS_EVENTS_PATH
-            headers = {Config.PAYMENTS_EVENTS_HEADER: sig, "Content-Type": "application/json"}
-            dispatch = db3.query(StoreDispatch).filter_by(event_id=event_id).first()
-            if not dispatch:
-                dispatch = StoreDispatch(event_id=event_id, account_id=account_id, order_id=order_id, status=status, attempts=0)
-                db3.add(dispatch)
-                db3.commit()
-            logger = structlog.get_logger()
-            delays = [1, 2, 4]
-            for attempt, dly in enumerate(delays, start=1):
-                try:
-                    r = requests.post(ep, data=body, headers=headers, timeout=5)
-                    logger.info("store_dispatch_response", request_id=g.get('request_id'), event_id=event_id, status_code=getattr(r, 'status_code', None))
-                    dispatch.attempts = attempt
-                    if getattr(r, 'status_code', 0) == 200:
-                        from datetime import datetime, UTC
-                        dispatch.delivered_at = datetime.now(UTC)
-                        db3.add(dispatch)
-                        db3.commit()
-                        break
-                except Exception:
-                    logger.info("store_dispatch_retry_scheduled", request_id=g.get('request_id'), event_id=event_id, attempt=attempt, delay_seconds=dly)
-                    dispatch.attempts = attempt
-                    db3.add(dispatch)
-                    db3.commit()
-                import time
-                time.sleep(dly)
-        # update processed_at
-        from datetime import datetime, UTC
-        db3.execute(text("UPDATE webhook_events SET processed_at=:ts, order_id=:oid, account_id=:acc, status=:st WHERE event_id=:eid"),
-                    {"ts": datetime.now(UTC), "oid": order_id, "acc": account_id, "st": status, "eid": event_id})
-        db3.commit()
-    finally:
-        db3.close()
-
 @app.route('/internal/sync/stripe-events', methods=['POST'])
 @local_only
 def internal_sync_stripe_events():
-    run_sync_once()
-    return ok({"status": "sync_started"})
+    # roda aqui só se este processo detém o lease; senão o líder atual sincroniza todas as contas no próximo ciclo
+    run_id = run_if_leader(force=True)
+    if run_id is None:
+        schedule_all_now()
+        return ok({"status": "sync_scheduled"})
+    return ok({"status": "sync_started", "runId": run_id})
 
 @app.route('/api/v1/auth/login', methods=['POST'])
 @limiter.limit(Config.RATE_LIMIT_LOGIN)
@@ -1235,20 +1317,11 @@ def admin_ui_users():
 def admin_stores_list_api():
     @admin_required
     def _exec():
-        db = SessionLocal()
         try:
-            rows = db.query(StripeAccount, User).join(User, StripeAccount.user_id == User.id).all()
-            data = []
-            for acc, user in rows:
-                data.append({
-                    'accountId': acc.account_id,
-                    'userId': user.id,
-                    'email': user.email,
-                    'storeDomain': acc.store_domain
-                })
-            return ok({'stores': data})
-        finally:
-            db.close()
+            data, next_cursor = _list_stores()
+        except InvalidCursor:
+            return error('invalid_cursor', 400)
+        return ok({'stores': data, 'next_cursor': next_cursor})
     return _exec()
 
 @app.route('/api/v1/admin/stores/get/<account_id>', methods=['GET'])
@@ -1265,7 +1338,9 @@ def admin_stores_get_api(account_id):
                 'accountId': acc.account_id,
                 'userId': acc.user_id,
                 'email': user.email if user else None,
-                'storeDomain': acc.store_domain
+                'storeDomain': acc.store_domain,
+                'batchEnabled': bool(acc.dispatch_batch_enabled),
+                'circuit': _store_circuit(acc.store_domain)
             })
         finally:
             db.close()
@@ -1275,57 +1350,80 @@ def admin_stores_get_api(account_id):
 def admin_stores_dispatches_api(account_id):
     @admin_required
     def _exec():
-        db = SessionLocal()
         try:
-            rows = db.query(StoreDispatch).filter_by(account_id=account_id).order_by(StoreDispatch.id.desc()).limit(200).all()
-            data = []
-            for d in rows:
-                data.append({
-                    'eventId': d.event_id,
-                    'orderId': d.order_id,
-                    'status': d.status,
-                    'attempts': d.attempts,
-                    'deliveredAt': d.delivered_at.isoformat() if d.delivered_at else None
-                })
-            return ok({'dispatches': data})
-        finally:
-            db.close()
+            data, next_cursor = _list_dispatches(account_id, request.args.get('state'))
+        except InvalidCursor:
+            return error('invalid_cursor', 400)
+        return ok({'dispatches': data, 'next_cursor': next_cursor})
+    return _exec()
+
+@app.route('/api/v1/admin/stores/dispatches/<account_id>/requeue', methods=['POST'])
+def admin_stores_dispatches_requeue_api(account_id):
+    @admin_required
+    def _exec():
+        return ok({'status': 'requeued', 'accountId': account_id, 'requeued': requeue_dead_letters(account_id)})
+    return _exec()
+
+@app.route('/api/v1/admin/dispatches/requeue', methods=['POST'])
+def admin_dispatches_requeue_all_api():
+    @admin_required
+    def _exec():
+        return ok({'status': 'requeued', 'requeued': requeue_dead_letters()})
+    return _exec()
+
+@app.route('/api/v1/admin/replays', methods=['POST'])
+def admin_replays_create_api():
+    @admin_required
+    def _exec():
+        payload, err = parse_and_validate(ReplayCreateSchema, parse_request_body())
+        if err:
+            return error("invalid_payload", 400, message=str(err))
+        since, until = _naive_utc(payload.since), _naive_utc(payload.until)
+        if until and until <= since:
+            return error("invalid_payload", 400, message="until deve ser posterior a since")
+        job_id = create_replay_job(since, until, payload.accountId, payload.eventTypes, payload.dryRun)
+        start_replay_job(job_id)
+        structlog.get_logger().info("webhook_replay_requested", request_id=g.get('request_id'), job_id=job_id, account_id=payload.accountId)
+        return ok(replay_job_status(job_id), 202)
+    return _exec()
+
+@app.route('/api/v1/admin/replays/<int:job_id>', methods=['GET'])
+def admin_replays_get_api(job_id):
+    @admin_required
+    def _exec():
+        job = replay_job_status(job_id)
+        if not job:
+            return error('replay_not_found', 404)
+        return ok(job)
+    return _exec()
+
+@app.route('/api/v1/admin/stores/circuits', methods=['GET'])
+def admin_stores_circuits_api():
+    @admin_required
+    def _exec():
+        return ok({'circuits': list_shed_circuits()})
     return _exec()
 
 @app.route('/api/v1/admin/stores/webhooks/<account_id>', methods=['GET'])
 def admin_stores_webhooks_api(account_id):
     @admin_required
     def _exec():
-        db = SessionLocal()
         try:
-            rows = db.query(WebhookLog).order_by(WebhookLog.id.desc()).limit(400).all()
-            data = []
-            for w in rows:
-                try:
-                    ev = json.loads(w.payload)
-                    if ev.get('account') == account_id:
-                        data.append({
-                            'eventId': ev.get('id'),
-                            'type': ev.get('type'),
-                            'receivedAt': w.received_at.isoformat() if w.received_at else None
-                        })
-                except Exception:
-                    pass
-            return ok({'webhooks': data})
-        finally:
-            db.close()
+            data, next_cursor = _list_store_webhooks(account_id)
+        except InvalidCursor:
+            return error('invalid_cursor', 400)
+        return ok({'webhooks': data, 'next_cursor': next_cursor})
     return _exec()
 
 @app.route('/api/v1/admin/users/list', methods=['GET'])
 def admin_users_list_api():
     @admin_required
     def _exec():
-        db = SessionLocal()
         try:
-            rows = db.query(User).order_by(User.id.asc()).all()
-            return ok({'users': [{'id': u.id, 'email': u.email} for u in rows]})
-        finally:
-            db.close()
+            data, next_cursor = _list_users()
+        except InvalidCursor:
+            return error('invalid_cursor', 400)
+        return ok({'users': data, 'next_cursor': next_cursor})
     return _exec()
 
 @app.route('/api/v1/admin/users/<int:user_id>/stores', methods=['GET'])
@@ -1461,6 +1559,13 @@ def admin_stores_update_api(account_id):
             db.close()
     return _exec()
 
+@app.route('/api/v1/admin/stores/batch/<account_id>', methods=['PUT'])
+def admin_stores_batch_api(account_id):
+    @admin_required
+    def _exec():
+        return _set_store_batch(account_id, parse_request_body().get('enabled'))
+    return _exec()
+
 @app.route('/api/v1/admin/stores/delete/<account_id>', methods=['DELETE'])
 def admin_stores_delete_api(account_id):
     @admin_required
@@ -1483,4 +1588,12 @@ if __name__ == '__main__':
         start_worker()
     except Exception:
         pass
+    try:
+        start_dispatch_workers()
+    except Exception:
+        pass
+    try:
+        webhook_spool.start_spool_consumer()
+    except Exception:
+        pass
     app.run(port=4242, host="::1", debug=False)
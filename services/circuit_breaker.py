@@ -0,0 +1,198 @@
+import threading
+from datetime import datetime, timedelta
+import structlog
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from core.config import Config
+from core.db import SessionLocal, StoreCircuit
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+FIELDS = ("state", "window_started_at", "window_requests", "window_failures", "opened_at", "next_probe_at")
+
+# estado via concorrência otimista: save() só grava se a versão lida ainda for a atual
+class DbCircuitBackend:
+    def load(self, key):
+        db = SessionLocal()
+        try:
+            row = db.query(StoreCircuit).filter_by(store_key=key).first()
+            if not row:
+                return None
+            data = {f: getattr(row, f) for f in FIELDS}
+            data["version"] = row.version
+            return data
+        finally:
+            db.close()
+
+    def save(self, key, values, version):
+        db = SessionLocal()
+        try:
+            fields = {f: values.get(f) for f in FIELDS}
+            if version is None:
+                db.add(StoreCircuit(store_key=key, version=1, updated_at=datetime.utcnow(), **fields))
+                db.commit()
+                return True
+            res = db.execute(
+                update(StoreCircuit)
+                .where(StoreCircuit.store_key == key, StoreCircuit.version == version)
+                .values(version=version + 1, updated_at=datetime.utcnow(), **fields)
+            )
+            db.commit()
+            return res.rowcount == 1
+        except IntegrityError:
+            db.rollback()
+            return False
+        finally:
+            db.close()
+
+    def list(self, states):
+        db = SessionLocal()
+        try:
+            rows = db.query(StoreCircuit).filter(StoreCircuit.state.in_(states)).order_by(StoreCircuit.opened_at.desc()).all()
+            out = []
+            for row in rows:
+                data = {f: getattr(row, f) for f in FIELDS}
+                data["key"] = row.store_key
+                out.append(data)
+            return out
+        finally:
+            db.close()
+
+class MemoryCircuitBackend:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        with self._lock:
+            cur = self._data.get(key)
+            return dict(cur) if cur else None
+
+    def save(self, key, values, version):
+        with self._lock:
+            cur = self._data.get(key)
+            if (cur["version"] if cur else None) != version:
+                return False
+            data = {f: values.get(f) for f in FIELDS}
+            data["version"] = (version or 0) + 1
+            self._data[key] = data
+            return True
+
+    def list(self, states):
+        with self._lock:
+            return [dict(v, key=k) for k, v in self._data.items() if v["state"] in states]
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = MemoryCircuitBackend() if Config.CIRCUIT_BREAKER_BACKEND == "memory" else DbCircuitBackend()
+        return _backend
+
+def set_backend(backend):
+    global _backend
+    with _backend_lock:
+        _backend = backend
+    with _pending_lock:
+        _pending.clear()
+
+# sucessos com o circuito fechado e sem falhas na janela não mudam o estado: ficam no processo
+# e entram no contador junto com a próxima gravação (ou a cada CIRCUIT_BREAKER_MIN_REQUESTS)
+_pending = {}
+_pending_lock = threading.Lock()
+
+def _buffer_success(key, now, window):
+    with _pending_lock:
+        count, since = _pending.get(key, (0, now))
+        if now - since > window:
+            count, since = 0, now
+        if count + 1 >= max(1, Config.CIRCUIT_BREAKER_MIN_REQUESTS):
+            return False
+        _pending[key] = (count + 1, since)
+        return True
+
+def _take_pending(key, now, window):
+    with _pending_lock:
+        count, since = _pending.pop(key, (0, now))
+    return count if now - since <= window else 0
+
+def _closed(now):
+    return {"state": STATE_CLOSED, "window_started_at": now, "window_requests": 0, "window_failures": 0, "opened_at": None, "next_probe_at": None}
+
+def _opened(now):
+    return {"state": STATE_OPEN, "window_started_at": now, "window_requests": 0, "window_failures": 0, "opened_at": now,
+            "next_probe_at": now + timedelta(seconds=max(1, Config.CIRCUIT_BREAKER_OPEN_SECONDS))}
+
+def allow_request(key, now=None):
+    # retorna (permitido, quando tentar de novo)
+    now = now or datetime.utcnow()
+    backend = get_backend()
+    for _ in range(3):
+        cur = backend.load(key)
+        if not cur or cur["state"] == STATE_CLOSED:
+            return True, None
+        if cur["next_probe_at"] and now < cur["next_probe_at"]:
+            return False, cur["next_probe_at"]
+        # aberto e vencido (ou probe anterior abandonado): este chamador vira o probe half-open
+        probe = dict(cur, state=STATE_HALF_OPEN, next_probe_at=now + timedelta(seconds=max(1, Config.STORE_DISPATCH_LEASE_SECONDS)))
+        if backend.save(key, probe, cur["version"]):
+            return True, None
+    return False, now + timedelta(seconds=max(1, Config.CIRCUIT_BREAKER_OPEN_SECONDS))
+
+def record_result(key, success, now=None):
+    now = now or datetime.utcnow()
+    backend = get_backend()
+    window = timedelta(seconds=max(1, Config.CIRCUIT_BREAKER_WINDOW_SECONDS))
+    pending = None
+    for _ in range(3):
+        cur = backend.load(key)
+        version = cur["version"] if cur else None
+        st = cur or _closed(now)
+        if st["state"] != STATE_CLOSED:
+            new = _closed(now) if success else _opened(now)
+        else:
+            new = dict(st)
+            window_start = new["window_started_at"] or now
+            expired = now - window_start > window
+            if success and pending is None and (expired or not new["window_failures"]) and _buffer_success(key, now, window):
+                return STATE_CLOSED
+            if expired:
+                new.update(window_started_at=now, window_requests=0, window_failures=0)
+            if pending is None:
+                pending = _take_pending(key, now, window)
+            new["window_requests"] += 1 + pending
+            new["window_failures"] += 0 if success else 1
+            if (new["window_requests"] >= Config.CIRCUIT_BREAKER_MIN_REQUESTS
+                    and new["window_failures"] * 100 >= Config.CIRCUIT_BREAKER_FAILURE_RATE_PERCENT * new["window_requests"]):
+                new = _opened(now)
+        if backend.save(key, new, version):
+            return new["state"]
+    # três conflitos seguidos: o resultado (e os sucessos acumulados) ficam de fora da janela
+    structlog.get_logger().warning("circuit_result_dropped", store_key=key, success=success, pending_successes=pending or 0)
+    return None
+
+def _summary(data):
+    return {
+        "state": data["state"],
+        "windowRequests": data["window_requests"],
+        "windowFailures": data["window_failures"],
+        "openedAt": data["opened_at"].isoformat() if data.get("opened_at") else None,
+        "nextProbeAt": data["next_probe_at"].isoformat() if data.get("next_probe_at") else None,
+    }
+
+def circuit_status(key):
+    cur = get_backend().load(key)
+    return _summary(cur or _closed(None))
+
+def list_shed_circuits():
+    out = []
+    for data in get_backend().list((STATE_OPEN, STATE_HALF_OPEN)):
+        item = _summary(data)
+        item["storeKey"] = data["key"]
+        out.append(item)
+    return out
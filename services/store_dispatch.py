@@ -0,0 +1,323 @@
+import json
+import hmac
+import hashlib
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+import structlog
+from sqlalchemy import update
+from core import outbound_http
+from core.config import Config
+from core.db import SessionLocal, StripeAccount, StoreDispatch
+from services import circuit_breaker
+
+STATE_PENDING = "pending"
+STATE_DELIVERED = "delivered"
+STATE_DEAD = "dead"
+STATE_DEFERRED = "deferred"
+DUE_STATES = (STATE_PENDING, STATE_DEFERRED)
+
+_workers = []
+_workers_lock = threading.Lock()
+
+def _store_endpoint(acc):
+    if not acc or not acc.store_domain or not Config.PAYMENTS_EVENTS_SECRET:
+        return None
+    return acc.store_domain.rstrip("/") + Config.PAYMENTS_EVENTS_PATH
+
+def _signed_request(order_id, status):
+    payload = {"orderId": order_id, "status": status}
+    body = json.dumps(payload, separators=(",", ":"))
+    sig = hmac.new(
+        Config.PAYMENTS_EVENTS_SECRET.encode("utf-8"),
+        body.encode("utf-8"),
+        hashlib.sha256
+    ).hexdigest()
+    headers = {Config.PAYMENTS_EVENTS_HEADER: sig, "Content-Type": "application/json"}
+    return body, headers
+
+def next_retry_delay(attempts):
+    # backoff exponencial com "equal jitter": metade fixa, metade aleatória
+    base = max(1, Config.STORE_DISPATCH_BACKOFF_BASE_SECONDS)
+    delay = min(Config.STORE_DISPATCH_BACKOFF_MAX_SECONDS, base * (2 ** max(0, attempts - 1)))
+    return random.uniform(delay / 2.0, delay)
+
+def enqueue_dispatch(db, account_id, order_id, status, event_id, acc=None, known_new=False):
+    # grava no outbox usando a sessão do chamador; o commit fica a cargo dele
+    # acc/known_new: o chamador já carregou a conta e sabe que não há linha para o evento (lotes do sync)
+    if acc is None:
+        acc = db.query(StripeAccount).filter_by(account_id=account_id).first()
+    if not _store_endpoint(acc):
+        return None
+    due = datetime.utcnow()
+    if acc.dispatch_batch_enabled:
+        # lojas em modo lote aguardam a janela para agrupar pedidos
+        due = due + timedelta(seconds=Config.STORE_DISPATCH_BATCH_WINDOW_SECONDS)
+    dispatch = None if known_new else db.query(StoreDispatch).filter_by(event_id=event_id).first()
+    if not dispatch:
+        dispatch = StoreDispatch(event_id=event_id, account_id=account_id, order_id=order_id, status=status, attempts=0, next_attempt_at=due, state=STATE_PENDING)
+        db.add(dispatch)
+    return dispatch
+
+def requeue_dead_letters(account_id=None):
+    values = {"state": STATE_PENDING, "attempts": 0, "next_attempt_at": datetime.utcnow()}
+    stmt = update(StoreDispatch).where(StoreDispatch.state == STATE_DEAD)
+    if account_id:
+        stmt = stmt.where(StoreDispatch.account_id == account_id)
+    db = SessionLocal()
+    try:
+        res = db.execute(stmt.values(**values))
+        db.commit()
+        return res.rowcount
+    finally:
+        db.close()
+
+def lease_until():
+    # segundos inteiros: o valor volta do banco igual ao gravado (DATETIME sem fração no MySQL) e serve de compare-and-set
+    return (datetime.utcnow() + timedelta(seconds=max(1, Config.STORE_DISPATCH_LEASE_SECONDS))).replace(microsecond=0)
+
+def _claim_due(limit, account_id=None, due_before=None, exclude=()):
+    # devolve (id, conta, lease); a entrega só acontece se o lease ainda for de quem fez o claim
+    now = datetime.utcnow()
+    lease = lease_until()
+    db = SessionLocal()
+    try:
+        q = db.query(StoreDispatch.id, StoreDispatch.account_id, StoreDispatch.next_attempt_at).filter(
+            StoreDispatch.state.in_(DUE_STATES), StoreDispatch.next_attempt_at <= (due_before or now)
+        )
+        if account_id:
+            q = q.filter(StoreDispatch.account_id == account_id)
+        if exclude:
+            q = q.filter(StoreDispatch.id.notin_(list(exclude)))
+        rows = q.order_by(StoreDispatch.next_attempt_at.asc()).limit(limit).all()
+        claimed = []
+        for rid, acc_id, due in rows:
+            # compare-and-set em next_attempt_at: só um worker (de qualquer processo) leva a linha
+            res = db.execute(
+                update(StoreDispatch)
+                .where(StoreDispatch.id == rid, StoreDispatch.state.in_(DUE_STATES), StoreDispatch.next_attempt_at == due)
+                .values(next_attempt_at=lease)
+            )
+            if res.rowcount == 1:
+                claimed.append((rid, acc_id, lease))
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+def _batch_request(dispatches):
+    # agrupa até STORE_DISPATCH_BATCH_MAX_BYTES; o que sobrar volta para a fila
+    orders, included = [], []
+    size = len('{"orders":[]}')
+    for d in dispatches:
+        item = json.dumps({"eventId": d.event_id, "orderId": d.order_id, "status": d.status}, separators=(",", ":"))
+        if included and size + len(item) + 1 > Config.STORE_DISPATCH_BATCH_MAX_BYTES:
+            break
+        orders.append(item)
+        included.append(d)
+        size += len(item) + 1
+    body = '{"orders":[' + ",".join(orders) + "]}"
+    sig = hmac.new(
+        Config.PAYMENTS_EVENTS_SECRET.encode("utf-8"),
+        body.encode("utf-8"),
+        hashlib.sha256
+    ).hexdigest()
+    headers = {Config.PAYMENTS_EVENTS_HEADER: sig, "Content-Type": "application/json"}
+    return body, headers, included
+
+def _acknowledged(r):
+    # resposta 200 sem "acknowledged" confirma todos os pedidos do lote
+    try:
+        data = r.json()
+    except Exception:
+        return None
+    if isinstance(data, dict) and isinstance(data.get("acknowledged"), list):
+        return set(str(o) for o in data["acknowledged"])
+    return None
+
+def _mark_delivered(dispatch):
+    dispatch.state = STATE_DELIVERED
+    dispatch.delivered_at = datetime.utcnow()
+    dispatch.next_attempt_at = None
+    dispatch.last_error = None
+
+def _mark_failed(dispatch, err, logger):
+    dispatch.last_error = err[:1000]
+    if dispatch.attempts < Config.STORE_DISPATCH_MAX_ATTEMPTS:
+        dly = next_retry_delay(dispatch.attempts)
+        dispatch.next_attempt_at = datetime.utcnow() + timedelta(seconds=dly)
+        logger.info("store_dispatch_retry_scheduled", event_id=dispatch.event_id, attempt=dispatch.attempts, delay_seconds=int(dly), error=dispatch.last_error)
+    else:
+        dispatch.state = STATE_DEAD
+        dispatch.next_attempt_at = None
+        logger.warning("store_dispatch_dead_letter", event_id=dispatch.event_id, attempts=dispatch.attempts, error=dispatch.last_error)
+
+def _deliver(db, acc, dispatches, batch, logger):
+    ep = _store_endpoint(acc)
+    if not ep:
+        for d in dispatches:
+            d.state = STATE_DEAD
+            d.next_attempt_at = None
+            d.last_error = "store_not_configured"
+            db.add(d)
+        db.commit()
+        return 0
+    circuit_key = outbound_http.host_key(ep)
+    if Config.CIRCUIT_BREAKER_ENABLED:
+        allowed, retry_at = circuit_breaker.allow_request(circuit_key)
+        if not allowed:
+            # loja em circuito aberto: adia sem consumir tentativa
+            for d in dispatches:
+                d.state = STATE_DEFERRED
+                d.next_attempt_at = retry_at
+                d.last_error = "circuit_open"
+                db.add(d)
+            db.commit()
+            logger.info("store_dispatch_deferred", store=circuit_key, count=len(dispatches), retry_at=retry_at.isoformat())
+            return 0
+    if batch:
+        body, headers, included = _batch_request(dispatches)
+        for d in dispatches[len(included):]:
+            d.next_attempt_at = datetime.utcnow()
+            db.add(d)
+    else:
+        body, headers = _signed_request(dispatches[0].order_id, dispatches[0].status)
+        included = dispatches[:1]
+    for d in included:
+        d.state = STATE_PENDING
+        d.attempts = (d.attempts or 0) + 1
+    err, acked = None, None
+    try:
+        r = outbound_http.post(ep, data=body, headers=headers)
+        logger.info("store_dispatch_response", event_id=included[0].event_id, count=len(included), batch=batch, status_code=getattr(r, "status_code", None))
+        if getattr(r, "status_code", 0) != 200:
+            err = f"http_{getattr(r, 'status_code', None)}"
+        elif batch:
+            acked = _acknowledged(r)
+    except Exception as e:
+        err = str(e) or e.__class__.__name__
+    if Config.CIRCUIT_BREAKER_ENABLED:
+        circuit_state = circuit_breaker.record_result(circuit_key, err is None)
+        if circuit_state == circuit_breaker.STATE_OPEN:
+            logger.warning("store_circuit_open", store=circuit_key, event_id=included[0].event_id)
+    delivered = 0
+    for d in included:
+        if err is not None:
+            _mark_failed(d, err, logger)
+        elif acked is not None and str(d.order_id) not in acked:
+            _mark_failed(d, "not_acknowledged", logger)
+        else:
+            _mark_delivered(d)
+            delivered += 1
+        db.add(d)
+    db.commit()
+    return delivered
+
+def _renew_leases(db, claims, logger):
+    # claims: (id, lease gravado no claim); renova logo antes do POST só as linhas cujo lease ainda é nosso.
+    # Um claim longo (vários POSTs lentos) pode vencer e a linha ser levada por outro worker: essa não é enviada
+    owned = []
+    for rid, lease in claims:
+        res = db.execute(
+            update(StoreDispatch)
+            .where(StoreDispatch.id == rid, StoreDispatch.state.in_(DUE_STATES), StoreDispatch.next_attempt_at == lease)
+            .values(next_attempt_at=lease_until())
+        )
+        if res.rowcount == 1:
+            owned.append(rid)
+        else:
+            logger.info("store_dispatch_lease_lost", dispatch_id=rid)
+    db.commit()
+    return owned
+
+def deliver_dispatch(dispatch_id, lease):
+    logger = structlog.get_logger()
+    db = SessionLocal()
+    try:
+        if not _renew_leases(db, [(dispatch_id, lease)], logger):
+            return False
+        dispatch = db.get(StoreDispatch, dispatch_id)
+        acc = db.query(StripeAccount).filter_by(account_id=dispatch.account_id).first()
+        return _deliver(db, acc, [dispatch], False, logger) == 1
+    finally:
+        db.close()
+
+def deliver_batch(account_id, claims):
+    logger = structlog.get_logger()
+    db = SessionLocal()
+    try:
+        owned = _renew_leases(db, claims, logger)
+        if not owned:
+            return 0
+        rows = (
+            db.query(StoreDispatch)
+            .filter(StoreDispatch.id.in_(owned))
+            .order_by(StoreDispatch.id.asc())
+            .all()
+        )
+        if not rows:
+            return 0
+        acc = db.query(StripeAccount).filter_by(account_id=account_id).first()
+        return _deliver(db, acc, rows, True, logger)
+    finally:
+        db.close()
+
+def _batch_accounts(account_ids):
+    if not account_ids:
+        return set()
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(StripeAccount.account_id)
+            .filter(StripeAccount.account_id.in_(list(account_ids)), StripeAccount.dispatch_batch_enabled.is_(True))
+            .all()
+        )
+        return set(r[0] for r in rows)
+    finally:
+        db.close()
+
+def process_due_dispatches(limit=None):
+    logger = structlog.get_logger()
+    claimed = _claim_due(limit or Config.STORE_DISPATCH_BATCH_SIZE)
+    batch_accounts = _batch_accounts(set(acc_id for _, acc_id, _ in claimed))
+    singles = [(rid, lease) for rid, acc_id, lease in claimed if acc_id not in batch_accounts]
+    total = len(claimed)
+    for acc_id in batch_accounts:
+        claims = [(rid, lease) for rid, a, lease in claimed if a == acc_id]
+        room = Config.STORE_DISPATCH_BATCH_MAX_ORDERS - len(claims)
+        if room > 0:
+            # puxa também o que chegou dentro da janela de agrupamento da mesma loja
+            horizon = datetime.utcnow() + timedelta(seconds=Config.STORE_DISPATCH_BATCH_WINDOW_SECONDS)
+            more = _claim_due(room, account_id=acc_id, due_before=horizon, exclude=[rid for rid, _ in claims])
+            claims += [(rid, lease) for rid, _, lease in more]
+            total += len(more)
+        try:
+            deliver_batch(acc_id, claims)
+        except Exception as e:
+            logger.warning("store_dispatch_error", account_id=acc_id, error=str(e))
+    for dispatch_id, lease in singles:
+        try:
+            deliver_dispatch(dispatch_id, lease)
+        except Exception as e:
+            logger.warning("store_dispatch_error", dispatch_id=dispatch_id, error=str(e))
+    return total
+
+def start_dispatch_workers():
+    with _workers_lock:
+        if _workers or Config.STORE_DISPATCH_WORKERS <= 0:
+            return
+        for i in range(Config.STORE_DISPATCH_WORKERS):
+            t = threading.Thread(target=_loop, name=f"StoreDispatchWorker-{i + 1}", daemon=True)
+            t.start()
+            _workers.append(t)
+
+def _loop():
+    while True:
+        processed = 0
+        try:
+            processed = process_due_dispatches()
+        except Exception as e:
+            structlog.get_logger().warning("store_dispatch_loop_error", error=str(e))
+        if not processed:
+            time.sleep(max(1, Config.STORE_DISPATCH_POLL_SECONDS))
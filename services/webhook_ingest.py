@@ -0,0 +1,106 @@
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+from sqlalchemy.exc import IntegrityError
+from core import payload_codec
+from core.db import SessionLocal, WebhookEvent, WebhookLog, OrderCorrelation
+from services.store_dispatch import enqueue_dispatch
+
+DISPATCH_EVENT_TYPES = ("checkout.session.completed", "payment_intent.succeeded")
+
+@dataclass
+class IngestResult:
+    status: str
+    event_id: str
+    event_type: Optional[str] = None
+    raw_status: Optional[str] = None
+    order_id: Optional[str] = None
+    account_id: Optional[str] = None
+    account_source: Optional[str] = None
+    enqueued: bool = False
+
+def _normalize_status(obj):
+    raw = obj.get("payment_status") or obj.get("status")
+    if raw in ("paid", "succeeded", "completed", "complete"):
+        return "paid", raw
+    return None, raw
+
+def _extract_order_id(obj):
+    if not isinstance(obj, dict):
+        return None
+    meta = obj.get("metadata") or {}
+    return meta.get("orderId") or obj.get("client_reference_id")
+
+def log_columns(event):
+    # colunas indexadas de webhook_logs, extraídas uma vez na ingestão
+    created = event.get("created")
+    return {
+        "account_id": event.get("account"),
+        "event_created": datetime.utcfromtimestamp(created) if isinstance(created, (int, float)) else None,
+    }
+
+def stored_payload(event, raw=None, source="webhook"):
+    # guarda os bytes originais quando disponíveis, sem re-serializar o evento
+    if raw is None:
+        return json.dumps(event), None
+    if isinstance(raw, (bytes, bytearray)):
+        raw = bytes(raw).decode("utf-8")
+    return raw, source
+
+def ingest_event(event, raw=None, source="webhook"):
+    # log, dedupe, correlação e resolução da conta numa única sessão/commit
+    event_id = event["id"]
+    etype = event.get("type")
+    result = IngestResult(status="unhandled", event_id=event_id, event_type=etype)
+    db = SessionLocal()
+    try:
+        if not db.query(WebhookLog.id).filter_by(event_id=event_id).first():
+            payload, payload_source = stored_payload(event, raw, source)
+            db.add(WebhookLog(event_id=event_id, event_type=etype, payload_source=payload_source,
+                              **log_columns(event), **payload_codec.encode(payload)))
+        if etype in DISPATCH_EVENT_TYPES:
+            _ingest_payment(db, event, result)
+        db.commit()
+        return result
+    except IntegrityError:
+        # entrega concorrente do mesmo event_id ganhou a corrida
+        db.rollback()
+        result.status = "duplicate"
+        result.enqueued = False
+        return result
+    finally:
+        db.close()
+
+def _ingest_payment(db, event, result):
+    obj = event["data"]["object"]
+    status, raw_status = _normalize_status(obj)
+    result.raw_status = raw_status
+    if not status:
+        result.status = "ignored"
+        return
+    if db.query(WebhookEvent.id).filter_by(event_id=result.event_id).first():
+        result.status = "duplicate"
+        return
+    wev = WebhookEvent(event_id=result.event_id, status=status, processed_at=None, source="webhook")
+    db.add(wev)
+    order_id = _extract_order_id(obj)
+    result.order_id = order_id
+    if not order_id:
+        result.status = "no_order_id"
+        return
+    acc_id = event.get("account")
+    result.account_source = "event" if acc_id else None
+    if not acc_id:
+        corr = db.query(OrderCorrelation).filter_by(order_id=order_id).first()
+        if not corr:
+            result.status = "unresolved"
+            return
+        acc_id = corr.account_id
+        result.account_source = "correlation"
+    result.account_id = acc_id
+    result.enqueued = enqueue_dispatch(db, acc_id, order_id, status, result.event_id) is not None
+    wev.processed_at = datetime.utcnow()
+    wev.order_id = order_id
+    wev.account_id = acc_id
+    result.status = "processed"
@@ -0,0 +1,93 @@
+import json
+import sys
+import time
+import structlog
+from sqlalchemy import or_, update
+from core import payload_codec
+from core.config import Config
+from core.db import SessionLocal, WebhookLog, init_db
+from services.webhook_ingest import log_columns
+
+def compress_existing_payloads(batch_size=500, pause_seconds=0.0, codec=None):
+    # lotes curtos por id crescente: cada commit segura poucas linhas por pouco tempo
+    logger = structlog.get_logger()
+    codec = codec or Config.WEBHOOK_PAYLOAD_CODEC
+    last_id, total = 0, 0
+    while True:
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(WebhookLog.id, WebhookLog.payload)
+                .filter(WebhookLog.id > last_id, or_(WebhookLog.payload_codec.is_(None), WebhookLog.payload_codec == payload_codec.CODEC_IDENTITY))
+                .order_by(WebhookLog.id.asc())
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            for rid, payload in rows:
+                values = payload_codec.encode(payload or "", codec)
+                if values["payload_codec"] == payload_codec.CODEC_IDENTITY:
+                    continue
+                db.execute(
+                    update(WebhookLog)
+                    .where(WebhookLog.id == rid, or_(WebhookLog.payload_codec.is_(None), WebhookLog.payload_codec == payload_codec.CODEC_IDENTITY))
+                    .values(**values)
+                )
+                total += 1
+            db.commit()
+            last_id = rows[-1][0]
+        finally:
+            db.close()
+        logger.info("webhook_payload_backfill_batch", last_id=last_id, compressed=total)
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    return total
+
+def backfill_event_columns(batch_size=500, pause_seconds=0.0):
+    # preenche account_id/event_created de linhas antigas; lê o payload só dessas linhas
+    logger = structlog.get_logger()
+    last_id, total = 0, 0
+    while True:
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(WebhookLog)
+                .filter(WebhookLog.id > last_id, WebhookLog.event_created.is_(None), WebhookLog.account_id.is_(None))
+                .order_by(WebhookLog.id.asc())
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            for w in rows:
+                try:
+                    values = log_columns(json.loads(payload_codec.payload_of(w)))
+                except (ValueError, AttributeError):
+                    continue
+                if values["account_id"] is None and values["event_created"] is None:
+                    continue
+                db.execute(update(WebhookLog).where(WebhookLog.id == w.id).values(**values))
+                total += 1
+            db.commit()
+            last_id = rows[-1].id
+        finally:
+            db.close()
+        logger.info("webhook_columns_backfill_batch", last_id=last_id, updated=total)
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    return total
+
+if __name__ == "__main__":
+    # python -m services.webhook_log_maintenance compress|columns [batch_size] [pause_seconds]
+    args = sys.argv[1:]
+    if not args or args[0] not in ("compress", "columns"):
+        print("uso: python -m services.webhook_log_maintenance compress|columns [batch_size] [pause_seconds]")
+        sys.exit(2)
+    init_db()
+    batch = int(args[1]) if len(args) > 1 else 500
+    pause = float(args[2]) if len(args) > 2 else 0.0
+    if args[0] == "compress":
+        print(f"{compress_existing_payloads(batch, pause)} payloads comprimidos")
+    else:
+        print(f"{backfill_event_columns(batch, pause)} registros atualizados")
@@ -0,0 +1,239 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import structlog
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import undefer
+from core import payload_codec
+from core.config import Config
+from core.db import SessionLocal, ReplayJob, WebhookLog, WebhookEvent, OrderCorrelation, StoreDispatch, StripeAccount
+from services.store_dispatch import DUE_STATES, STATE_PENDING, enqueue_dispatch, deliver_dispatch, deliver_batch, lease_until
+from services.webhook_ingest import DISPATCH_EVENT_TYPES, _normalize_status, _extract_order_id
+
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+class _StoreRateGate:
+    # espaça as entregas de cada loja em 1/rate segundos
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, key):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(key, now))
+            self._next[key] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+def create_job(since, until=None, account_id=None, event_types=None, dry_run=False):
+    db = SessionLocal()
+    try:
+        job = ReplayJob(
+            account_id=account_id,
+            event_types=",".join(event_types) if event_types else None,
+            since=since,
+            until=until,
+            dry_run=bool(dry_run),
+            state=STATE_QUEUED,
+        )
+        db.add(job)
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+def fail_stale_jobs(job_id=None):
+    # as threads de replay não sobrevivem a restart/deploy: job sem progresso há REPLAY_STALE_MINUTES vira failed
+    now = datetime.utcnow()
+    cutoff = now - timedelta(minutes=max(1, Config.REPLAY_STALE_MINUTES))
+    stmt = update(ReplayJob).where(
+        ReplayJob.state.in_((STATE_QUEUED, STATE_RUNNING)),
+        func.coalesce(ReplayJob.updated_at, ReplayJob.started_at, ReplayJob.created_at) < cutoff,
+    )
+    if job_id is not None:
+        stmt = stmt.where(ReplayJob.id == job_id)
+    db = SessionLocal()
+    try:
+        res = db.execute(stmt.values(state=STATE_FAILED, finished_at=now, message="interrupted"))
+        db.commit()
+        return res.rowcount
+    finally:
+        db.close()
+
+def job_status(job_id):
+    fail_stale_jobs(job_id)
+    db = SessionLocal()
+    try:
+        job = db.get(ReplayJob, job_id)
+        return _summary(job) if job else None
+    finally:
+        db.close()
+
+def _summary(job):
+    return {
+        "jobId": job.id,
+        "state": job.state,
+        "accountId": job.account_id,
+        "eventTypes": job.event_types.split(",") if job.event_types else list(DISPATCH_EVENT_TYPES),
+        "since": job.since.isoformat() if job.since else None,
+        "until": job.until.isoformat() if job.until else None,
+        "dryRun": bool(job.dry_run),
+        "matched": job.matched,
+        "delivered": job.delivered,
+        "pending": job.pending,
+        "skipped": job.skipped,
+        "startedAt": job.started_at.isoformat() if job.started_at else None,
+        "finishedAt": job.finished_at.isoformat() if job.finished_at else None,
+        "message": job.message,
+    }
+
+def _save_progress(job_id, **values):
+    db = SessionLocal()
+    try:
+        job = db.get(ReplayJob, job_id)
+        for k, v in values.items():
+            setattr(job, k, v)
+        job.updated_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+def _candidates(db, job, last_id):
+    # janela pelo created do evento (índice event_type, event_created); linhas antigas sem a coluna
+    # precisam do backfill (python -m services.webhook_log_maintenance columns)
+    types = job.event_types.split(",") if job.event_types else list(DISPATCH_EVENT_TYPES)
+    q = (
+        db.query(WebhookLog, WebhookEvent.account_id, WebhookEvent.order_id)
+        .outerjoin(WebhookEvent, WebhookEvent.event_id == WebhookLog.event_id)
+        .options(undefer(WebhookLog.payload_blob))
+        .filter(WebhookLog.id > last_id, WebhookLog.event_type.in_(types), WebhookLog.event_created >= job.since)
+    )
+    if job.until:
+        q = q.filter(WebhookLog.event_created < job.until)
+    if job.account_id:
+        q = q.filter(or_(WebhookEvent.account_id == job.account_id, WebhookLog.account_id == job.account_id, WebhookEvent.account_id.is_(None)))
+    return q.order_by(WebhookLog.id.asc()).limit(max(1, Config.REPLAY_BATCH_SIZE)).all()
+
+def _targets(db, rows):
+    # (conta, pedido, status) a reenviar por linha, ou None se o evento não gera notificação;
+    # pedidos sem conta resolvem pela correlação numa consulta só por lote
+    parsed = []
+    for log, account_id, order_id in rows:
+        try:
+            obj = json.loads(payload_codec.payload_of(log))["data"]["object"]
+        except (ValueError, KeyError, TypeError):
+            parsed.append(None)
+            continue
+        status, _ = _normalize_status(obj)
+        order_id = order_id or _extract_order_id(obj)
+        parsed.append((account_id or log.account_id, order_id, status) if status and order_id else None)
+    orders = {p[1] for p in parsed if p and not p[0]}
+    corr = dict(db.query(OrderCorrelation.order_id, OrderCorrelation.account_id).filter(OrderCorrelation.order_id.in_(orders))) if orders else {}
+    targets = []
+    for p in parsed:
+        account_id = p[0] or corr.get(p[1]) if p else None
+        targets.append((account_id, p[1], p[2]) if account_id else None)
+    return targets
+
+def _queue(db, acc, order_id, status, event_id):
+    # reaproveita a linha do outbox sob o lease do job e devolve (id, lease); None: loja sem domínio/segredo;
+    # False: a linha está com um worker do outbox ou já agendada, e ele a entrega
+    dispatch = enqueue_dispatch(db, acc.account_id, order_id, status, event_id, acc=acc) if acc else None
+    if dispatch is None:
+        return None
+    now = datetime.utcnow()
+    lease = lease_until()
+    if dispatch.id is None:
+        dispatch.next_attempt_at = lease
+        db.flush()
+        return dispatch.id, lease
+    # compare-and-set: só reabre entregue/dead ou pendente vencida (sem lease de outro worker)
+    res = db.execute(
+        update(StoreDispatch)
+        .where(StoreDispatch.id == dispatch.id, or_(
+            StoreDispatch.state.notin_(DUE_STATES), StoreDispatch.next_attempt_at.is_(None), StoreDispatch.next_attempt_at <= now))
+        .values(state=STATE_PENDING, attempts=0, last_error=None, delivered_at=None, next_attempt_at=lease)
+    )
+    return (dispatch.id, lease) if res.rowcount == 1 else False
+
+def run_job(job_id):
+    logger = structlog.get_logger()
+    db = SessionLocal()
+    try:
+        job = db.get(ReplayJob, job_id)
+        if not job or job.state != STATE_QUEUED:
+            return
+        db.expunge(job)
+    finally:
+        db.close()
+    started = datetime.utcnow()
+    _save_progress(job_id, state=STATE_RUNNING, started_at=started)
+    logger.info("webhook_replay_started", job_id=job_id, account_id=job.account_id, since=job.since.isoformat(), dry_run=bool(job.dry_run))
+    gate = _StoreRateGate(Config.REPLAY_RATE_PER_STORE)
+    counts = {"matched": 0, "delivered": 0, "pending": 0, "skipped": 0}
+
+    def _send(account_id, claims, batch):
+        # lojas em modo lote recebem o mesmo corpo {"orders": [...]} do outbox; o que não couber volta para a fila
+        # o lease do job é conferido antes do envio, como no dispatcher
+        gate.wait(account_id)
+        try:
+            if batch:
+                return deliver_batch(account_id, claims)
+            return 1 if deliver_dispatch(*claims[0]) else 0
+        except Exception as e:
+            logger.warning("webhook_replay_delivery_error", job_id=job_id, dispatch_ids=[c[0] for c in claims], error=str(e))
+            return 0
+
+    last_id = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, Config.REPLAY_CONCURRENCY), thread_name_prefix=f"WebhookReplay-{job_id}") as pool:
+            while True:
+                db = SessionLocal()
+                try:
+                    rows = _candidates(db, job, last_id)
+                    if not rows:
+                        break
+                    last_id = rows[-1][0].id
+                    targets = [(row[0], t) for row, t in zip(rows, _targets(db, rows)) if t and (not job.account_id or t[0] == job.account_id)]
+                    counts["matched"] += len(targets)
+                    sends, batches = [], {}
+                    if targets and not job.dry_run:
+                        ids = {t[0] for _, t in targets}
+                        accs = {a.account_id: a for a in db.query(StripeAccount).filter(StripeAccount.account_id.in_(ids))}
+                        for log, (acc_id, order_id, status) in targets:
+                            acc = accs.get(acc_id)
+                            claim = _queue(db, acc, order_id, status, log.event_id)
+                            if claim is None:
+                                counts["skipped"] += 1
+                            elif claim is False:
+                                counts["pending"] += 1
+                            elif acc.dispatch_batch_enabled:
+                                batches.setdefault(acc_id, []).append(claim)
+                            else:
+                                sends.append((acc_id, [claim], False))
+                    db.commit()
+                finally:
+                    db.close()
+                sends += [(acc_id, claims, True) for acc_id, claims in batches.items()]
+                # no máximo um lote em voo: concorrência limitada pelo pool e pelo tamanho do lote
+                for (_, claims, _), sent in zip(sends, pool.map(lambda item: _send(*item), sends)):
+                    counts["delivered"] += sent
+                    counts["pending"] += len(claims) - sent
+                _save_progress(job_id, **counts)
+        _save_progress(job_id, state=STATE_DONE, finished_at=datetime.utcnow(), **counts)
+        logger.info("webhook_replay_finished", job_id=job_id, **counts)
+    except Exception as e:
+        _save_progress(job_id, state=STATE_FAILED, finished_at=datetime.utcnow(), message=str(e)[:1000], **counts)
+        logger.warning("webhook_replay_failed", job_id=job_id, error=str(e))
+
+def start_job(job_id):
+    t = threading.Thread(target=run_job, args=(job_id,), name=f"WebhookReplayJob-{job_id}", daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,229 @@
+import json
+import os
+import threading
+import time
+import structlog
+from core.config import Config
+from core.event_cache import seen_events
+from services.webhook_ingest import ingest_event
+
+# spool local append-only: cada registro é "<tamanho>\n<corpo bruto>\n"
+# segmentos ativos terminam em .open (um por processo) e são renomeados para .seg ao rotacionar
+OPEN_SUFFIX = ".open"
+SEALED_SUFFIX = ".seg"
+ACK_SUFFIX = ".ack"
+
+_writer = None
+_writer_lock = threading.Lock()
+_consumer = None
+_consumer_lock = threading.Lock()
+
+def _spool_dir():
+    path = Config.WEBHOOK_SPOOL_DIR
+    os.makedirs(path, exist_ok=True)
+    return path
+
+class _SegmentWriter:
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.name = None
+        self.size = 0
+        self.opened_at = 0.0
+        self.synced_at = 0.0
+        self.seq = 0
+
+    def _open(self):
+        self.seq += 1
+        self.name = os.path.join(self.path, f"{int(time.time() * 1000):015d}-{os.getpid()}-{self.seq:06d}{OPEN_SUFFIX}")
+        self.fd = os.open(self.name, os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0), 0o600)
+        self.size = 0
+        self.opened_at = time.monotonic()
+
+    def seal(self):
+        if self.fd is None:
+            return
+        try:
+            os.fsync(self.fd)
+        except OSError:
+            pass
+        os.close(self.fd)
+        self.fd = None
+        try:
+            os.replace(self.name, self.name[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+    def append(self, body):
+        if self.fd is not None and (
+            self.size >= Config.WEBHOOK_SPOOL_SEGMENT_BYTES
+            or time.monotonic() - self.opened_at >= Config.WEBHOOK_SPOOL_SEGMENT_SECONDS
+        ):
+            self.seal()
+        if self.fd is None:
+            self._open()
+        record = str(len(body)).encode("ascii") + b"\n" + body + b"\n"
+        os.write(self.fd, record)
+        self.size += len(record)
+        policy = Config.WEBHOOK_SPOOL_FSYNC
+        now = time.monotonic()
+        if policy == "always" or (policy == "interval" and now - self.synced_at >= Config.WEBHOOK_SPOOL_FSYNC_INTERVAL_SECONDS):
+            os.fsync(self.fd)
+            self.synced_at = now
+
+def append(body):
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = _SegmentWriter(_spool_dir())
+        _writer.append(body)
+
+def seal_active():
+    with _writer_lock:
+        if _writer is not None:
+            _writer.seal()
+
+def _ack_path(seg):
+    # o ack acompanha o segmento mesmo depois do rename .open -> .seg
+    return os.path.splitext(seg)[0] + ACK_SUFFIX
+
+def _read_ack(seg):
+    try:
+        with open(_ack_path(seg), "r") as fh:
+            return int(fh.read().strip() or "0")
+    except (OSError, ValueError):
+        return 0
+
+def _write_ack(seg, offset):
+    tmp = _ack_path(seg) + ".tmp"
+    with open(tmp, "w") as fh:
+        fh.write(str(offset))
+    os.replace(tmp, _ack_path(seg))
+
+def _remove(seg):
+    for p in (seg, _ack_path(seg)):
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+def _segments(path):
+    names = [n for n in os.listdir(path) if n.endswith(OPEN_SUFFIX) or n.endswith(SEALED_SUFFIX)]
+    return [os.path.join(path, n) for n in sorted(names)]
+
+def _replay(body, logger):
+    event = json.loads(body.decode("utf-8"))
+    if seen_events.get(event.get("id")) is not None:
+        return "duplicate"
+    res = ingest_event(event, raw=body)
+    seen_events.add(res.event_id, dispatched=res.enqueued)
+    logger.info("webhook_spool_ingested", event_id=res.event_id, event_type=res.event_type, status=res.status, enqueued=res.enqueued)
+    return res.status
+
+def _consume_segment(seg, logger):
+    offset = _read_ack(seg)
+    with open(seg, "rb") as fh:
+        fh.seek(offset)
+        data = fh.read()
+    pos, done = 0, 0
+    while pos < len(data):
+        nl = data.find(b"\n", pos)
+        if nl < 0:
+            break
+        try:
+            size = int(data[pos:nl])
+        except ValueError:
+            logger.warning("webhook_spool_corrupt", segment=os.path.basename(seg), offset=offset + pos)
+            return offset + len(data), done, True
+        end = nl + 1 + size
+        if end + 1 > len(data):
+            # registro ainda sendo escrito
+            break
+        try:
+            _replay(data[nl + 1:end], logger)
+        except ValueError:
+            logger.warning("webhook_spool_invalid_json", segment=os.path.basename(seg), offset=offset + pos)
+        except Exception:
+            # banco indisponível etc.: para aqui e tenta de novo no próximo ciclo
+            if pos:
+                _write_ack(seg, offset + pos)
+            raise
+        pos = end + 1
+        done += 1
+    if pos:
+        _write_ack(seg, offset + pos)
+    return offset + pos, done, False
+
+def consume_once():
+    logger = structlog.get_logger()
+    path = _spool_dir()
+    total = 0
+    stale_after = max(300, 2 * Config.WEBHOOK_SPOOL_SEGMENT_SECONDS)
+    for seg in _segments(path):
+        try:
+            offset, done, corrupt = _consume_segment(seg, logger)
+            total += done
+            size = os.path.getsize(seg)
+        except FileNotFoundError:
+            continue
+        if offset < size and not corrupt:
+            continue
+        if seg.endswith(SEALED_SUFFIX):
+            _remove(seg)
+        elif time.time() - os.path.getmtime(seg) > stale_after:
+            # segmento .open de um processo que não rotaciona mais (encerrado)
+            _remove(seg)
+    return total
+
+def backlog():
+    path = _spool_dir()
+    pending = 0
+    segments = _segments(path)
+    for seg in segments:
+        try:
+            pending += max(0, os.path.getsize(seg) - _read_ack(seg))
+        except OSError:
+            pass
+    return {"segments": len(segments), "pendingBytes": pending}
+
+def _try_lock(fh):
+    try:
+        import fcntl
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except ImportError:
+        import msvcrt
+        try:
+            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+    except OSError:
+        return False
+
+def _loop():
+    logger = structlog.get_logger()
+    lock_fh = open(os.path.join(_spool_dir(), "consumer.lock"), "a+")
+    # só um consumidor por diretório; os demais processos ficam de reserva
+    while not _try_lock(lock_fh):
+        time.sleep(max(1, Config.WEBHOOK_SPOOL_POLL_SECONDS) * 5)
+    logger.info("webhook_spool_consumer_started", pid=os.getpid())
+    while True:
+        processed = 0
+        try:
+            processed = consume_once()
+        except Exception as e:
+            logger.warning("webhook_spool_consume_error", error=str(e))
+        if not processed:
+            time.sleep(max(1, Config.WEBHOOK_SPOOL_POLL_SECONDS))
+
+def start_spool_consumer():
+    global _consumer
+    with _consumer_lock:
+        if _consumer is not None or not Config.WEBHOOK_SPOOL_ENABLED:
+            return
+        _consumer = threading.Thread(target=_loop, name="WebhookSpoolConsumer", daemon=True)
+        _consumer.start()
+
+if __name__ == "__main__":
+    _loop()
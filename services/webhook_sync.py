@@ -1,13 +1,21 @@
+import re
 import time
 import json
-import hmac
-import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import stripe
 import structlog
+from sqlalchemy import insert, or_, update
+from core import payload_codec
 from core.config import Config
-from core.db import SessionLocal, StripeAccount, WebhookEvent, WebhookLog, StoreDispatch, OrderCorrelation, WebhookSyncLog
-import requests
+from core.db import SessionLocal, StripeAccount, WebhookEvent, WebhookLog, StoreDispatch, OrderCorrelation, WebhookSyncLog, WebhookSyncRun, SyncCheckpoint
+from services.store_dispatch import enqueue_dispatch
+from services.webhook_ingest import log_columns
+from core.event_cache import seen_events
+from services import worker_lease
+
+SYNC_LEASE = "webhook_sync"
 
 def _now_ts_minus(minutes):
     return int((datetime.utcnow() - timedelta(minutes=minutes)).timestamp())
@@ -23,141 +31,432 @@ def _normalize_status(obj):
         return "paid"
     return None
 
-def _resolve_account_id(order_id, fallback_account):
-    if fallback_account:
-        return fallback_account
+_WS = re.compile(r"\s*")
+# strings JSON (com escapes) e delimitadores; o resto do corpo é pulado sem ser decodificado
+_TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]')
+
+def _skip_ws(body, pos):
+    return _WS.match(body, pos).end()
+
+def _data_spans(body):
+    # um passe pelos tokens, sem montar objetos: (início, fim) de cada item do "data" de primeiro nível
+    spans, depth, key, start, in_data = [], 0, None, None, False
+    for m in _TOKENS.finditer(body):
+        tok = m.group()
+        if tok[0] == '"':
+            if depth == 1 and body.startswith(":", _skip_ws(body, m.end())):
+                key = tok
+            continue
+        if tok in "[{":
+            if in_data and depth == 2:
+                start = m.start()
+            elif depth == 1 and tok == "[" and key == '"data"':
+                in_data = True
+            depth += 1
+            continue
+        depth -= 1
+        if in_data and depth == 2:
+            spans.append((start, m.end()))
+        elif in_data and depth == 1:
+            return spans
+    raise ValueError("truncated list response")
+
+def _list_page(body, parsed=None):
+    # parsed: a resposta já decodificada pelo SDK (o único json.loads da página);
+    # daqui só saem os trechos originais de cada item, para gravar os bytes que a Stripe enviou
+    if parsed is None:
+        parsed = json.loads(body)
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("data"), list):
+        raise ValueError("unexpected list response")
+    spans = _data_spans(body)
+    if len(spans) != len(parsed["data"]):
+        raise ValueError("unexpected list response")
+    meta = {k: v for k, v in parsed.items() if k != "data"}
+    return [(obj, body[a:b]) for obj, (a, b) in zip(parsed["data"], spans)], meta
+
+_client = None
+
+def _list_events(**params):
+    # resposta crua (sem montar StripeObjects); stripe_account vai em params
+    global _client
+    if _client is None:
+        _client = stripe.StripeClient(str(Config.STRIPE_SECRET_KEY))
+    return _client.raw_request("get", "/v1/events", **params)
+
+class _RequestBudget:
+    # token bucket compartilhado por todas as contas de uma execução (requisições/s à Stripe)
+    def __init__(self, per_second, burst=None):
+        self.rate = per_second
+        self.capacity = burst or max(1.0, per_second)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+def _iter_pages(account_id, params, budget=None, starting_after=None):
+    while True:
+        extra = {"starting_after": starting_after} if starting_after else {}
+        if budget:
+            budget.acquire()
+        page = _list_events(**params, **extra, stripe_account=account_id)
+        items, meta = _list_page(page.body, page.data)
+        if items:
+            yield items
+        if not meta.get("has_more") or not items:
+            return
+        starting_after = items[-1][0]["id"]
+
+def _oldest(a, b):
+    return b if a is None or (b is not None and b < a) else a
+
+def _process_page(items, logger):
+    # uma página da Stripe por vez: consultas IN para eventos, outbox, correlações e contas; um commit
+    # retry: menor created entre eventos que falharam ou ficaram sem conta (a janela seguinte os relê)
+    rec, ign, fail = 0, 0, 0
+    retry = None
+    candidates = []
+    for ev, raw in items:
+        ev_id = ev.get("id")
+        order_id = _extract_order_id(ev)
+        status = _normalize_status((ev.get("data") or {}).get("object") or {})
+        if not order_id or not status or seen_events.get(ev_id):
+            # seen_events: já ingerido e enfileirado por este processo
+            ign += 1
+            continue
+        candidates.append((ev, raw, ev_id, order_id, status))
+    if not candidates:
+        return rec, ign, fail, retry
+    ids = [c[2] for c in candidates]
     db = SessionLocal()
     try:
-        corr = db.query(OrderCorrelation).filter_by(order_id=order_id).first()
-        return corr.account_id if corr else None
+        stored = {r[0] for r in db.query(WebhookEvent.event_id).filter(WebhookEvent.event_id.in_(ids))}
+        queued = {r[0] for r in db.query(StoreDispatch.event_id).filter(StoreDispatch.event_id.in_(ids))}
+        orders = {c[3] for c in candidates if not c[0].get("account") and c[2] not in queued}
+        corr = dict(db.query(OrderCorrelation.order_id, OrderCorrelation.account_id).filter(OrderCorrelation.order_id.in_(orders))) if orders else {}
+        new_events, new_logs, targets = [], [], []
+        for ev, raw, ev_id, order_id, status in candidates:
+            if ev_id not in stored:
+                new_events.append({"event_id": ev_id})
+                new_logs.append({"event_id": ev_id, "event_type": ev.get("type"), "payload_source": "sync_api",
+                                 **log_columns(ev), **payload_codec.encode(raw)})
+            if ev_id in queued:
+                # já está no outbox: retentativas e dead-letter ficam a cargo do dispatcher
+                ign += 1
+                continue
+            account_id = ev.get("account") or corr.get(order_id)
+            if not account_id:
+                ign += 1
+                retry = _oldest(retry, ev.get("created") or 0)
+                continue
+            targets.append((account_id, order_id, status, ev_id, ev.get("created") or 0))
+        if new_events:
+            db.execute(insert(WebhookEvent), new_events)
+            db.execute(insert(WebhookLog), new_logs)
+        accs = {}
+        if targets:
+            accs = {a.account_id: a for a in db.query(StripeAccount).filter(StripeAccount.account_id.in_({t[0] for t in targets}))}
+        enqueued = []
+        for account_id, order_id, status, ev_id, created in targets:
+            acc = accs.get(account_id)
+            if acc is None or enqueue_dispatch(db, account_id, order_id, status, ev_id, acc=acc, known_new=True) is None:
+                fail += 1
+                retry = _oldest(retry, created)
+                continue
+            enqueued.append((ev_id, account_id))
+        db.commit()
     finally:
         db.close()
+    for ev_id in queued:
+        seen_events.add(ev_id, dispatched=True)
+    for ev_id, account_id in enqueued:
+        seen_events.add(ev_id, dispatched=True)
+        logger.info("webhook_sync_dispatch_enqueued", event_id=ev_id, account_id=account_id)
+    rec += len(enqueued)
+    return rec, ign, fail, retry
 
-def _dispatch_to_store(account_id, order_id, status, event_id, logger):
+def _open_window(account_id):
+    # retoma a janela interrompida (mesmo gte, página seguinte ao cursor) ou abre uma nova a partir do checkpoint
     db = SessionLocal()
     try:
-        acc = db.query(StripeAccount).filter_by(account_id=account_id).first()
-        if not acc or not acc.store_domain or not Config.PAYMENTS_EVENTS_SECRET:
-            return False
-        payload = {"orderId": order_id, "status": status}
-        body = json.dumps(payload, separators=(",", ":"))
-        sig = hmac.new(
-            Config.PAYMENTS_EVENTS_SECRET.encode("utf-8"),
-            body.encode("utf-8"),
-            hashlib.sha256
-        ).hexdigest()
-        ep = acc.store_domain.rstrip("/") + Config.PAYMENTS_EVENTS_PATH
-        headers = {Config.PAYMENTS_EVENTS_HEADER: sig, "Content-Type": "application/json"}
-        dispatch = db.query(StoreDispatch).filter_by(event_id=event_id).first()
-        if not dispatch:
-            dispatch = StoreDispatch(event_id=event_id, account_id=account_id, order_id=order_id, status=status, attempts=0)
-            db.add(dispatch)
-            db.commit()
-        delays = [1, 2, 4]
-        for attempt, dly in enumerate(delays, start=1):
-            try:
-                r = requests.post(ep, data=body, headers=headers, timeout=5)
-                logger.info("webhook_sync_store_response", event_id=event_id, status_code=getattr(r, "status_code", None))
-                dispatch.attempts = attempt
-                if getattr(r, "status_code", 0) == 200:
-                    dispatch.delivered_at = datetime.utcnow()
-                    db.add(dispatch)
-                    db.commit()
-                    return True
-            except Exception:
-                logger.info("webhook_sync_retry_scheduled", event_id=event_id, attempt=attempt, delay_seconds=dly)
-                dispatch.attempts = attempt
-                db.add(dispatch)
-                db.commit()
-            time.sleep(dly)
-        return False
+        cp = db.query(SyncCheckpoint).filter_by(account_id=account_id).first()
     finally:
         db.close()
+    if cp and cp.page_cursor:
+        newest = (cp.pending_created, cp.pending_event_id) if cp.pending_created is not None else None
+        return cp.window_gte, cp.window_started, cp.page_cursor, newest, cp.pending_retry_created
+    if cp and cp.last_event_created:
+        gte = max(0, cp.last_event_created - Config.WEBHOOK_SYNC_OVERLAP_SECONDS)
+    else:
+        # sem checkpoint, usa a janela de lookback
+        gte = _now_ts_minus(Config.WEBHOOK_SYNC_LOOKBACK_MINUTES)
+    return gte, int(datetime.utcnow().timestamp()), None, None, None
 
-def run_sync_once():
-    logger = structlog.get_logger()
-    if not Config.WEBHOOK_SYNC_ENABLED:
-        return
+def _checkpoint_row(db, account_id):
+    cp = db.query(SyncCheckpoint).filter_by(account_id=account_id).first()
+    if not cp:
+        cp = SyncCheckpoint(account_id=account_id)
+        db.add(cp)
+    return cp
+
+def _save_page(account_id, gte, started, cursor, newest, retry=None):
     db = SessionLocal()
     try:
-        accounts = db.query(StripeAccount).all()
+        cp = _checkpoint_row(db, account_id)
+        cp.window_gte = gte
+        cp.window_started = started
+        cp.page_cursor = cursor
+        cp.pending_created, cp.pending_event_id = newest or (None, None)
+        cp.pending_retry_created = retry
+        cp.updated_at = datetime.utcnow()
+        db.commit()
     finally:
         db.close()
-    for acc in accounts:
-        slog = WebhookSyncLog(account_id=acc.account_id, started_at=datetime.utcnow())
-        rec, ign, fail = 0, 0, 0
-        dbs = SessionLocal()
-        try:
-            dbs.add(slog)
-            dbs.commit()
-        finally:
-            dbs.close()
+
+def _save_checkpoint(account_id, created, event_id):
+    # fecha a janela; o checkpoint nunca recua
+    db = SessionLocal()
+    try:
+        cp = _checkpoint_row(db, account_id)
+        if not cp.last_event_created or created >= cp.last_event_created:
+            cp.last_event_created = created
+            cp.last_event_id = event_id
+        cp.window_gte = cp.window_started = cp.page_cursor = None
+        cp.pending_created = cp.pending_event_id = cp.pending_retry_created = None
+        cp.updated_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+def _next_interval(previous, slog, failed):
+    # perda observada (eventos recuperados) ou erro transitório (Stripe, lease): volta ao mínimo;
+    # senão dobra até o máximo, inclusive com falhas de notificação (conta/loja não configurada não se
+    # resolve consultando mais vezes; os eventos seguem retidos pelo checkpoint)
+    low = max(1, Config.WEBHOOK_SYNC_MIN_INTERVAL_MINUTES) * 60
+    high = max(low, Config.WEBHOOK_SYNC_MAX_INTERVAL_MINUTES * 60)
+    if failed or slog.recovered_events:
+        return low
+    if not previous:
+        return min(high, max(low, Config.WEBHOOK_SYNC_INTERVAL_MINUTES * 60))
+    return min(high, max(low, previous * 2))
+
+def _due_accounts(force=False):
+    db = SessionLocal()
+    try:
+        q = db.query(StripeAccount.account_id).outerjoin(SyncCheckpoint, SyncCheckpoint.account_id == StripeAccount.account_id)
+        if not force:
+            q = q.filter(or_(SyncCheckpoint.next_sync_at.is_(None), SyncCheckpoint.next_sync_at <= datetime.utcnow()))
+        return [r[0] for r in q.all()]
+    finally:
+        db.close()
+
+def close_stale_logs():
+    # linhas de execuções interrompidas (restart/deploy) que nunca receberam finished_at
+    cutoff = datetime.utcnow() - timedelta(minutes=max(1, Config.WEBHOOK_SYNC_STALE_MINUTES))
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        logs = db.execute(
+            update(WebhookSyncLog)
+            .where(WebhookSyncLog.finished_at.is_(None), WebhookSyncLog.started_at < cutoff)
+            .values(finished_at=now, message="interrupted")
+        ).rowcount
+        db.execute(
+            update(WebhookSyncRun)
+            .where(WebhookSyncRun.finished_at.is_(None), WebhookSyncRun.started_at < cutoff)
+            .values(finished_at=now)
+        )
+        db.commit()
+        return logs
+    finally:
+        db.close()
+
+def _check_lease(stop):
+    # lease perdido no meio do ciclo: outro processo já pode estar sincronizando; para antes de despachar ou gravar
+    if stop is not None and stop.is_set():
+        raise RuntimeError("worker_lease_lost")
+
+def _sync_account(account_id, run_id, budget, logger, stop=None):
+    if stop is not None and stop.is_set():
+        return None
+    slog = WebhookSyncLog(account_id=account_id, run_id=run_id, started_at=datetime.utcnow())
+    rec, ign, fail = 0, 0, 0
+    failed = False
+    dbs = SessionLocal()
+    try:
+        dbs.add(slog)
+        dbs.commit()
+    finally:
+        dbs.close()
+    try:
+        gte, started, cursor, newest, retry = _open_window(account_id)
+        if cursor:
+            logger.info("webhook_sync_resumed", account_id=account_id, starting_after=cursor)
+        params = {
+            "types": ["checkout.session.completed", "payment_intent.succeeded"],
+            "created": {"gte": gte},
+            "limit": 50,
+        }
+        for items in _iter_pages(account_id, params, budget, cursor):
+            _check_lease(stop)
+            for ev, _ in items:
+                if newest is None or (ev.get("created") or 0) > newest[0]:
+                    newest = (ev.get("created") or 0, ev.get("id"))
+            r, i, f, oldest = _process_page(items, logger)
+            rec, ign, fail, retry = rec + r, ign + i, fail + f, _oldest(retry, oldest)
+            _save_page(account_id, gte, started, items[-1][0]["id"], newest, retry)
+        # só avança o checkpoint quando a janela inteira foi lida sem erro
+        _check_lease(stop)
+        if newest is None:
+            newest = (started, None)
+        if retry is not None:
+            # para logo antes do evento com falha mais antigo, que volta na próxima janela; eventos fora
+            # do lookback deixam de segurar o checkpoint (não ficam relendo a mesma janela para sempre)
+            cap = max(retry - 1, _now_ts_minus(Config.WEBHOOK_SYNC_LOOKBACK_MINUTES))
+            if cap < newest[0]:
+                newest = (cap, None)
+        _save_checkpoint(account_id, newest[0], newest[1])
+    except Exception as e:
+        failed = True
+        slog.message = str(e)[:1000]
+        logger.warning("webhook_sync_error", account_id=account_id, error=str(e))
+    finally:
+        dbf = SessionLocal()
         try:
-            params = {
-                "types": ["checkout.session.completed", "payment_intent.succeeded"],
-                "created": {"gte": _now_ts_minus(Config.WEBHOOK_SYNC_LOOKBACK_MINUTES)},
-                "limit": 50,
-            }
-            events = stripe.Event.list(**params, stripe_account=acc.account_id)
-            for ev in events.auto_paging_iter():
-                ev_id = ev.get("id")
-                ev_type = ev.get("type")
-                obj = (ev.get("data") or {}).get("object") or {}
-                order_id = _extract_order_id(ev)
-                status = _normalize_status(obj)
-                if not order_id or not status:
-                    ign += 1
-                    continue
-                dbx = SessionLocal()
-                try:
-                    exists_evt = dbx.query(WebhookEvent).filter_by(event_id=ev_id).first()
-                    dispatch = dbx.query(StoreDispatch).filter_by(event_id=ev_id).first()
-                finally:
-                    dbx.close()
-                if exists_evt and dispatch and dispatch.delivered_at:
-                    ign += 1
-                    continue
-                dbp = SessionLocal()
-                try:
-                    if not exists_evt:
-                        dbp.add(WebhookEvent(event_id=ev_id))
-                        dbp.add(WebhookLog(event_id=ev_id, event_type=ev_type, payload=json.dumps(ev)))
-                        dbp.commit()
-                finally:
-                    dbp.close()
-                account_id = _resolve_account_id(order_id, ev.get("account"))
-                if not account_id:
-                    ign += 1
-                    continue
-                ok = _dispatch_to_store(account_id, order_id, status, ev_id, logger)
-                if ok:
-                    rec += 1
-                else:
-                    fail += 1
-        except Exception as e:
-            logger.warning("webhook_sync_error", account_id=acc.account_id, error=str(e))
+            slog.finished_at = datetime.utcnow()
+            slog.recovered_events = rec
+            slog.ignored_events = ign
+            slog.failed_notifications = fail
+            dbf.add(slog)
+            cp = _checkpoint_row(dbf, account_id)
+            cp.interval_seconds = _next_interval(cp.interval_seconds, slog, failed)
+            cp.next_sync_at = slog.finished_at + timedelta(seconds=cp.interval_seconds)
+            dbf.commit()
         finally:
-            dbf = SessionLocal()
+            dbf.close()
+    return rec, ign, fail, failed
+
+def run_sync_once(force=False, stop=None):
+    # force: ignora a agenda adaptativa e sincroniza todas as contas (disparo manual)
+    # stop: evento do heartbeat do lease; marcado, as contas restantes são puladas e as em curso param na próxima página
+    logger = structlog.get_logger()
+    if not Config.WEBHOOK_SYNC_ENABLED:
+        return None
+    stale = close_stale_logs()
+    if stale:
+        logger.info("webhook_sync_stale_logs_closed", count=stale)
+    account_ids = _due_accounts(force)
+    if not account_ids:
+        return None
+    db = SessionLocal()
+    try:
+        run = WebhookSyncRun(started_at=datetime.utcnow(), accounts_total=len(account_ids))
+        db.add(run)
+        db.commit()
+        run_id = run.id
+    finally:
+        db.close()
+    t0 = time.monotonic()
+    budget = _RequestBudget(Config.WEBHOOK_SYNC_STRIPE_RPS)
+    totals = {"accounts_processed": 0, "accounts_failed": 0, "recovered_events": 0, "ignored_events": 0, "failed_notifications": 0}
+    skipped = 0
+    workers = max(1, min(Config.WEBHOOK_SYNC_CONCURRENCY, len(account_ids) or 1))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="WebhookSync") as pool:
+        futures = {pool.submit(_sync_account, acc_id, run_id, budget, logger, stop): acc_id for acc_id in account_ids}
+        for fut in as_completed(futures):
             try:
-                slog.finished_at = datetime.utcnow()
-                slog.recovered_events = rec
-                slog.ignored_events = ign
-                slog.failed_notifications = fail
-                dbf.add(slog)
-                dbf.commit()
-            finally:
-                dbf.close()
+                result = fut.result()
+                if result is None:
+                    skipped += 1
+                    continue
+                rec, ign, fail, failed = result
+            except Exception as e:
+                # falha ao gravar o log da conta; as demais seguem
+                logger.warning("webhook_sync_error", account_id=futures[fut], error=str(e))
+                rec, ign, fail, failed = 0, 0, 0, True
+            totals["accounts_failed" if failed else "accounts_processed"] += 1
+            totals["recovered_events"] += rec
+            totals["ignored_events"] += ign
+            totals["failed_notifications"] += fail
+    duration_ms = int((time.monotonic() - t0) * 1000)
+    db = SessionLocal()
+    try:
+        run = db.get(WebhookSyncRun, run_id)
+        run.finished_at = datetime.utcnow()
+        run.duration_ms = duration_ms
+        for k, v in totals.items():
+            setattr(run, k, v)
+        db.commit()
+    finally:
+        db.close()
+    if stop is not None and stop.is_set():
+        logger.warning("webhook_sync_run_aborted", run_id=run_id, reason="worker_lease_lost", accounts_skipped=skipped)
+    logger.info("webhook_sync_run_finished", run_id=run_id, accounts=len(account_ids), duration_ms=duration_ms, **totals)
+    return run_id
 
 def start_worker():
     if not Config.WEBHOOK_SYNC_ENABLED:
         return
-    import threading
     t = threading.Thread(target=_loop, name="WebhookSyncWorker", daemon=True)
     t.start()
 
+def _cycle_due():
+    # o intervalo conta a partir da última execução de qualquer processo, não deste;
+    # a cada ciclo só entram as contas vencidas na agenda (next_sync_at)
+    db = SessionLocal()
+    try:
+        last = db.query(WebhookSyncRun.started_at).order_by(WebhookSyncRun.started_at.desc()).first()
+    finally:
+        db.close()
+    return not last or last[0] <= datetime.utcnow() - timedelta(minutes=Config.WEBHOOK_SYNC_MIN_INTERVAL_MINUTES)
+
+_cycle_lock = threading.Lock()
+
+def run_if_leader(force=False):
+    # só o detentor do lease roda o ciclo; se ele morrer, o lease expira e outro processo assume
+    # force (disparo manual): ignora o intervalo entre ciclos e a agenda das contas, mas não o lease
+    if not worker_lease.acquire(SYNC_LEASE):
+        return None
+    if not force and not _cycle_due():
+        return None
+    # o loop e o disparo manual do mesmo processo dividem o holder; um ciclo por vez
+    if not _cycle_lock.acquire(blocking=False):
+        return None
+    try:
+        with worker_lease.heartbeat(SYNC_LEASE) as lost:
+            return run_sync_once(force, stop=lost)
+    finally:
+        _cycle_lock.release()
+
+def schedule_all_now():
+    # antecipa a agenda de todas as contas; o líder as pega no próximo ciclo
+    db = SessionLocal()
+    try:
+        n = db.query(SyncCheckpoint).update({SyncCheckpoint.next_sync_at: datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        return n
+    finally:
+        db.close()
+
 def _loop():
+    logger = structlog.get_logger()
+    # followers tentam o lease a cada ttl/3 para assumir logo após a expiração
+    poll = max(1, min(Config.WEBHOOK_SYNC_MIN_INTERVAL_MINUTES * 60, Config.WORKER_LEASE_TTL_SECONDS / 3))
     while Config.WEBHOOK_SYNC_ENABLED:
         try:
-            run_sync_once()
-        finally:
-            time.sleep(max(1, Config.WEBHOOK_SYNC_INTERVAL_MINUTES * 60))
+            run_if_leader()
+        except Exception as e:
+            logger.warning("webhook_sync_loop_error", error=str(e))
+        time.sleep(poll)
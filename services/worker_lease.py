@@ -0,0 +1,95 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import structlog
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from core.config import Config
+from core.db import SessionLocal, WorkerLease
+
+# identifica este processo em todo o deployment (host + pid + sufixo aleatório para pids reaproveitados)
+HOLDER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def acquire(name, ttl=None, holder=None):
+    # compare-and-set: renova se já é nosso, toma se expirou; sem linha, o INSERT decide (nome único)
+    holder = holder or HOLDER
+    now = datetime.utcnow()
+    expires = now + timedelta(seconds=max(1, ttl or Config.WORKER_LEASE_TTL_SECONDS))
+    db = SessionLocal()
+    try:
+        res = db.execute(
+            update(WorkerLease)
+            .where(WorkerLease.name == name, or_(WorkerLease.holder == holder, WorkerLease.expires_at < now))
+            .values(holder=holder, expires_at=expires, heartbeat_at=now)
+        )
+        db.commit()
+        if res.rowcount == 1:
+            return True
+        if db.query(WorkerLease.id).filter_by(name=name).first():
+            return False
+        db.add(WorkerLease(name=name, holder=holder, expires_at=expires, heartbeat_at=now))
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+def release(name, holder=None):
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(WorkerLease)
+            .where(WorkerLease.name == name, WorkerLease.holder == (holder or HOLDER))
+            .values(expires_at=datetime.utcnow())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def current(name):
+    db = SessionLocal()
+    try:
+        row = db.query(WorkerLease).filter_by(name=name).first()
+        if not row or row.expires_at < datetime.utcnow():
+            return None
+        return {"holder": row.holder, "expiresAt": row.expires_at.isoformat(), "heartbeatAt": row.heartbeat_at.isoformat()}
+    finally:
+        db.close()
+
+@contextmanager
+def heartbeat(name, ttl=None):
+    # renova o lease a cada ttl/3 enquanto o bloco roda (ciclos mais longos que o ttl);
+    # o evento entregue ao bloco é marcado quando o lease se perde (outro holder ou sem renovar por um ttl)
+    ttl = max(1, ttl or Config.WORKER_LEASE_TTL_SECONDS)
+    logger = structlog.get_logger()
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def _beat():
+        renewed = time.monotonic()
+        while not stop.wait(ttl / 3):
+            try:
+                if acquire(name, ttl):
+                    renewed = time.monotonic()
+                    continue
+            except Exception as e:
+                logger.warning("worker_lease_heartbeat_error", lease=name, error=str(e))
+                if time.monotonic() - renewed < ttl:
+                    continue
+            logger.warning("worker_lease_lost", lease=name, holder=HOLDER)
+            lost.set()
+            return
+
+    t = threading.Thread(target=_beat, name=f"WorkerLease-{name}", daemon=True)
+    t.start()
+    try:
+        yield lost
+    finally:
+        stop.set()
+        t.join()
@@ -14,7 +14,10 @@ function renderDispatches(items) {
       <td>${i.eventId}</td>
       <td>${i.orderId || ""}</td>
       <td>${i.status || ""}</td>
+      <td>${i.state || ""}</td>
       <td>${i.attempts || 0}</td>
+      <td>${i.nextAttemptAt || ""}</td>
+      <td>${i.lastError || ""}</td>
       <td>${i.deliveredAt || ""}</td>
     `;
     tbody.appendChild(tr);
@@ -38,7 +41,8 @@ document.addEventListener("DOMContentLoaded", async () => {
   const summ = document.getElementById("summary");
   const info = await fetchJSON(`/stores/get/${encodeURIComponent(accountId)}`);
   if (summ && info) {
-    summ.textContent = `Loja: ${info.accountId} · Usuário: ${info.email || info.userId || "N/D"} · storeDomain: ${info.storeDomain || ""}`;
+    const circuit = info.circuit ? ` · circuito: ${info.circuit.state}${info.circuit.nextProbeAt ? ` (próximo teste ${info.circuit.nextProbeAt})` : ""}` : "";
+    summ.textContent = `Loja: ${info.accountId} · Usuário: ${info.email || info.userId || "N/D"} · storeDomain: ${info.storeDomain || ""}${circuit}`;
     const inp = document.getElementById("detailStoreDomain");
     if (inp) inp.value = info.storeDomain || "";
   }
@@ -62,6 +66,17 @@ document.addEventListener("DOMContentLoaded", async () => {
       if (el) el.textContent = typeof body === "string" ? body : JSON.stringify(body);
     });
   }
+  const requeueBtn = document.getElementById("requeueDeadBtn");
+  if (requeueBtn) {
+    requeueBtn.addEventListener("click", async () => {
+      const res = await fetch(`/stores/dispatches/${encodeURIComponent(accountId)}/requeue`, { method: "POST" });
+      const body = await res.json();
+      const el = document.getElementById("requeueResult");
+      if (el) el.textContent = `${body.requeued || 0} reenfileirado(s)`;
+      const d = await fetchJSON(`/stores/dispatches/${encodeURIComponent(accountId)}`);
+      renderDispatches(d && d.dispatches);
+    });
+  }
   const delBtn = document.getElementById("detailDeleteBtn");
   if (delBtn) {
     delBtn.addEventListener("click", async () => {
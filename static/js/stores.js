@@ -4,10 +4,12 @@ async function fetchJSON(url) {
   if (!ct.includes("application/json")) return null;
   return await res.json();
 }
-function renderStores(stores) {
+let storesCursor = null;
+let storesLoaded = 0;
+function renderStores(stores, append) {
   const tbody = document.querySelector("#storesTable tbody");
   if (!tbody) return;
-  tbody.innerHTML = "";
+  if (!append) tbody.innerHTML = "";
   (stores || []).forEach(s => {
     const tr = document.createElement("tr");
     tr.innerHTML = `
@@ -25,13 +27,22 @@ function renderStores(stores) {
     tbody.appendChild(tr);
   });
 }
-document.addEventListener("DOMContentLoaded", async () => {
-  const data = await fetchJSON("/stores/list");
-  renderStores(data && data.stores);
+async function loadStores(append) {
+  const url = append && storesCursor ? `/stores/list?cursor=${encodeURIComponent(storesCursor)}` : "/stores/list";
+  const data = await fetchJSON(url);
+  const stores = (data && data.stores) || [];
+  renderStores(stores, append);
+  storesLoaded = (append ? storesLoaded : 0) + stores.length;
+  storesCursor = (data && data.next_cursor) || null;
   const statusEl = document.getElementById("storesStatus");
-  if (statusEl) {
-    statusEl.textContent = `Total: ${(data && data.stores && data.stores.length) || 0}`;
-  }
+  if (statusEl) statusEl.textContent = `Exibindo: ${storesLoaded}${storesCursor ? "+" : ""}`;
+  const more = document.getElementById("storesMore");
+  if (more) more.classList.toggle("d-none", !storesCursor);
+}
+document.addEventListener("DOMContentLoaded", async () => {
+  await loadStores(false);
+  const more = document.getElementById("storesMore");
+  if (more) more.addEventListener("click", () => loadStores(true));
   const form = document.getElementById("updateStoreForm");
   if (form) {
     form.addEventListener("submit", async (e) => {
@@ -47,8 +58,7 @@ document.addEventListener("DOMContentLoaded", async () => {
       const ct = res.headers.get("content-type") || "";
       const body = ct.includes("application/json") ? await res.json() : await res.text();
       if (el) el.textContent = typeof body === "string" ? body : JSON.stringify(body);
-      const data2 = await fetchJSON("/stores/list");
-      renderStores(data2 && data2.stores);
+      await loadStores(false);
     });
   }
   const upForm = document.getElementById("upsertStoreForm");
@@ -67,8 +77,7 @@ document.addEventListener("DOMContentLoaded", async () => {
       const ct = res.headers.get("content-type") || "";
       const body = ct.includes("application/json") ? await res.json() : await res.text();
       if (el) el.textContent = typeof body === "string" ? body : JSON.stringify(body);
-      const data2 = await fetchJSON("/stores/list");
-      renderStores(data2 && data2.stores);
+      await loadStores(false);
     });
   }
   document.body.addEventListener("click", async (e) => {
@@ -82,14 +91,12 @@ document.addEventListener("DOMContentLoaded", async () => {
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ accountId, storeDomain })
       });
-      const data2 = await fetchJSON("/stores/list");
-      renderStores(data2 && data2.stores);
+      await loadStores(false);
     }
     if (t && t.dataset && t.dataset.action === "delete") {
       const accountId = t.dataset.account;
       await fetch(`/admin/stores/delete/${encodeURIComponent(accountId)}`, { method: "DELETE" });
-      const data2 = await fetchJSON("/stores/list");
-      renderStores(data2 && data2.stores);
+      await loadStores(false);
     }
   });
 });
@@ -19,12 +19,8 @@ function renderStores(items) {
 }
 document.addEventListener("DOMContentLoaded", async () => {
   const summ = document.getElementById("userSummary");
-  if (summ) {
-    const users = await fetchJSON("/admin/users/list");
-    const u = (users && users.users || []).find(x => x.id === userId);
-    summ.textContent = u ? `${u.email}` : `Usuário ${userId}`;
-  }
   const stores = await fetchJSON(`/admin/users/${userId}/stores`);
+  if (summ) summ.textContent = stores && stores.email ? `${stores.email}` : `Usuário ${userId}`;
   renderStores(stores && stores.stores);
   const form = document.getElementById("createUserStoreForm");
   if (form) {
@@ -4,10 +4,12 @@ async function fetchJSON(url) {
   if (!ct.includes("application/json")) return null;
   return await res.json();
 }
-function renderUsers(users) {
+let usersCursor = null;
+let usersLoaded = 0;
+function renderUsers(users, append) {
   const tbody = document.querySelector("#usersTable tbody");
   if (!tbody) return;
-  tbody.innerHTML = "";
+  if (!append) tbody.innerHTML = "";
   (users || []).forEach(u => {
     const tr = document.createElement("tr");
     tr.innerHTML = `
@@ -20,11 +22,22 @@ function renderUsers(users) {
     tbody.appendChild(tr);
   });
 }
-document.addEventListener("DOMContentLoaded", async () => {
-  const data = await fetchJSON("/admin/users/list");
-  renderUsers(data && data.users);
+async function loadUsers(append) {
+  const url = append && usersCursor ? `/admin/users/list?cursor=${encodeURIComponent(usersCursor)}` : "/admin/users/list";
+  const data = await fetchJSON(url);
+  const users = (data && data.users) || [];
+  renderUsers(users, append);
+  usersLoaded = (append ? usersLoaded : 0) + users.length;
+  usersCursor = (data && data.next_cursor) || null;
   const statusEl = document.getElementById("usersStatus");
-  if (statusEl) statusEl.textContent = `Total: ${(data && data.users && data.users.length) || 0}`;
+  if (statusEl) statusEl.textContent = `Exibindo: ${usersLoaded}${usersCursor ? "+" : ""}`;
+  const more = document.getElementById("usersMore");
+  if (more) more.classList.toggle("d-none", !usersCursor);
+}
+document.addEventListener("DOMContentLoaded", async () => {
+  await loadUsers(false);
+  const more = document.getElementById("usersMore");
+  if (more) more.addEventListener("click", () => loadUsers(true));
   const form = document.getElementById("createUserForm");
   if (form) {
     form.addEventListener("submit", async (e) => {
@@ -40,8 +53,7 @@ document.addEventListener("DOMContentLoaded", async () => {
       const ct = res.headers.get("content-type") || "";
       const body = ct.includes("application/json") ? await res.json() : await res.text();
       if (el) el.textContent = typeof body === "string" ? body : JSON.stringify(body);
-      const data2 = await fetchJSON("/admin/users/list");
-      renderUsers(data2 && data2.users);
+      await loadUsers(false);
     });
   }
 });
@@ -1,20 +1,22 @@
 import json
 from types import SimpleNamespace
 import pytest
+from core.payload_codec import payload_of
 
 def auth_headers(access_token):
     return {"Authorization": f"Bearer {access_token}"}
 
 @pytest.mark.temp
 def test_webhook_audit_persists_payload(app_module, client):
+    body = json.dumps({
+        "id": "evt_test_123",
+        "type": "checkout.session.completed",
+        "data": {"object": {"status": "complete", "metadata": {"orderId": "ORD_123"}}},
+    }, indent=2).encode()
     def ok_verify(payload, sig, secret):
-        return {
-            "id": "evt_test_123",
-            "type": "checkout.session.completed",
-            "data": {"object": {"status": "complete", "metadata": {"orderId": "ORD_123"}}},
-        }
+        return json.loads(payload)
     app_module.verify_webhook = ok_verify
-    r = client.post("/webhook", data=b"{}")
+    r = client.post("/webhook", data=body)
     assert r.status_code == 200
     data = r.get_json()
     assert data.get("status") == "success"
@@ -23,8 +25,10 @@ def test_webhook_audit_persists_payload(app_module, client):
         log = db.query(app_module.WebhookLog).filter_by(event_id="evt_test_123").first()
         assert log is not None
         assert log.event_type == "checkout.session.completed"
-        payload = json.loads(log.payload)
+        payload = json.loads(payload_of(log))
         assert payload["id"] == "evt_test_123"
+        assert payload_of(log).encode() == body
+        assert log.payload_source == "webhook"
     finally:
         db.close()
 
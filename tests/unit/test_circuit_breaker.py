@@ -0,0 +1,93 @@
+import importlib
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+
+@pytest.fixture()
+def breaker(app_module, monkeypatch):
+    cb = importlib.import_module("services.circuit_breaker")
+    monkeypatch.setattr(cb.Config, "CIRCUIT_BREAKER_MIN_REQUESTS", 4)
+    monkeypatch.setattr(cb.Config, "CIRCUIT_BREAKER_FAILURE_RATE_PERCENT", 50)
+    monkeypatch.setattr(cb.Config, "CIRCUIT_BREAKER_OPEN_SECONDS", 60)
+    monkeypatch.setattr(cb.Config, "CIRCUIT_BREAKER_WINDOW_SECONDS", 60)
+    yield cb
+    cb.set_backend(None)
+
+@pytest.mark.unit
+@pytest.mark.parametrize("backend", ["memory", "db"])
+def test_breaker_opens_probes_and_closes(breaker, backend):
+    breaker.set_backend(breaker.MemoryCircuitBackend() if backend == "memory" else breaker.DbCircuitBackend())
+    key = f"https://{backend}-store.example"
+    t0 = datetime.utcnow()
+    assert breaker.record_result(key, True, t0) == "closed"
+    assert breaker.record_result(key, False, t0) == "closed"
+    assert breaker.record_result(key, True, t0) == "closed"
+    assert breaker.record_result(key, False, t0) == "open"
+    allowed, retry_at = breaker.allow_request(key, t0 + timedelta(seconds=10))
+    assert not allowed and retry_at == t0 + timedelta(seconds=60)
+    probe_time = t0 + timedelta(seconds=61)
+    assert breaker.allow_request(key, probe_time) == (True, None)
+    allowed, _ = breaker.allow_request(key, probe_time)
+    assert not allowed
+    assert breaker.circuit_status(key)["state"] == "half_open"
+    assert [c["storeKey"] for c in breaker.list_shed_circuits()] == [key]
+    assert breaker.record_result(key, True, probe_time) == "closed"
+    assert breaker.allow_request(key, probe_time) == (True, None)
+
+@pytest.mark.unit
+def test_open_circuit_defers_dispatch_without_attempt(breaker, app_module, monkeypatch):
+    dispatcher = importlib.import_module("services.store_dispatch")
+    breaker.set_backend(breaker.MemoryCircuitBackend())
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    monkeypatch.setattr(dispatcher.Config, "CIRCUIT_BREAKER_MIN_REQUESTS", 1)
+    calls = {"count": 0}
+    def failing_post(url, data=None, headers=None, timeout=None):
+        calls["count"] += 1
+        return SimpleNamespace(status_code=500)
+    monkeypatch.setattr(dispatcher.outbound_http, "post", failing_post)
+    db = app_module.SessionLocal()
+    try:
+        u = app_module.User(email="cb@example.com", password_hash="x")
+        db.add(u)
+        db.commit()
+        db.add(app_module.StripeAccount(user_id=u.id, account_id="acct_cb_1", store_domain="https://down.example"))
+        db.commit()
+        for i in (1, 2):
+            dispatcher.enqueue_dispatch(db, "acct_cb_1", f"ord_cb_{i}", "paid", f"evt_cb_{i}")
+        db.commit()
+    finally:
+        db.close()
+    assert dispatcher.process_due_dispatches() == 2
+    assert calls["count"] == 1
+    db = app_module.SessionLocal()
+    try:
+        deferred = db.query(app_module.StoreDispatch).filter_by(event_id="evt_cb_2").first()
+        assert deferred.state == "deferred" and deferred.attempts == 0 and deferred.last_error == "circuit_open"
+    finally:
+        db.close()
+    c = app_module.app.test_client()
+    r = c.get("/stores/get/acct_cb_1", environ_overrides={"REMOTE_ADDR": "127.0.0.1"})
+    assert r.get_json()["circuit"]["state"] == "open"
+
+@pytest.mark.unit
+def test_closed_successes_are_buffered_until_needed(breaker):
+    backend = breaker.MemoryCircuitBackend()
+    breaker.set_backend(backend)
+    key = "https://hot-store.example"
+    t0 = datetime.utcnow()
+    for _ in range(3):
+        assert breaker.record_result(key, True, t0) == "closed"
+    assert backend.load(key) is None
+    # a falha grava os sucessos acumulados junto: 1 em 4 não abre o circuito
+    assert breaker.record_result(key, False, t0) == "closed"
+    assert (backend.load(key)["window_requests"], backend.load(key)["window_failures"]) == (4, 1)
+
+@pytest.mark.unit
+def test_conflicting_result_is_logged_when_dropped(breaker, monkeypatch):
+    backend = breaker.MemoryCircuitBackend()
+    breaker.set_backend(backend)
+    monkeypatch.setattr(backend, "save", lambda key, values, version: False)
+    logged = []
+    monkeypatch.setattr(breaker.structlog, "get_logger", lambda: SimpleNamespace(warning=lambda event, **kw: logged.append(event)))
+    assert breaker.record_result("https://busy-store.example", False) is None
+    assert logged == ["circuit_result_dropped"]
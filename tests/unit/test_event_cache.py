@@ -0,0 +1,38 @@
+import importlib
+import pytest
+
+@pytest.mark.unit
+def test_event_cache_lru_ttl_and_counters(monkeypatch):
+    mod = importlib.import_module("core.event_cache")
+    cache = mod.EventIdCache(2, 60)
+    assert cache.get("evt_a") is None
+    cache.add("evt_a")
+    cache.add("evt_b", dispatched=True)
+    assert cache.get("evt_a") is False
+    cache.add("evt_c")
+    assert cache.get("evt_b") is None
+    cache.add("evt_a", dispatched=True)
+    cache.add("evt_a")
+    assert cache.get("evt_a") is True
+    t = [1000.0]
+    monkeypatch.setattr(mod.time, "monotonic", lambda: t[0])
+    cache.add("evt_d")
+    t[0] += 61
+    assert cache.get("evt_d") is None
+    assert cache.stats() == {"size": 1, "maxSize": 2, "hits": 2, "misses": 3}
+
+@pytest.mark.unit
+def test_webhook_duplicate_served_from_cache(app_module, client, monkeypatch):
+    mod = importlib.import_module("core.event_cache")
+    mod.seen_events.clear()
+    calls = []
+    real = app_module.ingest_event
+    monkeypatch.setattr(app_module, "ingest_event", lambda e, **kw: calls.append(e["id"]) or real(e, **kw))
+    evt = {"id": "evt_cache_1", "type": "checkout.session.completed", "data": {"object": {"status": "complete"}}}
+    app_module.verify_webhook = lambda payload, sig, sec: evt
+    client.post("/webhook", data=b"{}")
+    r = client.post("/webhook", data=b"{}")
+    assert r.get_json()["status"] == "duplicate"
+    assert calls == ["evt_cache_1"]
+    stats = client.get("/status").get_json()["dedupe_cache"]
+    assert stats["hits"] == 1 and stats["misses"] == 1
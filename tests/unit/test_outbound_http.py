@@ -0,0 +1,32 @@
+import importlib
+import pytest
+
+@pytest.mark.unit
+def test_session_reused_per_host_and_evicted(app_module, monkeypatch):
+    outbound = importlib.import_module("core.outbound_http")
+    outbound.close_all()
+    monkeypatch.setattr(outbound.Config, "OUTBOUND_MAX_HOSTS", 2)
+    a1 = outbound.session_for("https://loja-a.com/payments/events/")
+    a2 = outbound.session_for("https://LOJA-A.com/other")
+    assert a1 is a2
+    b = outbound.session_for("https://loja-b.com/payments/events/")
+    assert b is not a1
+    outbound.session_for("https://loja-c.com/payments/events/")
+    assert outbound.session_for("https://loja-a.com/") is not a1
+    outbound.close_all()
+
+@pytest.mark.unit
+def test_post_uses_pooled_session_with_split_timeouts(app_module, monkeypatch):
+    outbound = importlib.import_module("core.outbound_http")
+    outbound.close_all()
+    monkeypatch.setattr(outbound.Config, "OUTBOUND_CONNECT_TIMEOUT_SECONDS", 2)
+    monkeypatch.setattr(outbound.Config, "OUTBOUND_READ_TIMEOUT_SECONDS", 7)
+    s = outbound.session_for("https://loja.com/")
+    captured = {}
+    def fake_post(url, data=None, headers=None, timeout=None):
+        captured.update({"url": url, "timeout": timeout})
+        return "resp"
+    monkeypatch.setattr(s, "post", fake_post)
+    assert outbound.post("https://loja.com/payments/events/", data="{}") == "resp"
+    assert captured["timeout"] == (2, 7)
+    outbound.close_all()
@@ -91,6 +91,7 @@ def test_get_products_paths(app_module, client):
     assert r.status_code == 403
     class P:
         def __init__(self): self.data = [SimpleNamespace(product=SimpleNamespace(id="prod1", name="N", description="D"), unit_amount=1234, id="price1")]
+        def auto_paging_iter(self): return iter(self.data)
     app_module.list_prices_with_products = lambda account_id: P()
     r = client.get(f"/api/v1/products/{acct}", headers=auth_headers(access))
     assert r.status_code == 200
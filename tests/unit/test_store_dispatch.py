@@ -23,10 +23,15 @@ def test_dispatch_event_to_store_with_hmac(monkeypatch):
         posted["headers"] = headers
         posted["timeout"] = timeout
         return SimpleNamespace(status_code=200)
-    monkeypatch.setattr(server.requests, "post", fake_post)
+    dispatcher = importlib.import_module("services.store_dispatch")
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    monkeypatch.setattr(dispatcher.Config, "CIRCUIT_BREAKER_ENABLED", False)
+    monkeypatch.setattr(dispatcher.outbound_http, "post", fake_post)
     server.verify_webhook = lambda payload, sig, sec: evt
     r = client.post("/webhook", data=b"{}")
     assert r.status_code == 200
+    assert posted == {}
+    assert dispatcher.process_due_dispatches() == 1
     assert posted["url"] == "https://loja.com/payments/events/"
     body = json.loads(posted["data"])
     assert body["orderId"] == "ord_1" and body["status"] == "paid"
@@ -49,10 +54,207 @@ def test_dispatch_idempotent(monkeypatch):
     def fake_post(url, data=None, headers=None, timeout=None):
         calls["count"] += 1
         return SimpleNamespace(status_code=200)
-    monkeypatch.setattr(server.requests, "post", fake_post)
+    dispatcher = importlib.import_module("services.store_dispatch")
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    monkeypatch.setattr(dispatcher.Config, "CIRCUIT_BREAKER_ENABLED", False)
+    monkeypatch.setattr(dispatcher.outbound_http, "post", fake_post)
     server.verify_webhook = lambda payload, sig, sec: evt
     r = client.post("/webhook", data=b"{}")
     assert r.status_code == 200
     r = client.post("/webhook", data=b"{}")
     assert r.status_code == 200
+    dispatcher.process_due_dispatches()
+    dispatcher.process_due_dispatches()
     assert calls["count"] == 1
+
+@pytest.mark.unit
+def test_dispatch_failure_rescheduled_not_slept(monkeypatch):
+    monkeypatch.setenv("PAYMENTS_EVENTS_SECRET", "secret123")
+    server = importlib.import_module("server")
+    importlib.reload(server)
+    server.Config.PAYMENTS_EVENTS_SECRET = "secret123"
+    client = server.app.test_client()
+    client.post("/api/v1/auth/register", json={"email":"o@example.com","password":"secret"})
+    r = client.post("/api/v1/auth/login", json={"email":"o@example.com","password":"secret"})
+    access = r.get_json()["access_token"]
+    server.stripe_client.v2.core.accounts.create = lambda payload: SimpleNamespace(id="acct_user_8")
+    client.post("/api/v1/create-connect-account", json={"email":"o@example.com","storeDomain":"https://loja.com"}, headers={"Authorization": f"Bearer {access}"})
+    evt = {"id":"evt_test_3","type":"checkout.session.completed","data":{"object":{"status":"complete","metadata":{"orderId":"ord_3"}}},"account":"acct_user_8"}
+    def failing_post(url, data=None, headers=None, timeout=None):
+        raise ConnectionError("store down")
+    dispatcher = importlib.import_module("services.store_dispatch")
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    monkeypatch.setattr(dispatcher.Config, "CIRCUIT_BREAKER_ENABLED", False)
+    monkeypatch.setattr(dispatcher.outbound_http, "post", failing_post)
+    server.verify_webhook = lambda payload, sig, sec: evt
+    r = client.post("/webhook", data=b"{}")
+    assert r.status_code == 200
+    assert dispatcher.process_due_dispatches() == 1
+    assert dispatcher.process_due_dispatches() == 0
+    db = server.SessionLocal()
+    try:
+        d = db.query(server.StoreDispatch).filter_by(event_id="evt_test_3").first()
+        assert d.attempts == 1 and d.delivered_at is None
+        assert d.next_attempt_at is not None and d.last_error == "store down"
+    finally:
+        db.close()
+
+@pytest.mark.unit
+def test_dispatch_dead_letter_and_requeue(monkeypatch):
+    monkeypatch.setenv("PAYMENTS_EVENTS_SECRET", "secret123")
+    server = importlib.import_module("server")
+    importlib.reload(server)
+    server.Config.PAYMENTS_EVENTS_SECRET = "secret123"
+    client = server.app.test_client()
+    client.post("/api/v1/auth/register", json={"email":"q@example.com","password":"secret"})
+    r = client.post("/api/v1/auth/login", json={"email":"q@example.com","password":"secret"})
+    access = r.get_json()["access_token"]
+    server.stripe_client.v2.core.accounts.create = lambda payload: SimpleNamespace(id="acct_user_9")
+    client.post("/api/v1/create-connect-account", json={"email":"q@example.com","storeDomain":"https://loja.com"}, headers={"Authorization": f"Bearer {access}"})
+    evt = {"id":"evt_test_4","type":"checkout.session.completed","data":{"object":{"status":"complete","metadata":{"orderId":"ord_4"}}},"account":"acct_user_9"}
+    responses = [SimpleNamespace(status_code=503), SimpleNamespace(status_code=200)]
+    def fake_post(url, data=None, headers=None, timeout=None):
+        return responses.pop(0)
+    dispatcher = importlib.import_module("services.store_dispatch")
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    monkeypatch.setattr(dispatcher.Config, "CIRCUIT_BREAKER_ENABLED", False)
+    monkeypatch.setattr(dispatcher.Config, "STORE_DISPATCH_MAX_ATTEMPTS", 1)
+    monkeypatch.setattr(dispatcher.outbound_http, "post", fake_post)
+    server.verify_webhook = lambda payload, sig, sec: evt
+    client.post("/webhook", data=b"{}")
+    assert dispatcher.process_due_dispatches() == 1
+    local = {"REMOTE_ADDR": "127.0.0.1"}
+    r = client.get("/stores/dispatches/acct_user_9?state=dead", environ_overrides=local)
+    items = r.get_json()["dispatches"]
+    assert len(items) == 1 and items[0]["state"] == "dead" and items[0]["lastError"] == "http_503"
+    r = client.post("/stores/dispatches/acct_user_9/requeue", environ_overrides=local)
+    assert r.get_json()["requeued"] == 1
+    assert dispatcher.process_due_dispatches() == 1
+    r = client.get("/stores/dispatches/acct_user_9", environ_overrides=local)
+    item = r.get_json()["dispatches"][0]
+    assert item["state"] == "delivered" and item["deliveredAt"]
+
+@pytest.mark.unit
+def test_retry_delay_backoff_is_jittered_and_capped(monkeypatch):
+    dispatcher = importlib.import_module("services.store_dispatch")
+    monkeypatch.setattr(dispatcher.Config, "STORE_DISPATCH_BACKOFF_BASE_SECONDS", 30)
+    monkeypatch.setattr(dispatcher.Config, "STORE_DISPATCH_BACKOFF_MAX_SECONDS", 3600)
+    assert 15 <= dispatcher.next_retry_delay(1) <= 30
+    assert 120 <= dispatcher.next_retry_delay(4) <= 240
+    assert 1800 <= dispatcher.next_retry_delay(20) <= 3600
+
+@pytest.mark.unit
+def test_batch_mode_coalesces_and_acknowledges_per_order(app_module, monkeypatch):
+    import hmac
+    import hashlib
+    dispatcher = importlib.import_module("services.store_dispatch")
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    monkeypatch.setattr(dispatcher.Config, "CIRCUIT_BREAKER_ENABLED", False)
+    monkeypatch.setattr(dispatcher.Config, "STORE_DISPATCH_BATCH_WINDOW_SECONDS", 0)
+    c = app_module.app.test_client()
+    local = {"REMOTE_ADDR": "127.0.0.1"}
+    r = c.post("/admin/users/create", json={"email":"batch@example.com","password":"secret"}, environ_overrides=local)
+    uid = r.get_json()["id"]
+    c.post("/admin/stores/upsert", json={"userId":uid,"accountId":"acct_batch_1","storeDomain":"https://marketplace.example"}, environ_overrides=local)
+    r = c.put("/admin/stores/batch/acct_batch_1", json={"enabled": True}, environ_overrides=local)
+    assert r.get_json()["batchEnabled"] is True
+    db = app_module.SessionLocal()
+    try:
+        for i in (1, 2, 3):
+            dispatcher.enqueue_dispatch(db, "acct_batch_1", f"ord_b{i}", "paid", f"evt_b{i}")
+        db.commit()
+    finally:
+        db.close()
+    posted = []
+    def fake_post(url, data=None, headers=None, timeout=None):
+        posted.append((url, data, headers))
+        return SimpleNamespace(status_code=200, json=lambda: {"acknowledged": ["ord_b1", "ord_b2"]})
+    monkeypatch.setattr(dispatcher.outbound_http, "post", fake_post)
+    assert dispatcher.process_due_dispatches(limit=1) == 3
+    assert len(posted) == 1
+    url, body, headers = posted[0]
+    assert url == "https://marketplace.example/payments/events/"
+    assert [o["orderId"] for o in json.loads(body)["orders"]] == ["ord_b1", "ord_b2", "ord_b3"]
+    assert headers[dispatcher.Config.PAYMENTS_EVENTS_HEADER] == hmac.new(b"secret123", body.encode("utf-8"), hashlib.sha256).hexdigest()
+    db = app_module.SessionLocal()
+    try:
+        states = {d.order_id: (d.state, d.last_error) for d in db.query(app_module.StoreDispatch).filter_by(account_id="acct_batch_1").all()}
+    finally:
+        db.close()
+    assert states["ord_b1"] == ("delivered", None) and states["ord_b2"] == ("delivered", None)
+    assert states["ord_b3"] == ("pending", "not_acknowledged")
+
+@pytest.mark.unit
+def test_delivery_requires_owning_the_lease(app_module, monkeypatch):
+    from datetime import datetime, timedelta
+    dispatcher = importlib.import_module("services.store_dispatch")
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    monkeypatch.setattr(dispatcher.Config, "CIRCUIT_BREAKER_ENABLED", False)
+    posted = []
+    monkeypatch.setattr(dispatcher.outbound_http, "post", lambda url, data=None, headers=None, timeout=None: posted.append(data) or SimpleNamespace(status_code=200))
+    while dispatcher.process_due_dispatches():
+        pass
+    posted.clear()
+    db = app_module.SessionLocal()
+    try:
+        u = app_module.User(email="lease-owner@example.com", password_hash="x")
+        db.add(u)
+        db.commit()
+        db.add(app_module.StripeAccount(user_id=u.id, account_id="acct_lease_owner", store_domain="https://loja.com"))
+        # linha em backoff (ou com lease de outro worker)
+        d = app_module.StoreDispatch(event_id="evt_lease_owner", account_id="acct_lease_owner", order_id="ord_lease_owner", status="paid",
+                                     attempts=1, state="pending", next_attempt_at=datetime.utcnow() + timedelta(seconds=50))
+        db.add(d)
+        db.commit()
+        rid = d.id
+    finally:
+        db.close()
+    assert dispatcher.deliver_dispatch(rid, dispatcher.lease_until()) is False
+    assert posted == []
+    db = app_module.SessionLocal()
+    try:
+        db.get(app_module.StoreDispatch, rid).next_attempt_at = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+    finally:
+        db.close()
+    (claimed_id, _, lease), = dispatcher._claim_due(10, account_id="acct_lease_owner")
+    # o lease venceu e outro dispatcher levou a linha: quem fez o primeiro claim não envia
+    stolen = dispatcher.lease_until() + timedelta(seconds=30)
+    db = app_module.SessionLocal()
+    try:
+        db.get(app_module.StoreDispatch, rid).next_attempt_at = stolen
+        db.commit()
+    finally:
+        db.close()
+    assert dispatcher.deliver_dispatch(claimed_id, lease) is False
+    assert dispatcher.deliver_dispatch(claimed_id, stolen) is True
+    assert len(posted) == 1
+    db = app_module.SessionLocal()
+    try:
+        assert db.get(app_module.StoreDispatch, rid).attempts == 2
+    finally:
+        db.close()
+
+@pytest.mark.unit
+def test_legacy_undelivered_dispatches_are_requeued_on_migration(app_module, tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+    from sqlalchemy import create_engine, text
+    core_db = importlib.import_module("core.db")
+    legacy = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}", future=True)
+    recent = datetime.utcnow() - timedelta(minutes=5)
+    old = datetime.utcnow() - timedelta(days=3)
+    with legacy.begin() as conn:
+        conn.execute(text("CREATE TABLE webhook_events (id INTEGER PRIMARY KEY, event_id VARCHAR(255) UNIQUE NOT NULL, received_at DATETIME NOT NULL,"
+                          " order_id VARCHAR(255), account_id VARCHAR(255), status VARCHAR(64), source VARCHAR(32), processed_at DATETIME)"))
+        conn.execute(text("CREATE TABLE store_dispatch (id INTEGER PRIMARY KEY, event_id VARCHAR(255) UNIQUE NOT NULL, account_id VARCHAR(255) NOT NULL,"
+                          " order_id VARCHAR(255), status VARCHAR(64), attempts INTEGER NOT NULL, delivered_at DATETIME)"))
+        for ev, received, delivered in (("evt_legacy_recent", recent, None), ("evt_legacy_old", old, None), ("evt_legacy_ok", recent, recent)):
+            conn.execute(text("INSERT INTO webhook_events (event_id, received_at) VALUES (:e, :r)"), {"e": ev, "r": received})
+            conn.execute(text("INSERT INTO store_dispatch (event_id, account_id, attempts, delivered_at) VALUES (:e, 'acct_legacy', 3, :d)"), {"e": ev, "d": delivered})
+    monkeypatch.setattr(core_db, "engine", legacy)
+    core_db.init_db()
+    with legacy.connect() as conn:
+        rows = {r[0]: (r[1], r[2]) for r in conn.execute(text("SELECT event_id, state, next_attempt_at FROM store_dispatch"))}
+    assert rows["evt_legacy_recent"][0] == "pending" and rows["evt_legacy_recent"][1] is not None
+    assert rows["evt_legacy_old"] == ("dead", None)
+    assert rows["evt_legacy_ok"][0] == "delivered"
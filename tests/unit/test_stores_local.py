@@ -26,3 +26,45 @@ def test_stores_list_and_detail_flow(app_module, client):
     r = c.get("/stores/acct_m1", environ_overrides={"REMOTE_ADDR": "127.0.0.1"})
     assert r.status_code == 200
     assert "Detalhes da Loja" in r.get_data(as_text=True)
+
+@pytest.mark.unit
+def test_local_listings_use_keyset_cursors(app_module):
+    c = app_module.app.test_client()
+    local = {"REMOTE_ADDR": "127.0.0.1"}
+    db = app_module.SessionLocal()
+    try:
+        for i in range(3):
+            db.add(app_module.User(email=f"page{i}@example.com", password_hash="x"))
+        for i in range(3):
+            db.add(app_module.StoreDispatch(event_id=f"evt_page_{i}", account_id="acct_page", order_id=f"ord_{i}", status="paid", attempts=0, state="pending"))
+        db.commit()
+    finally:
+        db.close()
+    seen, cursor = [], None
+    while True:
+        r = c.get("/admin/users/list?limit=2" + (f"&cursor={cursor}" if cursor else ""), environ_overrides=local)
+        body = r.get_json()
+        assert len(body["users"]) <= 2
+        seen += [u["id"] for u in body["users"]]
+        cursor = body["next_cursor"]
+        if not cursor:
+            break
+    assert seen == sorted(seen) and len(seen) == len(set(seen)) >= 3
+    r = c.get("/stores/dispatches/acct_page?limit=2", environ_overrides=local)
+    first = r.get_json()
+    assert [d["eventId"] for d in first["dispatches"]] == ["evt_page_2", "evt_page_1"]
+    r = c.get(f"/stores/dispatches/acct_page?limit=2&cursor={first['next_cursor']}", environ_overrides=local)
+    second = r.get_json()
+    assert [d["eventId"] for d in second["dispatches"]] == ["evt_page_0"] and second["next_cursor"] is None
+    r = c.get("/stores/list?cursor=not-a-cursor", environ_overrides=local)
+    assert r.status_code == 400 and r.get_json()["error"] == "invalid_cursor"
+
+@pytest.mark.unit
+def test_init_db_drops_replaced_webhook_log_index(app_module):
+    from sqlalchemy import inspect, text
+    core_db = importlib.import_module("core.db")
+    with core_db.engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_webhook_logs_account ON webhook_logs (account_id, id)"))
+    core_db.init_db()
+    names = [i["name"] for i in inspect(core_db.engine).get_indexes("webhook_logs")]
+    assert "ix_webhook_logs_account" not in names and "ix_webhook_logs_account_received" in names
@@ -0,0 +1,207 @@
+import importlib
+import json
+import time
+from types import SimpleNamespace
+import pytest
+
+def auth_headers(access_token):
+    return {"Authorization": f"Bearer {access_token}"}
+
+@pytest.fixture()
+def cache(app_module):
+    mod = importlib.import_module("core.stripe_cache")
+    mod.set_backend(mod.MemoryCacheBackend(100))
+    yield mod
+    mod.set_backend(None)
+
+@pytest.mark.unit
+def test_memory_backend_ttl_and_lru():
+    mod = importlib.import_module("core.stripe_cache")
+    b = mod.MemoryCacheBackend(2)
+    b.set("a", [1], 60)
+    b.set("b", [2], 60)
+    b.get("a")
+    b.set("c", [3], 60)
+    assert b.get("a") == [1] and b.get("b") is None and b.get("c") == [3]
+    b.set("d", [4], -1)
+    assert b.get("d") is None
+
+@pytest.mark.unit
+def test_db_backend_roundtrip(app_module):
+    mod = importlib.import_module("core.stripe_cache")
+    b = mod.DbCacheBackend()
+    b.set("catalog:acct_db", [{"priceId": "p1"}], 60)
+    b.set("catalog:acct_db", [{"priceId": "p2"}], 60)
+    assert b.get("catalog:acct_db") == [{"priceId": "p2"}]
+    b.delete("catalog:acct_db")
+    assert b.get("catalog:acct_db") is None
+    b.set_many({"price:acct_db:p1": {"type": "one_time"}, "price:acct_db:p2": {"type": "recurring"}}, 60)
+    b.set_many({"price:acct_db:p2": {"type": "one_time"}}, 60)
+    assert b.get("price:acct_db:p1") == {"type": "one_time"} and b.get("price:acct_db:p2") == {"type": "one_time"}
+
+@pytest.mark.unit
+def test_catalog_cached_and_invalidated_by_price_webhook(app_module, client, cache, monkeypatch):
+    client.post("/api/v1/auth/register", json={"email": "cat@example.com", "password": "secret"})
+    r = client.post("/api/v1/auth/login", json={"email": "cat@example.com", "password": "secret"})
+    access = r.get_json()["access_token"]
+    app_module.stripe_client.v2.core.accounts.create = lambda payload: SimpleNamespace(id="acct_cat_1")
+    client.post("/api/v1/create-connect-account", json={"email": "cat@example.com"}, headers=auth_headers(access))
+    r = client.post("/api/v1/auth/login", json={"email": "cat@example.com", "password": "secret"})
+    access = r.get_json()["access_token"]
+    calls = []
+    def fake_list(account_id):
+        calls.append(account_id)
+        data = [SimpleNamespace(product=SimpleNamespace(id="prod1", name="N", description="D"), unit_amount=100 * len(calls), id="price1")]
+        return SimpleNamespace(data=data, auto_paging_iter=lambda: iter(data))
+    app_module.list_prices_with_products = fake_list
+    assert client.get("/api/v1/products/acct_cat_1", headers=auth_headers(access)).get_json()[0]["price"] == 100
+    assert client.get("/api/v1/stores/acct_cat_1/products", headers=auth_headers(access)).get_json()[0]["price"] == 100
+    assert calls == ["acct_cat_1"]
+    app_module.verify_webhook = lambda payload, sig, secret: json.loads(payload)
+    r = client.post("/webhook", data=json.dumps({"id": f"evt_price_{time.time()}", "type": "price.updated", "account": "acct_cat_1", "data": {"object": {"id": "price1"}}}))
+    assert r.status_code == 200
+    assert client.get("/api/v1/products/acct_cat_1", headers=auth_headers(access)).get_json()[0]["price"] == 200
+    assert calls == ["acct_cat_1", "acct_cat_1"]
+
+def _price(i):
+    return SimpleNamespace(product=SimpleNamespace(id=f"prod{i}", name="N", description="D"), unit_amount=i, id=f"price{i}")
+
+def _login_with_account(app_module, client, email, account_id):
+    client.post("/api/v1/auth/register", json={"email": email, "password": "secret"})
+    r = client.post("/api/v1/auth/login", json={"email": email, "password": "secret"})
+    access = r.get_json()["access_token"]
+    app_module.stripe_client.v2.core.accounts.create = lambda payload: SimpleNamespace(id=account_id)
+    client.post("/api/v1/create-connect-account", json={"email": email}, headers=auth_headers(access))
+    r = client.post("/api/v1/auth/login", json={"email": email, "password": "secret"})
+    return r.get_json()["access_token"]
+
+@pytest.mark.unit
+def test_catalog_streams_every_page(app_module, client, cache):
+    access = _login_with_account(app_module, client, "stream@example.com", "acct_stream_1")
+    prices = [_price(i) for i in range(250)]
+    app_module.list_prices_with_products = lambda account_id: SimpleNamespace(data=prices[:100], auto_paging_iter=lambda: iter(prices))
+    r = client.get("/api/v1/products/acct_stream_1", headers=auth_headers(access))
+    assert r.status_code == 200 and r.is_streamed
+    body = json.loads(r.get_data(as_text=True))
+    assert len(body) == 250 and body[-1]["priceId"] == "price249"
+    assert len(cache.get_catalog("acct_stream_1")) == 250
+
+@pytest.mark.unit
+def test_catalog_client_paging_passthrough(app_module, client, cache):
+    access = _login_with_account(app_module, client, "page@example.com", "acct_page_1")
+    calls = []
+    def fake_list(account_id, limit=100, starting_after=None):
+        calls.append((limit, starting_after))
+        return SimpleNamespace(data=[_price(1), _price(2)], has_more=True)
+    app_module.list_prices_with_products = fake_list
+    r = client.get("/api/v1/products/acct_page_1?limit=2&starting_after=price0", headers=auth_headers(access))
+    assert r.status_code == 200
+    assert [p["priceId"] for p in r.get_json()] == ["price1", "price2"]
+    assert r.headers["X-Next-Cursor"] == "price2"
+    assert calls == [(2, "price0")]
+    assert cache.get_catalog("acct_page_1") is None
+
+@pytest.mark.unit
+def test_checkout_uses_cached_price_type(app_module, client, cache):
+    access = _login_with_account(app_module, client, "pm@example.com", "acct_pm_1")
+    retrieved = []
+    def fake_retrieve(price_id, account_id):
+        retrieved.append(price_id)
+        return SimpleNamespace(id=price_id, type="recurring", recurring=SimpleNamespace(interval="month"), currency="brl", unit_amount=990)
+    modes = []
+    def fake_session(account_id, price_id, mode, success_url, cancel_url, fee_amount):
+        modes.append(mode)
+        return SimpleNamespace(url="https://checkout.example/s")
+    app_module.retrieve_price = fake_retrieve
+    app_module.create_checkout_session_connected = fake_session
+    for _ in range(2):
+        r = client.post("/api/v1/create-checkout-session", json={"accountId": "acct_pm_1", "priceId": "price_pm"}, headers=auth_headers(access))
+        assert r.status_code == 303
+    assert retrieved == ["price_pm"] and modes == ["subscription", "subscription"]
+    assert cache.get_price_meta("acct_pm_1", "price_pm") == {"type": "recurring", "interval": "month", "currency": "brl", "unitAmount": 990}
+
+@pytest.mark.unit
+def test_price_meta_filled_from_webhook_and_catalog(app_module, client, cache):
+    app_module.verify_webhook = lambda payload, sig, secret: json.loads(payload)
+    price = {"id": "price_wh", "object": "price", "type": "one_time", "recurring": None, "currency": "brl", "unit_amount": 500}
+    client.post("/webhook", data=json.dumps({"id": f"evt_pc_{time.time()}", "type": "price.created", "account": "acct_pm_2", "data": {"object": price}}))
+    assert cache.get_price_meta("acct_pm_2", "price_wh")["type"] == "one_time"
+    cache.put_prices("acct_pm_2", [SimpleNamespace(id="price_cat", type="recurring", recurring={"interval": "year"}, currency="brl", unit_amount=1)])
+    assert cache.get_price_meta("acct_pm_2", "price_cat")["interval"] == "year"
+    client.post("/webhook", data=json.dumps({"id": f"evt_pd_{time.time()}", "type": "price.deleted", "account": "acct_pm_2", "data": {"object": price}}))
+    assert cache.get_price_meta("acct_pm_2", "price_wh") is None
+
+def _account(account_id, payouts):
+    return {
+        "id": account_id,
+        "configuration": {"merchant": {"capabilities": {"stripe_balance": {"payouts": {"status": payouts}}, "card_payments": {"status": "active"}}}},
+        "requirements": {"summary": {"minimum_deadline": {"status": None}}, "entries": []},
+    }
+
+@pytest.mark.unit
+def test_account_status_served_stale_while_revalidating(app_module, client, cache, monkeypatch):
+    access = _login_with_account(app_module, client, "as@example.com", "acct_as_1")
+    monkeypatch.setattr(cache.Config, "ACCOUNT_STATUS_FRESH_SECONDS", 30)
+    state = {"payouts": "pending", "calls": 0}
+    def fake_retrieve(account_id, opts):
+        state["calls"] += 1
+        return _account(account_id, state["payouts"])
+    app_module.stripe_client.v2.core.accounts.retrieve = fake_retrieve
+    assert client.get("/api/v1/stores/acct_as_1/status", headers=auth_headers(access)).get_json()["payoutsEnabled"] is False
+    assert client.get("/api/v1/account-status/acct_as_1", headers=auth_headers(access)).get_json()["payoutsEnabled"] is False
+    assert state["calls"] == 1
+    state["payouts"] = "active"
+    entry = cache.get_backend().get("account_status:acct_as_1")
+    cache.get_backend().set("account_status:acct_as_1", dict(entry, fetchedAt=entry["fetchedAt"] - 60), 60)
+    threads = []
+    real = cache.revalidate_account_status
+    monkeypatch.setattr(cache, "revalidate_account_status", lambda a, f: threads.append(real(a, f)) or threads[-1])
+    # vencido: responde o valor antigo e atualiza em segundo plano
+    assert client.get("/api/v1/account-status/acct_as_1", headers=auth_headers(access)).get_json()["payoutsEnabled"] is False
+    threads[0].join()
+    assert client.get("/api/v1/account-status/acct_as_1", headers=auth_headers(access)).get_json()["payoutsEnabled"] is True
+    assert state["calls"] == 2
+
+@pytest.mark.unit
+def test_account_updated_webhook_refreshes_status(app_module, client, cache, monkeypatch):
+    access = _login_with_account(app_module, client, "au@example.com", "acct_au_1")
+    state = {"payouts": "pending"}
+    app_module.stripe_client.v2.core.accounts.retrieve = lambda account_id, opts: _account(account_id, state["payouts"])
+    assert client.get("/api/v1/account-status/acct_au_1", headers=auth_headers(access)).get_json()["payoutsEnabled"] is False
+    state["payouts"] = "active"
+    threads = []
+    real = cache.account_status_changed
+    monkeypatch.setattr(cache, "account_status_changed", lambda a, f: threads.append(real(a, f)) or threads[-1])
+    app_module.verify_webhook = lambda payload, sig, secret: json.loads(payload)
+    client.post("/webhook", data=json.dumps({"id": f"evt_au_{time.time()}", "type": "account.updated", "account": "acct_au_1", "data": {"object": {"id": "acct_au_1"}}}))
+    assert len(threads) == 1
+    threads[0].join()
+    assert client.get("/api/v1/account-status/acct_au_1", headers=auth_headers(access)).get_json()["payoutsEnabled"] is True
+
+@pytest.mark.unit
+def test_catalog_stream_closes_array_when_later_page_fails(app_module, client, cache):
+    access = _login_with_account(app_module, client, "fail@example.com", "acct_fail_1")
+    first = [_price(i) for i in range(100)]
+    def pages():
+        yield from first
+        raise RuntimeError("page 2 failed")
+    app_module.list_prices_with_products = lambda account_id: SimpleNamespace(data=first, auto_paging_iter=pages)
+    r = client.get("/api/v1/products/acct_fail_1", headers=auth_headers(access))
+    assert r.status_code == 200
+    body = json.loads(r.get_data(as_text=True))
+    assert len(body) == 101
+    assert body[-1] == {"error": "catalog_stream_interrupted"}
+    assert cache.get_catalog("acct_fail_1") is None
+
+@pytest.mark.unit
+def test_catalog_stream_survives_cache_failures(app_module, client, cache, monkeypatch):
+    access = _login_with_account(app_module, client, "cf@example.com", "acct_cf_1")
+    prices = [_price(i) for i in range(150)]
+    app_module.list_prices_with_products = lambda account_id: SimpleNamespace(data=prices[:100], auto_paging_iter=lambda: iter(prices))
+    def broken(*args):
+        raise RuntimeError("cache db down")
+    monkeypatch.setattr(cache, "put_prices", broken)
+    monkeypatch.setattr(cache, "put_catalog", broken)
+    r = client.get("/api/v1/products/acct_cf_1", headers=auth_headers(access))
+    body = json.loads(r.get_data(as_text=True))
+    assert len(body) == 150 and body[-1]["priceId"] == "price149"
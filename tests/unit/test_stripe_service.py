@@ -37,6 +37,8 @@ def test_list_prices_with_products(app_module, monkeypatch):
     r2 = svc.list_prices_with_products("acct_1")
     assert r1.kwargs["expand"] == ["data.product"] and r1.kwargs["active"] and r1.kwargs["limit"] == 100 and "stripe_account" not in r1.kwargs
     assert r2.kwargs["stripe_account"] == "acct_1"
+    r3 = svc.list_prices_with_products("acct_1", limit=10, starting_after="price_9")
+    assert r3.kwargs["limit"] == 10 and r3.kwargs["starting_after"] == "price_9"
 
 @pytest.mark.unit
 def test_create_checkout_sessions(app_module, monkeypatch):
@@ -65,8 +67,78 @@ def test_retrieve_price(app_module, monkeypatch):
 @pytest.mark.unit
 def test_verify_webhook(app_module, monkeypatch):
     svc = importlib.import_module("core.stripe_service")
-    def fake_construct(payload, sig, secret):
-        return {"id":"evt_x","type":"t"}
-    monkeypatch.setattr(svc.stripe.Webhook, "construct_event", fake_construct)
-    evt = svc.verify_webhook(b"{}", "sig", "sec")
+    body = '{"id":"evt_x","type":"t"}'
+    header = svc.stripe.WebhookSignature.generate_signature_header(body, "whsec_new")
+    evt = svc.verify_webhook(body.encode(), header, ["whsec_old", "whsec_new"])
     assert evt["id"] == "evt_x"
+    assert svc._last_webhook_secret == "whsec_new"
+    with pytest.raises(svc.stripe.error.SignatureVerificationError):
+        svc.verify_webhook(body.encode(), header, ["whsec_other"])
+    stale = svc.stripe.WebhookSignature.generate_signature_header(body, "whsec_new", timestamp=int(svc.time.time()) - 3600)
+    def no_hmac(*a, **k):
+        raise AssertionError("hmac computed for stale timestamp")
+    monkeypatch.setattr(svc.hmac, "new", no_hmac)
+    with pytest.raises(svc.stripe.error.SignatureVerificationError):
+        svc.verify_webhook(body.encode(), stale, ["whsec_new"], tolerance=300)
+    with pytest.raises(svc.stripe.error.SignatureVerificationError):
+        svc.verify_webhook(body.encode(), None, ["whsec_new"])
+
+def _wait_shared(svc, count):
+    import time
+    deadline = time.time() + 5
+    while svc.single_flight_stats()["shared"] < count and time.time() < deadline:
+        time.sleep(0.01)
+
+@pytest.mark.unit
+def test_single_flight_shares_concurrent_identical_reads(app_module, monkeypatch):
+    import threading
+    svc = importlib.import_module("core.stripe_service")
+    release = threading.Event()
+    calls = []
+    def fake_retrieve(pid, stripe_account=None):
+        calls.append(pid)
+        release.wait(5)
+        return SimpleNamespace(id=pid, type="one_time")
+    monkeypatch.setattr(svc.stripe.Price, "retrieve", fake_retrieve)
+    base = svc.single_flight_stats()["shared"]
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(svc.retrieve_price("price_sf", "acct_1"))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    _wait_shared(svc, base + 4)
+    release.set()
+    for t in threads:
+        t.join()
+    assert calls == ["price_sf"]
+    assert len(results) == 5 and all(r is results[0] for r in results)
+    svc.retrieve_price("price_sf", "acct_1")
+    assert calls == ["price_sf", "price_sf"]
+
+@pytest.mark.unit
+def test_single_flight_shares_errors_and_times_out(app_module):
+    import threading
+    svc = importlib.import_module("core.stripe_service")
+    started, release = threading.Event(), threading.Event()
+    def slow_fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("stripe down")
+    errors = []
+    def call():
+        try:
+            svc.single_flight(("t", 1), slow_fail)
+        except ValueError as e:
+            errors.append(e)
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    with pytest.raises(svc.SingleFlightTimeout):
+        svc.single_flight(("t", 1), lambda: "unused", timeout=0.01)
+    base = svc.single_flight_stats()["shared"]
+    follower = threading.Thread(target=call)
+    follower.start()
+    _wait_shared(svc, base + 1)
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2 and errors[0] is errors[1]
@@ -0,0 +1,117 @@
+import importlib
+import pytest
+
+@pytest.mark.unit
+def test_ingest_resolves_account_and_enqueues(app_module, monkeypatch):
+    ingest = importlib.import_module("services.webhook_ingest")
+    dispatcher = importlib.import_module("services.store_dispatch")
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    db = app_module.SessionLocal()
+    try:
+        from core.db import OrderCorrelation
+        u = app_module.User(email="ing@example.com", password_hash="x")
+        db.add(u)
+        db.commit()
+        db.add(app_module.StripeAccount(user_id=u.id, account_id="acct_ing_1", store_domain="https://loja.com"))
+        db.add(OrderCorrelation(order_id="ord_ing_1", account_id="acct_ing_1"))
+        db.commit()
+    finally:
+        db.close()
+    evt = {"id": "evt_ing_1", "type": "checkout.session.completed", "data": {"object": {"status": "complete", "metadata": {"orderId": "ord_ing_1"}}}}
+    res = ingest.ingest_event(evt)
+    assert res.status == "processed" and res.account_source == "correlation"
+    assert res.account_id == "acct_ing_1" and res.enqueued
+    db = app_module.SessionLocal()
+    try:
+        wev = db.query(app_module.WebhookEvent).filter_by(event_id="evt_ing_1").first()
+        assert wev.processed_at is not None and wev.account_id == "acct_ing_1" and wev.order_id == "ord_ing_1"
+        assert db.query(app_module.WebhookLog).filter_by(event_id="evt_ing_1").count() == 1
+        assert db.query(app_module.StoreDispatch).filter_by(event_id="evt_ing_1").first().next_attempt_at is not None
+    finally:
+        db.close()
+    assert ingest.ingest_event(evt).status == "duplicate"
+
+@pytest.mark.unit
+def test_ingest_nonfinal_and_unhandled(app_module):
+    ingest = importlib.import_module("services.webhook_ingest")
+    res = ingest.ingest_event({"id": "evt_ing_2", "type": "checkout.session.completed", "data": {"object": {"status": "open"}}})
+    assert res.status == "ignored" and res.raw_status == "open"
+    res = ingest.ingest_event({"id": "evt_ing_3", "type": "customer.subscription.deleted", "data": {"object": {}}})
+    assert res.status == "unhandled"
+
+@pytest.mark.unit
+def test_sync_list_page_keeps_original_item_bytes(app_module):
+    sync = importlib.import_module("services.webhook_sync")
+    body = '{\n  "object": "list",\n  "data": [\n    {\n      "id": "evt_a",\n      "data": {"object": {"data": [1, 2]}}\n    },\n    {"id": "evt_b", "type": "x"}\n  ],\n  "has_more": true,\n  "url": "/v1/events"\n}'
+    items, meta = sync._list_page(body)
+    assert [ev["id"] for ev, _ in items] == ["evt_a", "evt_b"]
+    assert items[0][1] == '{\n      "id": "evt_a",\n      "data": {"object": {"data": [1, 2]}}\n    }'
+    assert items[1][1] == '{"id": "evt_b", "type": "x"}'
+    assert meta["has_more"] is True and meta["object"] == "list"
+
+@pytest.mark.unit
+def test_sync_list_page_only_splits_top_level_data(app_module):
+    sync = importlib.import_module("services.webhook_sync")
+    body = '{"object": "list", "extra": {"data": [{"id": "nested"}]}, "note": "\\"data\\": [", "data": [{"id": "evt_c", "data": {"object": {"data": [{"x": "]}"}]}}}], "has_more": false}'
+    items, meta = sync._list_page(body)
+    assert [raw for _, raw in items] == ['{"id": "evt_c", "data": {"object": {"data": [{"x": "]}"}]}}}']
+    assert meta["extra"] == {"data": [{"id": "nested"}]} and meta["has_more"] is False
+
+@pytest.mark.unit
+@pytest.mark.parametrize("body", ['{"object": "list", "data": [{"id": "evt_a"}, {"id": "ev', '<html>bad gateway</html>', '', '{"object": "list"}', '[]'])
+def test_sync_list_page_rejects_truncated_and_malformed_bodies(app_module, body):
+    sync = importlib.import_module("services.webhook_sync")
+    with pytest.raises(ValueError):
+        sync._list_page(body)
+    with pytest.raises(ValueError):
+        sync._data_spans(body)
+
+@pytest.mark.unit
+def test_payload_compressed_and_backfilled(app_module, monkeypatch):
+    codec = importlib.import_module("core.payload_codec")
+    maint = importlib.import_module("services.webhook_log_maintenance")
+    ingest = importlib.import_module("services.webhook_ingest")
+    monkeypatch.setattr(codec.Config, "WEBHOOK_PAYLOAD_CODEC", "zlib")
+    raw = b'{"id": "evt_zip_1", "type": "customer.subscription.deleted", "data": {"object": {}}}'
+    ingest.ingest_event({"id": "evt_zip_1", "type": "customer.subscription.deleted", "data": {"object": {}}}, raw=raw)
+    db = app_module.SessionLocal()
+    try:
+        db.add(app_module.WebhookLog(event_id="evt_legacy_1", event_type="t", payload='{"id": "evt_legacy_1"}'))
+        db.add(app_module.WebhookLog(event_id="evt_legacy_2", event_type="t", payload='{"id": "evt_legacy_2"}', payload_codec="identity"))
+        db.commit()
+        log = db.query(app_module.WebhookLog).filter_by(event_id="evt_zip_1").first()
+        assert log.payload_codec == "zlib" and log.payload == ""
+        assert codec.payload_of(log).encode() == raw
+    finally:
+        db.close()
+    assert maint.compress_existing_payloads(batch_size=1) == 2
+    assert maint.compress_existing_payloads(batch_size=1) == 0
+    db = app_module.SessionLocal()
+    try:
+        for eid in ("evt_legacy_1", "evt_legacy_2"):
+            log = db.query(app_module.WebhookLog).filter_by(event_id=eid).first()
+            assert log.payload_codec == "zlib" and codec.payload_of(log) == '{"id": "%s"}' % eid
+    finally:
+        db.close()
+
+@pytest.mark.unit
+def test_store_webhooks_view_uses_indexed_columns(app_module, client):
+    maint = importlib.import_module("services.webhook_log_maintenance")
+    ingest = importlib.import_module("services.webhook_ingest")
+    ingest.ingest_event({"id": "evt_col_1", "type": "customer.subscription.deleted", "account": "acct_col_1", "created": 1760000000, "data": {"object": {}}})
+    db = app_module.SessionLocal()
+    try:
+        db.add(app_module.WebhookLog(event_id="evt_col_old", event_type="payment_intent.succeeded", payload='{"id":"evt_col_old","account":"acct_col_1","created":1750000000}'))
+        db.commit()
+    finally:
+        db.close()
+    assert maint.backfill_event_columns(batch_size=1) >= 1
+    r = client.get("/stores/webhooks/acct_col_1")
+    ids = [w["eventId"] for w in r.get_json()["webhooks"]]
+    assert ids == ["evt_col_old", "evt_col_1"]
+    db = app_module.SessionLocal()
+    try:
+        log = db.query(app_module.WebhookLog).filter_by(event_id="evt_col_1").first()
+        assert log.account_id == "acct_col_1" and log.event_created.year == 2025
+    finally:
+        db.close()
@@ -0,0 +1,134 @@
+import importlib
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+
+@pytest.mark.unit
+def test_replay_resends_delivered_orders_from_local_log(app_module, monkeypatch):
+    dispatcher = importlib.import_module("services.store_dispatch")
+    ingest = importlib.import_module("services.webhook_ingest")
+    replay = importlib.import_module("services.webhook_replay")
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    monkeypatch.setattr(dispatcher.Config, "CIRCUIT_BREAKER_ENABLED", False)
+    monkeypatch.setattr(replay.Config, "REPLAY_RATE_PER_STORE", 0)
+    monkeypatch.setattr(replay.Config, "REPLAY_BATCH_SIZE", 1)
+    posted = []
+    monkeypatch.setattr(dispatcher.outbound_http, "post", lambda url, data=None, headers=None, timeout=None: posted.append(data) or SimpleNamespace(status_code=200))
+    while dispatcher.process_due_dispatches():
+        pass
+    db = app_module.SessionLocal()
+    try:
+        u = app_module.User(email="replay@example.com", password_hash="x")
+        db.add(u)
+        db.commit()
+        db.add(app_module.StripeAccount(user_id=u.id, account_id="acct_replay", store_domain="https://loja.com"))
+        db.commit()
+    finally:
+        db.close()
+    created = int(datetime.utcnow().timestamp())
+    for i in range(2):
+        ingest.ingest_event({"id": f"evt_replay_{i}", "type": "checkout.session.completed", "account": "acct_replay", "created": created,
+                             "data": {"object": {"status": "complete", "metadata": {"orderId": f"ord_replay_{i}"}}}})
+    ingest.ingest_event({"id": "evt_replay_open", "type": "checkout.session.completed", "account": "acct_replay", "created": created,
+                         "data": {"object": {"status": "open", "metadata": {"orderId": "ord_open"}}}})
+    assert dispatcher.process_due_dispatches() == 2
+    posted.clear()
+    since = datetime.utcnow() - timedelta(hours=1)
+    dry = replay.create_job(since, account_id="acct_replay", dry_run=True)
+    replay.run_job(dry)
+    assert replay.job_status(dry)["matched"] == 2 and posted == []
+    job_id = replay.create_job(since, account_id="acct_replay")
+    replay.run_job(job_id)
+    status = replay.job_status(job_id)
+    assert status["state"] == "done"
+    assert (status["matched"], status["delivered"], status["pending"], status["skipped"]) == (2, 2, 0, 0)
+    assert len(posted) == 2
+    other = replay.create_job(since, account_id="acct_other")
+    replay.run_job(other)
+    assert replay.job_status(other)["matched"] == 0
+
+@pytest.fixture()
+def replay_env(app_module, monkeypatch):
+    dispatcher = importlib.import_module("services.store_dispatch")
+    replay = importlib.import_module("services.webhook_replay")
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    monkeypatch.setattr(dispatcher.Config, "CIRCUIT_BREAKER_ENABLED", False)
+    monkeypatch.setattr(replay.Config, "REPLAY_RATE_PER_STORE", 0)
+    posted = []
+    monkeypatch.setattr(dispatcher.outbound_http, "post", lambda url, data=None, headers=None, timeout=None: posted.append(data) or SimpleNamespace(status_code=200))
+    return replay, posted
+
+def _store(app_module, email, account_id, batch=False):
+    db = app_module.SessionLocal()
+    try:
+        u = app_module.User(email=email, password_hash="x")
+        db.add(u)
+        db.commit()
+        db.add(app_module.StripeAccount(user_id=u.id, account_id=account_id, store_domain="https://loja.com", dispatch_batch_enabled=batch))
+        db.commit()
+    finally:
+        db.close()
+
+def _log_event(app_module, event_id, account_id, order_id):
+    ingest = importlib.import_module("services.webhook_ingest")
+    db = app_module.SessionLocal()
+    try:
+        event = {"id": event_id, "type": "checkout.session.completed", "account": account_id, "created": int(datetime.utcnow().timestamp()),
+                 "data": {"object": {"status": "complete", "metadata": {"orderId": order_id}}}}
+        db.add(app_module.WebhookLog(event_id=event_id, event_type=event["type"], **ingest.log_columns(event), **ingest.payload_codec.encode(ingest.json.dumps(event))))
+        db.commit()
+    finally:
+        db.close()
+
+@pytest.mark.unit
+def test_replay_does_not_reset_leased_dispatch(replay_env, app_module):
+    replay, posted = replay_env
+    _store(app_module, "replay-lease@example.com", "acct_replay_lease")
+    _log_event(app_module, "evt_replay_lease", "acct_replay_lease", "ord_replay_lease")
+    leased_until = datetime.utcnow() + timedelta(minutes=5)
+    db = app_module.SessionLocal()
+    try:
+        db.add(app_module.StoreDispatch(event_id="evt_replay_lease", account_id="acct_replay_lease", order_id="ord_replay_lease",
+                                        status="paid", attempts=2, state="pending", next_attempt_at=leased_until))
+        db.commit()
+    finally:
+        db.close()
+    job_id = replay.create_job(datetime.utcnow() - timedelta(hours=1), account_id="acct_replay_lease")
+    replay.run_job(job_id)
+    status = replay.job_status(job_id)
+    assert (status["matched"], status["delivered"], status["pending"]) == (1, 0, 1)
+    assert posted == []
+    db = app_module.SessionLocal()
+    try:
+        d = db.query(app_module.StoreDispatch).filter_by(event_id="evt_replay_lease").first()
+        assert (d.attempts, d.next_attempt_at) == (2, leased_until)
+    finally:
+        db.close()
+
+@pytest.mark.unit
+def test_replay_uses_batch_payload_for_batch_stores(replay_env, app_module):
+    replay, posted = replay_env
+    _store(app_module, "replay-batch@example.com", "acct_replay_batch", batch=True)
+    for i in range(3):
+        _log_event(app_module, f"evt_replay_batch_{i}", "acct_replay_batch", f"ord_replay_batch_{i}")
+    job_id = replay.create_job(datetime.utcnow() - timedelta(hours=1), account_id="acct_replay_batch")
+    replay.run_job(job_id)
+    status = replay.job_status(job_id)
+    assert (status["matched"], status["delivered"], status["pending"]) == (3, 3, 0)
+    assert len(posted) == 1
+    assert [o["orderId"] for o in replay.json.loads(posted[0])["orders"]] == [f"ord_replay_batch_{i}" for i in range(3)]
+
+@pytest.mark.unit
+def test_interrupted_replay_job_is_marked_failed(replay_env, app_module):
+    replay, _ = replay_env
+    job_id = replay.create_job(datetime.utcnow() - timedelta(hours=1))
+    db = app_module.SessionLocal()
+    try:
+        job = db.get(replay.ReplayJob, job_id)
+        job.state = "running"
+        job.started_at = job.updated_at = datetime.utcnow() - timedelta(minutes=replay.Config.REPLAY_STALE_MINUTES + 1)
+        db.commit()
+    finally:
+        db.close()
+    status = replay.job_status(job_id)
+    assert (status["state"], status["message"]) == ("failed", "interrupted")
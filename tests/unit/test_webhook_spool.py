@@ -0,0 +1,52 @@
+import importlib
+import json
+import os
+import pytest
+
+@pytest.fixture()
+def spool(app_module, tmp_path, monkeypatch):
+    mod = importlib.import_module("services.webhook_spool")
+    for cfg in (mod.Config, app_module.Config):
+        monkeypatch.setattr(cfg, "WEBHOOK_SPOOL_ENABLED", True)
+        monkeypatch.setattr(cfg, "WEBHOOK_SPOOL_DIR", str(tmp_path / "spool"))
+        monkeypatch.setattr(cfg, "WEBHOOK_SPOOL_FSYNC", "never")
+    monkeypatch.setattr(mod, "_writer", None)
+    importlib.import_module("core.event_cache").seen_events.clear()
+    yield mod
+    mod.seal_active()
+
+@pytest.mark.unit
+def test_webhook_spooled_then_replayed(app_module, client, spool):
+    evt = {"id": "evt_spool_1", "type": "checkout.session.completed", "data": {"object": {"status": "open"}}}
+    app_module.verify_webhook = lambda payload, sig, sec: evt
+    r = client.post("/webhook", data=json.dumps(evt, indent=2).encode())
+    assert r.get_json()["status"] == "accepted"
+    db = app_module.SessionLocal()
+    try:
+        assert db.query(app_module.WebhookLog).filter_by(event_id="evt_spool_1").count() == 0
+    finally:
+        db.close()
+    assert spool.backlog()["pendingBytes"] > 0
+    assert spool.consume_once() == 1
+    assert spool.consume_once() == 0
+    db = app_module.SessionLocal()
+    try:
+        assert db.query(app_module.WebhookLog).filter_by(event_id="evt_spool_1").count() == 1
+    finally:
+        db.close()
+
+@pytest.mark.unit
+def test_spool_partial_record_and_rotation(app_module, spool, monkeypatch):
+    calls = []
+    monkeypatch.setattr(spool, "_replay", lambda body, logger: calls.append(json.loads(body)["id"]))
+    monkeypatch.setattr(spool.Config, "WEBHOOK_SPOOL_SEGMENT_BYTES", 1)
+    spool.append(b'{"id":"evt_a"}')
+    spool.append(b'{"id":"evt_b"}')
+    seg = spool._writer.name
+    os.write(spool._writer.fd, b"20\n{\"id\":")
+    assert spool.consume_once() == 2
+    assert calls == ["evt_a", "evt_b"]
+    names = os.listdir(spool.Config.WEBHOOK_SPOOL_DIR)
+    assert not any(n.endswith(".seg") for n in names)
+    assert os.path.basename(seg) in names
+    assert spool.backlog()["pendingBytes"] == len(b"20\n{\"id\":")
@@ -0,0 +1,267 @@
+import importlib
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+
+def _page(events, has_more=False):
+    body = json.dumps({"object": "list", "data": events, "has_more": has_more, "url": "/v1/events"}, indent=2)
+    return SimpleNamespace(body=body, data=json.loads(body))
+
+@pytest.fixture()
+def sync(app_module, monkeypatch):
+    mod = importlib.import_module("services.webhook_sync")
+    monkeypatch.setattr(mod.Config, "WEBHOOK_SYNC_ENABLED", True)
+    monkeypatch.setattr(mod.Config, "WEBHOOK_SYNC_OVERLAP_SECONDS", 60)
+    db = app_module.SessionLocal()
+    try:
+        if not db.query(app_module.StripeAccount).filter_by(account_id="acct_sync_1").first():
+            u = app_module.User(email="sync@example.com", password_hash="x")
+            db.add(u)
+            db.commit()
+            db.add(app_module.StripeAccount(user_id=u.id, account_id="acct_sync_1"))
+            db.add(app_module.StripeAccount(user_id=u.id, account_id="acct_sync_2"))
+            db.commit()
+    finally:
+        db.close()
+    return mod
+
+@pytest.mark.unit
+def test_sync_resumes_from_checkpoint_with_overlap(sync, monkeypatch):
+    calls = []
+    pages = [
+        [{"id": "evt_s2", "type": "payment_intent.succeeded", "created": 1760000200, "data": {"object": {"status": "requires_action"}}},
+         {"id": "evt_s1", "type": "payment_intent.succeeded", "created": 1760000100, "data": {"object": {"status": "requires_action"}}}],
+        [],
+    ]
+    def fake_list(**params):
+        if params.get("stripe_account") != "acct_sync_1":
+            return _page([])
+        calls.append(params)
+        return _page(pages[len(calls) - 1])
+    monkeypatch.setattr(sync, "_list_events", fake_list)
+    sync.run_sync_once(force=True)
+    assert abs(calls[0]["created"]["gte"] - sync._now_ts_minus(sync.Config.WEBHOOK_SYNC_LOOKBACK_MINUTES)) < 5
+    sync.run_sync_once(force=True)
+    assert calls[1]["created"]["gte"] == 1760000200 - 60
+
+
+@pytest.mark.unit
+def test_sync_isolates_account_failures_and_records_run(sync, app_module, monkeypatch):
+    def fake_list(**params):
+        if params.get("stripe_account") == "acct_sync_2":
+            raise RuntimeError("stripe down")
+        return _page([])
+    monkeypatch.setattr(sync, "_list_events", fake_list)
+    monkeypatch.setattr(sync.Config, "WEBHOOK_SYNC_CONCURRENCY", 3)
+    run_id = sync.run_sync_once(force=True)
+    db = app_module.SessionLocal()
+    try:
+        run = db.get(sync.WebhookSyncRun, run_id)
+        logs = {l.account_id: l for l in db.query(sync.WebhookSyncLog).filter_by(run_id=run_id).all()}
+        total = db.query(app_module.StripeAccount).count()
+    finally:
+        db.close()
+    assert run.finished_at is not None and run.duration_ms is not None
+    assert run.accounts_total == total
+    assert run.accounts_failed == 1
+    assert run.accounts_processed == total - 1
+    assert logs["acct_sync_2"].message == "stripe down"
+    assert logs["acct_sync_1"].finished_at is not None and logs["acct_sync_1"].message is None
+
+@pytest.mark.unit
+def test_request_budget_spaces_calls(sync, monkeypatch):
+    budget = sync._RequestBudget(10, burst=1)
+    slept = []
+    monkeypatch.setattr(sync.time, "sleep", lambda s: (slept.append(s), budget.__dict__.update(_tokens=1)))
+    budget.acquire()
+    budget.acquire()
+    assert slept and 0 < slept[0] <= 0.1
+
+@pytest.mark.unit
+def test_sync_page_is_processed_as_a_batch(sync, app_module, monkeypatch):
+    from sqlalchemy import event
+    dispatcher = importlib.import_module("services.store_dispatch")
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    sync.seen_events.clear()
+    db = app_module.SessionLocal()
+    try:
+        acc = db.query(app_module.StripeAccount).filter_by(account_id="acct_sync_1").first()
+        acc.store_domain = "https://loja-sync.example.com"
+        db.add(sync.OrderCorrelation(order_id="ord_pg_2", account_id="acct_sync_1", created_at=datetime.utcnow()))
+        db.add(app_module.WebhookEvent(event_id="evt_pg_3"))
+        db.add(app_module.StoreDispatch(event_id="evt_pg_3", account_id="acct_sync_1", order_id="ord_pg_3", status="paid", attempts=0, state="delivered"))
+        db.commit()
+    finally:
+        db.close()
+    paid = {"status": "succeeded"}
+    items = [
+        ({"id": "evt_pg_1", "type": "payment_intent.succeeded", "account": "acct_sync_1", "created": 1760000001,
+          "data": {"object": {**paid, "metadata": {"orderId": "ord_pg_1"}}}}, '{"id":"evt_pg_1"}'),
+        ({"id": "evt_pg_2", "type": "payment_intent.succeeded", "created": 1760000002,
+          "data": {"object": {**paid, "metadata": {"orderId": "ord_pg_2"}}}}, '{"id":"evt_pg_2"}'),
+        ({"id": "evt_pg_3", "type": "payment_intent.succeeded", "account": "acct_sync_1", "created": 1760000003,
+          "data": {"object": {**paid, "metadata": {"orderId": "ord_pg_3"}}}}, '{"id":"evt_pg_3"}'),
+        ({"id": "evt_pg_4", "type": "payment_intent.succeeded", "created": 1760000004,
+          "data": {"object": {"status": "requires_action"}}}, '{"id":"evt_pg_4"}'),
+    ]
+    statements = []
+    engine = sync.SessionLocal.kw["bind"]
+    listener = lambda *a: statements.append(a[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        rec, ign, fail, _ = sync._process_page(items, sync.structlog.get_logger())
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert (rec, ign, fail) == (2, 2, 0)
+    # eventos, outbox, correlações e contas: uma consulta cada, independente do tamanho da página
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 4
+    db = app_module.SessionLocal()
+    try:
+        assert {d.event_id for d in db.query(app_module.StoreDispatch).filter(app_module.StoreDispatch.event_id.in_(["evt_pg_1", "evt_pg_2"]))} == {"evt_pg_1", "evt_pg_2"}
+        log = db.query(app_module.WebhookLog).filter_by(event_id="evt_pg_2").first()
+        assert log.payload_source == "sync_api"
+    finally:
+        db.close()
+    assert sync.seen_events.get("evt_pg_1") is True
+
+@pytest.mark.unit
+def test_interrupted_sync_resumes_from_page_cursor(sync, app_module, monkeypatch):
+    db = app_module.SessionLocal()
+    try:
+        db.query(sync.SyncCheckpoint).filter_by(account_id="acct_sync_1").delete()
+        db.commit()
+    finally:
+        db.close()
+    def ev(i, created):
+        return {"id": f"evt_rs_{i}", "type": "payment_intent.succeeded", "created": created, "data": {"object": {"status": "requires_action"}}}
+    calls = []
+    state = {"fail": True}
+    def fake_list(**params):
+        if params.get("stripe_account") != "acct_sync_1":
+            return _page([])
+        calls.append(params)
+        if "starting_after" not in params:
+            return _page([ev(3, 1770000300), ev(2, 1770000200)], has_more=True)
+        if state["fail"]:
+            raise RuntimeError("worker restarted")
+        return _page([ev(1, 1770000100)])
+    monkeypatch.setattr(sync, "_list_events", fake_list)
+    sync.run_sync_once(force=True)
+    db = app_module.SessionLocal()
+    try:
+        cp = db.query(sync.SyncCheckpoint).filter_by(account_id="acct_sync_1").first()
+        assert cp.page_cursor == "evt_rs_2"
+        assert cp.pending_created == 1770000300
+        gte = cp.window_gte
+    finally:
+        db.close()
+    state["fail"] = False
+    calls.clear()
+    sync.run_sync_once(force=True)
+    assert calls == [{**calls[0], "starting_after": "evt_rs_2", "created": {"gte": gte}}]
+    db = app_module.SessionLocal()
+    try:
+        cp = db.query(sync.SyncCheckpoint).filter_by(account_id="acct_sync_1").first()
+        assert cp.page_cursor is None and cp.window_gte is None
+        assert (cp.last_event_created, cp.last_event_id) == (1770000300, "evt_rs_3")
+    finally:
+        db.close()
+
+@pytest.mark.unit
+def test_stale_unfinished_sync_logs_are_closed(sync, app_module):
+    db = app_module.SessionLocal()
+    try:
+        old = sync.WebhookSyncLog(account_id="acct_sync_1", started_at=datetime.utcnow() - timedelta(hours=5))
+        fresh = sync.WebhookSyncLog(account_id="acct_sync_1", started_at=datetime.utcnow())
+        db.add_all([old, fresh])
+        db.commit()
+        old_id, fresh_id = old.id, fresh.id
+    finally:
+        db.close()
+    assert sync.close_stale_logs() >= 1
+    db = app_module.SessionLocal()
+    try:
+        old = db.get(sync.WebhookSyncLog, old_id)
+        assert old.finished_at is not None and old.message == "interrupted"
+        assert db.get(sync.WebhookSyncLog, fresh_id).finished_at is None
+    finally:
+        db.close()
+
+@pytest.mark.unit
+def test_sync_interval_adapts_to_recovered_events(sync, app_module, monkeypatch):
+    monkeypatch.setattr(sync.Config, "WEBHOOK_SYNC_MIN_INTERVAL_MINUTES", 5)
+    monkeypatch.setattr(sync.Config, "WEBHOOK_SYNC_INTERVAL_MINUTES", 15)
+    monkeypatch.setattr(sync.Config, "WEBHOOK_SYNC_MAX_INTERVAL_MINUTES", 40)
+    clean = SimpleNamespace(recovered_events=0, failed_notifications=0)
+    lossy = SimpleNamespace(recovered_events=2, failed_notifications=0)
+    assert sync._next_interval(None, clean, False) == 15 * 60
+    assert sync._next_interval(15 * 60, clean, False) == 30 * 60
+    assert sync._next_interval(30 * 60, clean, False) == 40 * 60
+    assert sync._next_interval(40 * 60, lossy, False) == 5 * 60
+    assert sync._next_interval(40 * 60, clean, True) == 5 * 60
+    # loja sem domínio/segredo: falha permanente também espaça as consultas
+    misconfigured = SimpleNamespace(recovered_events=0, failed_notifications=3)
+    assert sync._next_interval(15 * 60, misconfigured, False) == 30 * 60
+
+@pytest.mark.unit
+def test_sync_skips_accounts_not_yet_due(sync, app_module, monkeypatch):
+    synced = []
+    monkeypatch.setattr(sync, "_list_events", lambda **params: synced.append(params["stripe_account"]) or _page([]))
+    sync.run_sync_once(force=True)
+    db = app_module.SessionLocal()
+    try:
+        cp = db.query(sync.SyncCheckpoint).filter_by(account_id="acct_sync_1").first()
+        assert cp.next_sync_at > datetime.utcnow()
+        assert cp.interval_seconds >= sync.Config.WEBHOOK_SYNC_MIN_INTERVAL_MINUTES * 60
+        cp.next_sync_at = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+    finally:
+        db.close()
+    synced.clear()
+    sync.run_sync_once()
+    assert "acct_sync_1" in synced and "acct_sync_2" not in synced
+
+@pytest.mark.unit
+def test_failed_event_is_retried_on_next_run(sync, app_module, monkeypatch):
+    dispatcher = importlib.import_module("services.store_dispatch")
+    monkeypatch.setattr(dispatcher.Config, "PAYMENTS_EVENTS_SECRET", "secret123")
+    sync.seen_events.clear()
+    db = app_module.SessionLocal()
+    try:
+        db.query(sync.SyncCheckpoint).filter_by(account_id="acct_sync_2").delete()
+        db.query(app_module.StripeAccount).filter_by(account_id="acct_sync_2").first().store_domain = None
+        db.commit()
+    finally:
+        db.close()
+    now = int(datetime.utcnow().timestamp())
+    failing = {"id": "evt_retry_1", "type": "payment_intent.succeeded", "account": "acct_sync_2", "created": now - 30,
+               "data": {"object": {"status": "succeeded", "metadata": {"orderId": "ord_retry_1"}}}}
+    later = {"id": "evt_retry_2", "type": "payment_intent.succeeded", "created": now - 10, "data": {"object": {"status": "requires_action"}}}
+    calls = []
+    def fake_list(**params):
+        if params.get("stripe_account") != "acct_sync_2":
+            return _page([])
+        calls.append(params)
+        return _page([later, failing])
+    monkeypatch.setattr(sync, "_list_events", fake_list)
+    sync.run_sync_once(force=True)
+    db = app_module.SessionLocal()
+    try:
+        # sem loja configurada: falha, e o checkpoint para antes do evento
+        assert db.query(sync.SyncCheckpoint).filter_by(account_id="acct_sync_2").first().last_event_created == now - 31
+        assert not db.query(sync.StoreDispatch).filter_by(event_id="evt_retry_1").first()
+        db.query(app_module.StripeAccount).filter_by(account_id="acct_sync_2").first().store_domain = "https://loja-retry.example.com"
+        db.commit()
+    finally:
+        db.close()
+    sync.run_sync_once(force=True)
+    assert calls[1]["created"]["gte"] <= now - 30
+    db = app_module.SessionLocal()
+    try:
+        assert db.query(sync.StoreDispatch).filter_by(event_id="evt_retry_1").first()
+        assert db.query(sync.SyncCheckpoint).filter_by(account_id="acct_sync_2").first().last_event_created == now - 10
+        db.query(app_module.StripeAccount).filter_by(account_id="acct_sync_2").first().store_domain = None
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,92 @@
+import importlib
+from datetime import datetime, timedelta
+import pytest
+
+@pytest.fixture()
+def lease(app_module):
+    return importlib.import_module("services.worker_lease")
+
+@pytest.mark.unit
+def test_lease_is_exclusive_and_renewable(lease):
+    assert lease.acquire("t_exclusive", ttl=60, holder="node-a")
+    assert not lease.acquire("t_exclusive", ttl=60, holder="node-b")
+    assert lease.acquire("t_exclusive", ttl=60, holder="node-a")
+    assert lease.current("t_exclusive")["holder"] == "node-a"
+
+@pytest.mark.unit
+def test_lease_fails_over_after_expiry_and_release(lease):
+    assert lease.acquire("t_failover", ttl=60, holder="node-a")
+    db = lease.SessionLocal()
+    try:
+        row = db.query(lease.WorkerLease).filter_by(name="t_failover").first()
+        row.expires_at = datetime.utcnow() - timedelta(seconds=1)
+        db.commit()
+    finally:
+        db.close()
+    assert lease.current("t_failover") is None
+    assert lease.acquire("t_failover", ttl=60, holder="node-b")
+    assert not lease.acquire("t_failover", ttl=60, holder="node-a")
+    lease.release("t_failover", holder="node-b")
+    assert lease.acquire("t_failover", ttl=60, holder="node-a")
+
+@pytest.mark.unit
+def test_only_lease_holder_runs_sync_cycle(lease, monkeypatch):
+    sync = importlib.import_module("services.webhook_sync")
+    runs = []
+    monkeypatch.setattr(sync, "run_sync_once", lambda force=False, stop=None: runs.append(force) or 1)
+    monkeypatch.setattr(sync, "_cycle_due", lambda: True)
+    monkeypatch.setattr(sync, "SYNC_LEASE", "t_sync_leader")
+    monkeypatch.setattr(lease, "HOLDER", "node-a")
+    assert sync.run_if_leader() == 1
+    monkeypatch.setattr(lease, "HOLDER", "node-b")
+    assert sync.run_if_leader() is None
+    assert runs == [False]
+
+@pytest.mark.unit
+def test_heartbeat_signals_lost_lease(lease, monkeypatch):
+    monkeypatch.setattr(lease, "HOLDER", "node-a")
+    assert lease.acquire("t_heartbeat", ttl=60)
+    with lease.heartbeat("t_heartbeat", ttl=1) as lost:
+        db = lease.SessionLocal()
+        try:
+            row = db.query(lease.WorkerLease).filter_by(name="t_heartbeat").first()
+            row.holder = "node-b"
+            row.expires_at = datetime.utcnow() + timedelta(seconds=60)
+            db.commit()
+        finally:
+            db.close()
+        assert lost.wait(3)
+
+@pytest.mark.unit
+def test_sync_stops_when_lease_is_lost(lease, app_module, monkeypatch):
+    sync = importlib.import_module("services.webhook_sync")
+    monkeypatch.setattr(sync.Config, "WEBHOOK_SYNC_ENABLED", True)
+    processed = []
+    monkeypatch.setattr(sync, "_process_page", lambda items, logger: processed.append(items) or (0, 0, 0, None))
+    stop = lease.threading.Event()
+
+    def pages(account_id, params, budget=None, starting_after=None):
+        yield [({"id": "evt_lease_1", "created": 1760000000}, "{}")]
+        stop.set()
+        yield [({"id": "evt_lease_2", "created": 1760000001}, "{}")]
+    monkeypatch.setattr(sync, "_iter_pages", pages)
+    logger = sync.structlog.get_logger()
+    assert sync._sync_account("acct_lease_1", None, None, logger, stop)[3] is True
+    assert len(processed) == 1
+    assert sync._sync_account("acct_lease_2", None, None, logger, stop) is None
+
+@pytest.mark.unit
+def test_manual_sync_respects_lease(lease, app_module, client, monkeypatch):
+    sync = importlib.import_module("services.webhook_sync")
+    runs = []
+    monkeypatch.setattr(sync, "run_sync_once", lambda force=False, stop=None: runs.append(force) or 7)
+    monkeypatch.setattr(sync, "SYNC_LEASE", "t_manual_sync")
+    monkeypatch.setattr(lease, "HOLDER", "node-b")
+    assert lease.acquire("t_manual_sync", ttl=60, holder="node-a")
+    res = client.post("/internal/sync/stripe-events")
+    assert res.get_json()["status"] == "sync_scheduled"
+    assert runs == []
+    lease.release("t_manual_sync", holder="node-a")
+    res = client.post("/internal/sync/stripe-events")
+    assert res.get_json() == {"status": "sync_started", "runId": 7}
+    assert runs == [True]
@@ -1,4 +1,12 @@
 from server import app
+from services.store_dispatch import start_dispatch_workers
+from services.webhook_spool import start_spool_consumer
+from services.webhook_sync import start_worker
+
+start_dispatch_workers()
+start_spool_consumer()
+# seguro em todos os workers: só o detentor do lease em worker_leases executa o ciclo
+start_worker()
 
 if __name__ == "__main__":
-    app.run()
\ No newline at end of file
+    app.run()